@@ -0,0 +1,23 @@
+"""add pipeline checkpoints to generations
+
+Revision ID: 0005_generation_checkpoints
+Revises: 0004_add_frame_accepted
+Create Date: 2025-08-22
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0005_generation_checkpoints'
+down_revision = '0004_add_frame_accepted'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    op.add_column('generations', sa.Column('stage', sa.String(length=32), nullable=True))
+    op.add_column('generations', sa.Column('checkpoint', sa.JSON(), nullable=True))
+    op.add_column('generations', sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now(), nullable=True))
+
+def downgrade() -> None:
+    op.drop_column('generations', 'updated_at')
+    op.drop_column('generations', 'checkpoint')
+    op.drop_column('generations', 'stage')
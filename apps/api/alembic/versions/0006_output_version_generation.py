@@ -0,0 +1,23 @@
+"""link frame output versions to generations
+
+Revision ID: 0006_output_version_generation
+Revises: 0005_generation_checkpoints
+Create Date: 2025-08-25
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0006_output_version_generation'
+down_revision = '0005_generation_checkpoints'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    op.add_column('frame_output_versions', sa.Column('generation_id', sa.Integer(), nullable=True))
+    op.create_foreign_key('fk_frame_output_versions_generation_id', 'frame_output_versions', 'generations', ['generation_id'], ['id'])
+    op.create_unique_constraint('uq_frame_output_versions_generation_id', 'frame_output_versions', ['generation_id'])
+
+def downgrade() -> None:
+    op.drop_constraint('uq_frame_output_versions_generation_id', 'frame_output_versions', type_='unique')
+    op.drop_constraint('fk_frame_output_versions_generation_id', 'frame_output_versions', type_='foreignkey')
+    op.drop_column('frame_output_versions', 'generation_id')
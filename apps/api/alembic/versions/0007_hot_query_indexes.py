@@ -0,0 +1,34 @@
+"""indexes for hot store/dashboard queries
+
+Revision ID: 0007_hot_query_indexes
+Revises: 0006_output_version_generation
+Create Date: 2025-08-27
+"""
+from alembic import op
+
+revision = '0007_hot_query_indexes'
+down_revision = '0006_output_version_generation'
+branch_labels = None
+depends_on = None
+
+# (name, table, columns); ix_frames_sku_id / ix_generations_frame_id есть с 0001,
+# но БД, поднятые через create_all, могли остаться без них — отсюда if_not_exists
+INDEXES = [
+    ('ix_frames_sku_id', 'frames', ['sku_id']),
+    ('ix_frames_status', 'frames', ['status']),
+    ('ix_generations_frame_id', 'generations', ['frame_id']),
+    ('ix_generations_replicate_prediction_id', 'generations', ['replicate_prediction_id']),
+    ('ix_generations_status_updated_at', 'generations', ['status', 'updated_at']),
+    ('ix_skus_created_at', 'skus', ['created_at']),
+    ('ix_skus_brand_created_at', 'skus', ['brand', 'created_at']),
+]
+
+def upgrade() -> None:
+    for name, table, cols in INDEXES:
+        op.create_index(name, table, cols, if_not_exists=True)
+
+def downgrade() -> None:
+    for name, table, _ in reversed(INDEXES):
+        if name in ('ix_frames_sku_id', 'ix_generations_frame_id'):
+            continue  # созданы в 0001
+        op.drop_index(name, table_name=table, if_exists=True)
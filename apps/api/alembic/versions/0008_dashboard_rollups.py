@@ -0,0 +1,40 @@
+"""dashboard rollup tables (sku_frame_stats, daily_frame_stats)
+
+Revision ID: 0008_dashboard_rollups
+Revises: 0007_hot_query_indexes
+Create Date: 2025-08-29
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0008_dashboard_rollups'
+down_revision = '0007_hot_query_indexes'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    op.create_table('sku_frame_stats',
+        sa.Column('sku_id', sa.Integer(), sa.ForeignKey('skus.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('frames_total', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('frames_done', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('frames_failed', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now()),
+    )
+    op.create_index('ix_sku_frame_stats_day', 'sku_frame_stats', ['day'])
+    op.create_table('daily_frame_stats',
+        sa.Column('day', sa.Date(), primary_key=True),
+        sa.Column('skus_total', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('skus_done', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('skus_failed', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('frames_total', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('frames_done', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('frames_failed', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now()),
+    )
+    # первичное заполнение — `python -m app.rollups` (или автоматически на старте API)
+
+def downgrade() -> None:
+    op.drop_table('daily_frame_stats')
+    op.drop_index('ix_sku_frame_stats_day', table_name='sku_frame_stats')
+    op.drop_table('sku_frame_stats')
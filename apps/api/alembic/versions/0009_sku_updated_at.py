@@ -0,0 +1,19 @@
+"""add updated_at to skus (delta sync cursor)
+
+Revision ID: 0009_sku_updated_at
+Revises: 0008_dashboard_rollups
+Create Date: 2025-09-01
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0009_sku_updated_at'
+down_revision = '0008_dashboard_rollups'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    op.add_column('skus', sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now(), nullable=True))
+
+def downgrade() -> None:
+    op.drop_column('skus', 'updated_at')
@@ -0,0 +1,27 @@
+"""add image metadata columns to frames (header-only extraction at submit)
+
+Revision ID: 0010_frame_image_meta
+Revises: 0009_sku_updated_at
+Create Date: 2025-09-08
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0010_frame_image_meta'
+down_revision = '0009_sku_updated_at'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    op.add_column('frames', sa.Column('width', sa.Integer(), nullable=True))
+    op.add_column('frames', sa.Column('height', sa.Integer(), nullable=True))
+    op.add_column('frames', sa.Column('orientation', sa.Integer(), nullable=True))
+    op.add_column('frames', sa.Column('image_format', sa.String(length=16), nullable=True))
+    op.add_column('frames', sa.Column('byte_size', sa.BigInteger(), nullable=True))
+    op.add_column('frames', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.create_index('ix_frames_content_hash', 'frames', ['content_hash'])
+
+def downgrade() -> None:
+    op.drop_index('ix_frames_content_hash', table_name='frames')
+    for col in ('content_hash', 'byte_size', 'image_format', 'orientation', 'height', 'width'):
+        op.drop_column('frames', col)
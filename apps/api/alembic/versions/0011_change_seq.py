@@ -0,0 +1,21 @@
+"""add change_seq counters to skus and daily_frame_stats (ETag stamps)
+
+Revision ID: 0011_change_seq
+Revises: 0010_frame_image_meta
+Create Date: 2025-09-15
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0011_change_seq'
+down_revision = '0010_frame_image_meta'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    op.add_column('skus', sa.Column('change_seq', sa.BigInteger(), server_default='0', nullable=False))
+    op.add_column('daily_frame_stats', sa.Column('change_seq', sa.BigInteger(), server_default='0', nullable=False))
+
+def downgrade() -> None:
+    op.drop_column('daily_frame_stats', 'change_seq')
+    op.drop_column('skus', 'change_seq')
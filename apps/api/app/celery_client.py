@@ -1,14 +1,88 @@
 import os
+import redis
 from celery import Celery
+from .database import after_commit, on_rollback
 
 # API тоже должно знать адрес брокера, чтобы публиковать задачи
 REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+# должен совпадать с FRAME_QUEUED_TTL_SEC воркера
+FRAME_QUEUED_TTL_SEC = int(os.environ.get("FRAME_QUEUED_TTL_SEC", "600"))
 
 celery = Celery(broker=REDIS_URL, backend=REDIS_URL)
+_redis = redis.Redis.from_url(REDIS_URL)
 
 def queue_process_sku(sku_id: int):
     # имя задачи = то, что объявлено в воркере @celery.task(name="worker.process_sku")
-    return celery.send_task("worker.process_sku", args=[sku_id])
+    # публикуем после commit транзакции запроса — воркер сразу читает кадры SKU
+    after_commit(lambda: celery.send_task("worker.process_sku", args=[sku_id]))
+
+# пакетная постановка: задачи уходят кусками через одно соединение с брокером
+ENQUEUE_CHUNK_SIZE = int(os.environ.get("ENQUEUE_CHUNK_SIZE", "100"))
+
+def queue_process_skus(sku_ids: list):
+    """Как queue_process_sku для многих SKU (пакетный сабмит): после commit, кусками
+    по ENQUEUE_CHUNK_SIZE, каждый кусок — через один producer."""
+    ids = [int(s) for s in sku_ids]
+
+    def _send():
+        for i in range(0, len(ids), ENQUEUE_CHUNK_SIZE):
+            with celery.producer_or_acquire() as producer:
+                for sid in ids[i:i + ENQUEUE_CHUNK_SIZE]:
+                    celery.send_task("worker.process_sku", args=[sid], producer=producer)
+
+    after_commit(_send)
 
 def queue_process_frame(frame_id: int):
-    return celery.send_task("worker.process_frame", args=[frame_id])
+    """Поставить кадр в очередь. Если задача по кадру уже ждёт в очереди — не дублируем:
+    она сама прочитает последние pending_params. Если кадр сейчас в работе, воркер
+    схлопнет все такие запросы в один последующий прогон (см. worker.process_frame).
+    Задача публикуется после commit транзакции запроса (иначе воркер может прочитать
+    старые pending_params). Возвращает None, если запрос схлопнут, иначе True."""
+    marker = f"fc:frame:{int(frame_id)}:queued"
+    if not _redis.set(marker, "1", nx=True, ex=FRAME_QUEUED_TTL_SEC):
+        return None
+
+    def _send():
+        try:
+            celery.send_task("worker.process_frame", args=[frame_id])
+        except Exception:
+            _redis.delete(marker)  # не блокируем следующие redo на весь TTL
+            raise
+
+    after_commit(_send)
+    # откат транзакции запроса — задача не уйдёт, маркер не должен схлопывать следующие redo
+    on_rollback(lambda: _redis.delete(marker))
+    return True
+
+def queue_export(job_id: str, artifact_key: str, manifest: list):
+    """Сборка ZIP-экспорта в S3 (worker.build_export) — в отдельной очереди "exports",
+    чтобы длинные экспорты не задерживали генерации. Статус — app/exports.py."""
+    celery.send_task("worker.build_export", args=[job_id, artifact_key, manifest], queue="exports")
+
+def queue_build_preview(frame_id: int, original_key: str, target_key: str):
+    """Превью оригинала для маск-пейнтера (worker.build_preview); single-flight — app/previews.py.
+    Отдельная очередь "previews": пачка превью не встаёт перед генерациями."""
+    celery.send_task("worker.build_preview", args=[int(frame_id), original_key, target_key], queue="previews")
+
+def queue_build_previews(items: list):
+    """Много превью [(frame_id, original_key, target_key)] — кусками через один producer."""
+    for i in range(0, len(items), ENQUEUE_CHUNK_SIZE):
+        with celery.producer_or_acquire() as producer:
+            for fid, original_key, target_key in items[i:i + ENQUEUE_CHUNK_SIZE]:
+                celery.send_task(
+                    "worker.build_preview", args=[int(fid), original_key, target_key],
+                    queue="previews", producer=producer,
+                )
+
+# кадров на одну задачу worker.extract_frame_meta
+FRAME_META_TASK_SIZE = int(os.environ.get("FRAME_META_TASK_SIZE", "200"))
+
+def queue_extract_frame_meta(items: list):
+    """Метаданные оригиналов [(frame_id, original_key)] для большой пачки (app/frame_meta.py):
+    задачи по FRAME_META_TASK_SIZE кадров в очередь "meta", кусками через один producer."""
+    chunks = [[[int(fid), key] for fid, key in items[i:i + FRAME_META_TASK_SIZE]]
+              for i in range(0, len(items), FRAME_META_TASK_SIZE)]
+    for i in range(0, len(chunks), ENQUEUE_CHUNK_SIZE):
+        with celery.producer_or_acquire() as producer:
+            for chunk in chunks[i:i + ENQUEUE_CHUNK_SIZE]:
+                celery.send_task("worker.extract_frame_meta", args=[chunk], queue="meta", producer=producer)
@@ -2,6 +2,8 @@ from __future__ import annotations
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 from .config import settings
+from contextvars import ContextVar
+from typing import Optional
 import time
 
 class Base(DeclarativeBase):
@@ -38,6 +40,86 @@ def get_session():
         _SessionLocal = sessionmaker(bind=get_engine(), autoflush=False, autocommit=False)
     return _SessionLocal()
 
+class _RequestScope:
+    __slots__ = ("session", "after_commit", "on_rollback")
+
+    def __init__(self):
+        self.session = None
+        self.after_commit = []
+        self.on_rollback = []
+
+_request_scope: ContextVar[Optional[_RequestScope]] = ContextVar("fc_request_scope", default=None)
+
+def request_session():
+    """Сессия текущего HTTP-запроса (создаётся при первом обращении) или None вне запроса."""
+    scope = _request_scope.get()
+    if scope is None:
+        return None
+    if scope.session is None:
+        scope.session = get_session()
+    return scope.session
+
+def after_commit(fn) -> None:
+    """Выполнить fn после commit транзакции запроса (например, поставить задачу воркеру,
+    который сразу пойдёт читать записанное). Вне запроса — сразу."""
+    scope = _request_scope.get()
+    if scope is None:
+        fn()
+    else:
+        scope.after_commit.append(fn)
+
+def on_rollback(fn) -> None:
+    """Выполнить fn, если транзакция запроса откатится (убрать то, что уже записано вне БД,
+    например маркер в Redis под задачу, которая так и не будет отправлена). Вне запроса — ничего."""
+    scope = _request_scope.get()
+    if scope is not None:
+        scope.on_rollback.append(fn)
+
+def outside_request(fn, *args, **kwargs):
+    """Вызвать fn без транзакции запроса: store-функции откроют свою сессию и сразу её
+    закроют. Для коротких чтений перед долгой работой без БД (скачивания, S3), чтобы
+    соединение пула не висело idle in transaction до конца запроса."""
+    token = _request_scope.set(None)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _request_scope.reset(token)
+
+async def unit_of_work():
+    """FastAPI-зависимость: одна сессия и одна транзакция на запрос.
+    store-функции внутри запроса делают flush в общую сессию; здесь — commit после
+    ручки (или rollback при исключении). Запросы, не трогавшие БД, сессию не открывают.
+    async-генератор нарочно: contextvar ставится в контексте запроса и виден
+    sync-ручкам в threadpool."""
+    from starlette.concurrency import run_in_threadpool
+    scope = _RequestScope()
+    token = _request_scope.set(scope)
+    try:
+        yield
+        if scope.session is not None:
+            await run_in_threadpool(scope.session.commit)
+    except BaseException:
+        if scope.session is not None:
+            await run_in_threadpool(scope.session.rollback)
+        for fn in scope.on_rollback:
+            try:
+                await run_in_threadpool(fn)
+            except Exception as e:
+                print(f"[db] on_rollback callback failed: {e}")
+        raise
+    finally:
+        if scope.session is not None:
+            await run_in_threadpool(scope.session.close)
+        try:
+            _request_scope.reset(token)
+        except ValueError:
+            pass  # teardown в другом контексте — scope всё равно живёт только в этом запросе
+    for fn in scope.after_commit:
+        try:
+            await run_in_threadpool(fn)
+        except Exception as e:
+            print(f"[db] after_commit callback failed: {e}")
+
 def init_db(max_retries: int = 15, delay_sec: float = 2.0):
     """
     Пытаемся дождаться готовности БД (на старте Render БД может ещё создаваться).
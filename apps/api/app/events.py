@@ -0,0 +1,150 @@
+"""Push-канал статусов кадров/генераций: Redis pub/sub -> Server-Sent Events.
+
+store публикует события после commit (database.after_commit) в два канала:
+    fc:events:sku:{sku_id}   — для страницы SKU
+    fc:events:day:{YYYY-MM-DD} — для дашборда (день создания SKU)
+В каждом процессе API одна подписка psubscribe("fc:events:*") на redis.asyncio
+раздаёт сообщения по asyncio.Queue подписчиков — открытое SSE-соединение стоит
+одну корутину и одну очередь, без своего соединения с Redis и без потока.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+from typing import Any, AsyncIterator, Dict, Optional, Set
+
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+CHANNEL_PREFIX = "fc:events:"
+SSE_HEARTBEAT_SEC = float(os.environ.get("SSE_HEARTBEAT_SEC", "15"))
+SSE_QUEUE_SIZE = 100  # переполнение -> клиенту уходит resync (перечитать целиком)
+
+_publisher = None
+
+
+def _redis():
+    global _publisher
+    if _publisher is None:
+        import redis
+        _publisher = redis.Redis.from_url(REDIS_URL)
+    return _publisher
+
+
+def sku_channel(sku_id: int) -> str:
+    return f"{CHANNEL_PREFIX}sku:{int(sku_id)}"
+
+
+def day_channel(day: str) -> str:
+    return f"{CHANNEL_PREFIX}day:{day}"
+
+
+def publish(payload: Dict[str, Any], sku_id: Optional[int] = None, day: Optional[str] = None) -> None:
+    """Синхронная публикация (из store после commit). Ошибки Redis не ломают запись."""
+    data = json.dumps(payload, default=str)
+    try:
+        r = _redis()
+        if sku_id is not None:
+            r.publish(sku_channel(sku_id), data)
+        if day:
+            r.publish(day_channel(day), data)
+    except Exception as e:
+        print(f"[events] publish failed: {e}")
+
+
+class _Subscriber:
+    __slots__ = ("queue", "overflow")
+
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SSE_QUEUE_SIZE)
+        self.overflow = False
+
+
+class EventHub:
+    """Одна pattern-подписка на процесс, fan-out по локальным очередям."""
+
+    def __init__(self):
+        self._subs: Dict[str, Set[_Subscriber]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def _ensure_reader(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._reader())
+
+    async def _reader(self) -> None:
+        import redis.asyncio as aioredis
+        while True:
+            client = aioredis.Redis.from_url(REDIS_URL)
+            pubsub = client.pubsub()
+            try:
+                await pubsub.psubscribe(f"{CHANNEL_PREFIX}*")
+                async for msg in pubsub.listen():
+                    if msg.get("type") != "pmessage":
+                        continue
+                    channel = msg["channel"].decode() if isinstance(msg["channel"], bytes) else msg["channel"]
+                    self._dispatch(channel, msg["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[events] pubsub reader error, reconnecting: {e}")
+                # сообщения за время переподключения потеряны — пусть клиенты перечитают
+                for subs in self._subs.values():
+                    for sub in subs:
+                        sub.overflow = True
+                        self._wake(sub)
+                await asyncio.sleep(1.0)
+            finally:
+                try:
+                    await pubsub.close()
+                    await client.close()
+                except Exception:
+                    pass
+
+    @staticmethod
+    def _wake(sub: _Subscriber) -> None:
+        if sub.queue.empty():
+            try:
+                sub.queue.put_nowait(None)
+            except asyncio.QueueFull:
+                pass
+
+    def _dispatch(self, channel: str, data) -> None:
+        for sub in self._subs.get(channel, ()):
+            try:
+                sub.queue.put_nowait(data)
+            except asyncio.QueueFull:
+                sub.overflow = True
+
+    async def stream(self, channel: str) -> AsyncIterator[str]:
+        """SSE-поток канала: события, heartbeat-комментарии, resync при потере событий."""
+        self._ensure_reader()
+        sub = _Subscriber()
+        self._subs.setdefault(channel, set()).add(sub)
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    data = await asyncio.wait_for(sub.queue.get(), timeout=SSE_HEARTBEAT_SEC)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if sub.overflow:
+                    sub.overflow = False
+                    while not sub.queue.empty():
+                        sub.queue.get_nowait()
+                    yield "event: resync\ndata: {}\n\n"
+                    continue
+                if data is None:
+                    continue
+                text = data.decode() if isinstance(data, bytes) else str(data)
+                yield f"event: update\ndata: {text}\n\n"
+        finally:
+            subs = self._subs.get(channel)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    self._subs.pop(channel, None)
+
+
+hub = EventHub()
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
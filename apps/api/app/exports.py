@@ -0,0 +1,92 @@
+"""Экспорт ZIP как фоновая задача (очередь Celery "exports", задача worker.build_export).
+
+POST ручки экспорта собирают манифест (имя в архиве -> ключ S3) и считают по нему
+отпечаток. Ключи выходов уникальны и неизменяемы, так что отпечаток меняется ровно
+тогда, когда у какого-то кадра экспорта поменялись outputs или favorites. Отпечаток —
+это id задачи: повторный POST с тем же составом возвращает ту же задачу (идущую или
+готовую), а готовый архив exports/... в S3 переиспользуется, пока жив статус
+(EXPORT_JOB_TTL_SEC; lifecycle бакета для exports/ должен быть не короче).
+
+Статус задачи — hash fc:export:{job_id} в Redis (пишет воркер):
+status queued|running|done|failed, done/total (записей), key, bytes, error.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import redis
+
+from .celery_client import queue_export
+from .zipstream import Entry
+
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+# должен совпадать с EXPORT_JOB_TTL_SEC воркера
+EXPORT_JOB_TTL_SEC = int(os.environ.get("EXPORT_JOB_TTL_SEC", str(7 * 86400)))
+EXPORT_CLAIM_TTL_SEC = 60
+
+_redis = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+
+
+def _job_key(job_id: str) -> str:
+    return f"fc:export:{job_id}"
+
+
+def _manifest(entries: List[Entry]) -> List[Dict[str, str]]:
+    out = []
+    for name, src in entries:
+        if isinstance(src, (bytes, bytearray)):
+            out.append({"name": name, "text": bytes(src).decode("utf-8", "replace")})
+        else:
+            out.append({"name": name, "key": src})
+    return out
+
+
+def fingerprint(scope: str, manifest: List[Dict[str, str]]) -> str:
+    raw = json.dumps([scope, manifest], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    data = _redis.hgetall(_job_key(job_id))
+    if not data:
+        return None
+    job: Dict[str, Any] = {"job_id": job_id, "status": data.get("status") or "queued"}
+    for f in ("done", "total", "bytes"):
+        if data.get(f) is not None:
+            job[f] = int(data[f])
+    for f in ("key", "filename", "error"):
+        if data.get(f):
+            job[f] = data[f]
+    return job
+
+
+def ensure_job(scope: str, filename: str, entries: List[Entry]) -> Dict[str, Any]:
+    """Вернуть задачу экспорта для данного состава: готовую/идущую или поставить новую."""
+    manifest = _manifest(entries)
+    job_id = fingerprint(scope, manifest)
+    job = get_job(job_id)
+    if job is not None and job["status"] in ("queued", "running", "done"):
+        return job
+    # параллельные POST с тем же составом ставят задачу один раз
+    if not _redis.set(f"{_job_key(job_id)}:claim", "1", nx=True, ex=EXPORT_CLAIM_TTL_SEC):
+        return get_job(job_id) or {"job_id": job_id, "status": "queued"}
+    stem = filename[:-4] if filename.endswith(".zip") else filename
+    artifact_key = f"exports/{scope}/{stem}_{job_id[:16]}.zip"
+    pipe = _redis.pipeline()
+    pipe.delete(_job_key(job_id))
+    pipe.hset(_job_key(job_id), mapping={
+        "status": "queued", "done": 0, "total": len(manifest),
+        "key": artifact_key, "filename": filename, "created_ts": int(time.time()),
+    })
+    pipe.expire(_job_key(job_id), EXPORT_JOB_TTL_SEC)
+    pipe.execute()
+    try:
+        queue_export(job_id, artifact_key, manifest)
+    except Exception:
+        _redis.delete(_job_key(job_id), f"{_job_key(job_id)}:claim")
+        raise
+    return get_job(job_id) or {"job_id": job_id, "status": "queued"}
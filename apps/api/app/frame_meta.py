@@ -0,0 +1,109 @@
+"""Метаданные оригиналов по заголовкам: размер, EXIF-ориентация, формат, вес, хэш.
+
+При сабмите кадров (BackgroundTasks после ответа; большие пачки — воркеру, см. schedule)
+качаем только начало объекта —
+ranged GET на FRAME_META_HEAD_BYTES. Pillow читает размеры и EXIF из заголовков, не
+декодируя пиксели; если заголовок длиннее (большой EXIF/XMP до SOF у JPEG), окно
+удваивается до FRAME_META_MAX_BYTES. Вес берётся из Content-Range, хэш — ETag S3
+(MD5 для обычного PUT, для multipart — "md5-of-parts-N"; для поиска дублей одной и той
+же загрузки этого достаточно). Результат — колонки frames (store.set_frame_meta),
+воркер по ним решает, нужен ли полный decode на предобработке.
+"""
+from __future__ import annotations
+
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from PIL import Image
+
+from .config import settings
+from .database import after_commit
+from .s3util import s3_client
+from .store import set_frames_meta
+
+FRAME_META_HEAD_BYTES = int(os.environ.get("FRAME_META_HEAD_BYTES", str(64 * 1024)))
+FRAME_META_MAX_BYTES = int(os.environ.get("FRAME_META_MAX_BYTES", str(1024 * 1024)))
+FRAME_META_CONCURRENCY = int(os.environ.get("FRAME_META_CONCURRENCY", "8"))
+# больше — отдаём воркеру (worker.extract_frame_meta), чтобы тысячи ranged GET не шли из API
+FRAME_META_INLINE_MAX = int(os.environ.get("FRAME_META_INLINE_MAX", "200"))
+_EXIF_ORIENTATION = 0x0112
+
+
+def _head(key: str, n: int) -> Tuple[bytes, Dict[str, Any]]:
+    r = s3_client().get_object(Bucket=settings.s3_bucket, Key=key, Range=f"bytes=0-{n - 1}")
+    return r["Body"].read(), r
+
+
+def _total_size(resp: Dict[str, Any]) -> Optional[int]:
+    # "bytes 0-65535/31457280"; без Range (объект меньше окна) S3 может не прислать Content-Range
+    cr = resp.get("ContentRange") or ""
+    if "/" in cr and cr.rsplit("/", 1)[1].isdigit():
+        return int(cr.rsplit("/", 1)[1])
+    return resp.get("ContentLength")
+
+
+def _parse(data: bytes) -> Optional[Dict[str, Any]]:
+    try:
+        with Image.open(io.BytesIO(data)) as im:
+            w, h = im.size
+            fmt = im.format
+            orientation = None
+            # у PNG eXIf может идти после IDAT — getexif() полез бы декодировать обрезанные данные
+            if fmt != "PNG":
+                try:
+                    orientation = im.getexif().get(_EXIF_ORIENTATION)
+                except Exception:
+                    pass
+    except Exception:
+        return None
+    return {"width": int(w), "height": int(h), "image_format": (fmt or "").lower() or None,
+            "orientation": int(orientation) if orientation else None}
+
+
+def extract(key: str) -> Dict[str, Any]:
+    """Метаданные объекта key. Поля, которые не удалось прочитать, — None."""
+    n = FRAME_META_HEAD_BYTES
+    while True:
+        data, resp = _head(key, n)
+        total = _total_size(resp)
+        info = _parse(data)
+        if info is not None or len(data) < n or n >= FRAME_META_MAX_BYTES:
+            break
+        n = min(n * 2, FRAME_META_MAX_BYTES)
+    meta: Dict[str, Any] = {"byte_size": total, "content_hash": (resp.get("ETag") or "").strip('"') or None}
+    meta.update(info or {})
+    return meta
+
+
+def _extract_one(item: Tuple[int, str]) -> Optional[Tuple[int, Dict[str, Any]]]:
+    fid, key = item
+    if not key:
+        return None
+    try:
+        return fid, extract(key)
+    except Exception as e:
+        print(f"[frame_meta] frame {fid} ({key}): {e}")
+        return None
+
+
+def extract_frames(items: Iterable[Tuple[int, str]]) -> None:
+    """[(frame_id, original_key)] -> колонки frames одной записью (store.set_frames_meta);
+    для BackgroundTasks. Запускается после ответа, вне транзакции запроса."""
+    with ThreadPoolExecutor(max_workers=FRAME_META_CONCURRENCY, thread_name_prefix="frame-meta") as pool:
+        results = [r for r in pool.map(_extract_one, list(items)) if r is not None]
+    set_frames_meta(dict(results))
+
+
+def schedule(background, items: List[Tuple[int, str]]) -> None:
+    """Извлечь метаданные после ответа: до FRAME_META_INLINE_MAX кадров — в API (BackgroundTasks),
+    больше — задачами воркера в очереди "meta" (после commit; результат он шлёт в /internal/frames/meta)."""
+    items = [(int(fid), key) for fid, key in items if key]
+    if not items:
+        return
+    if len(items) <= FRAME_META_INLINE_MAX:
+        background.add_task(extract_frames, items)
+    else:
+        from .celery_client import queue_extract_frame_meta
+        after_commit(lambda: queue_extract_frame_meta(items))
@@ -0,0 +1,41 @@
+"""Условные GET (ETag / If-None-Match) для опрашиваемых ручек.
+
+Ручка считает дешёвый штамп версии (счётчик изменений change_seq, см. store.sku_view_version)
+и, если он совпал с ETag клиента, отвечает 304 до presign'а и сборки JSON.
+Cache-Control: no-cache — браузер хранит ответ, но на каждый опрос перепроверяет его у нас.
+"""
+from __future__ import annotations
+
+import hashlib
+import time
+from typing import Optional
+
+from fastapi import Request, Response
+
+
+def make_etag(*parts) -> str:
+    raw = "|".join("" if p is None else str(p) for p in parts)
+    return 'W/"' + hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20] + '"'
+
+
+def signing_bucket(ttl_sec: int) -> int:
+    """Номер окна в половину срока жизни presigned URL: ETag ответа со ссылками меняется
+    раньше, чем ссылки в закэшированной клиентом копии успеют протухнуть. Ссылки подписываются
+    началом этого же окна (s3util.signed_get_url), так что внутри окна они не меняются."""
+    return int(time.time() // max(1, ttl_sec // 2))
+
+
+def _opaque(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def not_modified(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """Проставить ETag в ответ; вернуть готовый 304, если клиент прислал тот же ETag."""
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    inm = request.headers.get("if-none-match")
+    # слабое сравнение (RFC 9110): прокси/CDN могут вернуть тег без префикса W/
+    if inm and (inm.strip() == "*" or _opaque(etag) in [_opaque(t) for t in inm.split(",")]):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    return None
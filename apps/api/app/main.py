@@ -1,4 +1,4 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from .routes.skus import router as skus_router
 from .routes.heads import router as heads_router
@@ -6,11 +6,13 @@ from .routes.internal import router as internal_router
 from .routes.dashboard import router as dashboard_router
 from .routes.webhooks import router as webhooks_router
 from .store import HEADS, create_head
-from .database import init_db, get_session
+from .database import init_db, get_session, unit_of_work
 from . import models
+from .s3util import SigningTimingMiddleware
 
 
-app = FastAPI()
+# одна сессия/транзакция БД на запрос для store-функций (см. database.unit_of_work)
+app = FastAPI(dependencies=[Depends(unit_of_work)])
 
 # CORS можно сузить позже
 app.add_middleware(
@@ -19,7 +21,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
+# Server-Timing: CPU на presign за запрос (s3util.signed_get_url)
+app.add_middleware(SigningTimingMiddleware)
 
 @app.get("/")
 def root():
@@ -45,6 +50,8 @@ DEFAULT_HEAD_PARAMS = {
     "guidance_scale": 2,
     "num_outputs": 3,
     "output_format": "png",
+    # True: сначала быстрый черновик (1 выход, мало шагов), полный прогон — после accept / refine
+    "draft_mode": False,
 }
 
 PREDEFINED_HEADS = [
@@ -121,6 +128,67 @@ def _ensure_schema_patches():
                 sess.rollback()
         except Exception as e:
             sess.rollback(); print(f"[startup] schema patch (accepted) skipped: {e}")
+        # generations: чекпоинты пайплайна (stage / checkpoint / updated_at)
+        for col, ddl in (
+            ("stage", "ALTER TABLE generations ADD COLUMN IF NOT EXISTS stage VARCHAR(32)"),
+            ("checkpoint", "ALTER TABLE generations ADD COLUMN IF NOT EXISTS checkpoint JSON"),
+            ("updated_at", "ALTER TABLE generations ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT now()"),
+        ):
+            try:
+                sess.execute(text(ddl))
+                sess.commit()
+            except Exception as e:
+                sess.rollback(); print(f"[startup] schema patch (generations.{col}) skipped: {e}")
+        # skus.updated_at (delta-sync дашборда)
+        try:
+            sess.execute(text("ALTER TABLE skus ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT now()"))
+            sess.commit()
+        except Exception as e:
+            sess.rollback(); print(f"[startup] schema patch (skus.updated_at) skipped: {e}")
+        # счётчики изменений для ETag (см. миграцию 0011)
+        for tbl in ("skus", "daily_frame_stats"):
+            try:
+                sess.execute(text(f"ALTER TABLE {tbl} ADD COLUMN IF NOT EXISTS change_seq BIGINT NOT NULL DEFAULT 0"))
+                sess.commit()
+            except Exception as e:
+                sess.rollback(); print(f"[startup] schema patch ({tbl}.change_seq) skipped: {e}")
+        # frame_output_versions.generation_id (прогрессивные выходы из webhook)
+        try:
+            sess.execute(text("ALTER TABLE frame_output_versions ADD COLUMN IF NOT EXISTS generation_id INTEGER REFERENCES generations(id)"))
+            sess.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS uq_frame_output_versions_generation_id ON frame_output_versions (generation_id)"))
+            sess.commit()
+        except Exception as e:
+            sess.rollback(); print(f"[startup] schema patch (frame_output_versions.generation_id) skipped: {e}")
+        # frames: метаданные оригинала (см. миграцию 0010)
+        for col, ddl in (
+            ("width", "ALTER TABLE frames ADD COLUMN IF NOT EXISTS width INTEGER"),
+            ("height", "ALTER TABLE frames ADD COLUMN IF NOT EXISTS height INTEGER"),
+            ("orientation", "ALTER TABLE frames ADD COLUMN IF NOT EXISTS orientation INTEGER"),
+            ("image_format", "ALTER TABLE frames ADD COLUMN IF NOT EXISTS image_format VARCHAR(16)"),
+            ("byte_size", "ALTER TABLE frames ADD COLUMN IF NOT EXISTS byte_size BIGINT"),
+            ("content_hash", "ALTER TABLE frames ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)"),
+        ):
+            try:
+                sess.execute(text(ddl))
+                sess.commit()
+            except Exception as e:
+                sess.rollback(); print(f"[startup] schema patch (frames.{col}) skipped: {e}")
+        # индексы горячих запросов (см. миграцию 0007)
+        for ddl in (
+            "CREATE INDEX IF NOT EXISTS ix_frames_sku_id ON frames (sku_id)",
+            "CREATE INDEX IF NOT EXISTS ix_frames_status ON frames (status)",
+            "CREATE INDEX IF NOT EXISTS ix_generations_frame_id ON generations (frame_id)",
+            "CREATE INDEX IF NOT EXISTS ix_generations_replicate_prediction_id ON generations (replicate_prediction_id)",
+            "CREATE INDEX IF NOT EXISTS ix_generations_status_updated_at ON generations (status, updated_at)",
+            "CREATE INDEX IF NOT EXISTS ix_skus_created_at ON skus (created_at)",
+            "CREATE INDEX IF NOT EXISTS ix_skus_brand_created_at ON skus (brand, created_at)",
+            "CREATE INDEX IF NOT EXISTS ix_frames_content_hash ON frames (content_hash)",
+        ):
+            try:
+                sess.execute(text(ddl))
+                sess.commit()
+            except Exception as e:
+                sess.rollback(); print(f"[startup] schema patch ({ddl.split()[5]}) skipped: {e}")
     finally:
         sess.close()
 
@@ -166,3 +234,23 @@ def _seed_heads_db():
 
 _seed_heads()  # legacy in-memory (можно убрать позже)
 _seed_heads_db()
+
+def _backfill_rollups():
+    """Первый старт с таблицами счётчиков дашборда: заполнить их из skus/frames."""
+    from . import rollups
+    try:
+        sess = get_session()
+    except Exception as e:
+        print(f"[startup] skip rollups backfill: {e}")
+        return
+    try:
+        n = rollups.backfill_if_empty(sess)
+        sess.commit()
+        if n is not None:
+            print(f"[startup] dashboard rollups backfilled for {n} skus")
+    except Exception as e:
+        sess.rollback(); print(f"[startup] rollups backfill skipped: {e}")
+    finally:
+        sess.close()
+
+_backfill_rollups()
@@ -1,6 +1,6 @@
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import String, Integer, ForeignKey, DateTime, Enum, JSON, func, UniqueConstraint, Boolean
-from datetime import datetime
+from sqlalchemy import String, Integer, BigInteger, ForeignKey, DateTime, Enum, JSON, func, UniqueConstraint, Boolean, Index, Date
+from datetime import date, datetime
 import enum
 
 """ORM models.
@@ -51,20 +51,32 @@ class SKU(Base):
     head_profile_id: Mapped[int | None] = mapped_column(ForeignKey("head_profiles.id"), nullable=True)
     brand: Mapped[str | None] = mapped_column(String(120), nullable=True, index=True)
     is_done: Mapped[bool] = mapped_column(Boolean, default=False)
-    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), index=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), onupdate=func.now())
+    # +1 в транзакции каждого изменения вида SKU (store._bump_sku) — штамп ETag
+    change_seq: Mapped[int] = mapped_column(BigInteger, default=0, server_default="0")
 
     head: Mapped["HeadProfile"] = relationship()
     frames: Mapped[list["Frame"]] = relationship(back_populates="sku")
+    # дашборд: SKU за день с фильтром по бренду
+    __table_args__ = (Index("ix_skus_brand_created_at", "brand", "created_at"),)
 
 class Frame(Base):
     __tablename__ = "frames"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    sku_id: Mapped[int] = mapped_column(ForeignKey("skus.id"))
+    sku_id: Mapped[int] = mapped_column(ForeignKey("skus.id"), index=True)
     original_key: Mapped[str] = mapped_column(String(512))
     mask_key: Mapped[str | None] = mapped_column(String(512), nullable=True)
-    status: Mapped[FrameStatus] = mapped_column(Enum(FrameStatus), default=FrameStatus.NEW)
+    status: Mapped[FrameStatus] = mapped_column(Enum(FrameStatus), default=FrameStatus.NEW, index=True)
     pending_params: Mapped[dict | None] = mapped_column(JSON, nullable=True)
     accepted: Mapped[bool] = mapped_column(Boolean, default=False)
+    # метаданные оригинала по заголовкам (app/frame_meta.py); NULL — ещё не извлекались
+    width: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    height: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    orientation: Mapped[int | None] = mapped_column(Integer, nullable=True)  # EXIF 1..8
+    image_format: Mapped[str | None] = mapped_column(String(16), nullable=True)
+    byte_size: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
+    content_hash: Mapped[str | None] = mapped_column(String(64), nullable=True, index=True)  # ETag S3
     created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
     updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), onupdate=func.now())
 
@@ -76,14 +88,20 @@ class Frame(Base):
 class Generation(Base):
     __tablename__ = "generations"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    frame_id: Mapped[int] = mapped_column(ForeignKey("frames.id"))
+    frame_id: Mapped[int] = mapped_column(ForeignKey("frames.id"), index=True)
     status: Mapped[GenStatus] = mapped_column(Enum(GenStatus), default=GenStatus.PENDING)
-    replicate_prediction_id: Mapped[str | None] = mapped_column(String(128))
+    replicate_prediction_id: Mapped[str | None] = mapped_column(String(128), index=True)  # поиск из webhook
     output_keys: Mapped[list[str] | None] = mapped_column(JSON, nullable=True)
     error: Mapped[str | None] = mapped_column(String(2048))
+    # последняя завершённая стадия пайплайна воркера: created|preprocessed|masked|submitted|ingested
+    stage: Mapped[str | None] = mapped_column(String(32), nullable=True)
+    checkpoint: Mapped[dict | None] = mapped_column(JSON, nullable=True)  # данные стадий (ключи S3, prediction_id, ...)
     created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+    updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), onupdate=func.now())
 
     frame: Mapped["Frame"] = relationship(back_populates="generations")
+    # sweeper осиротевших prediction: RUNNING, не обновлявшиеся дольше N секунд
+    __table_args__ = (Index("ix_generations_status_updated_at", "status", "updated_at"),)
 
 
 class FrameOutputVersion(Base):
@@ -91,6 +109,8 @@ class FrameOutputVersion(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     frame_id: Mapped[int] = mapped_column(ForeignKey("frames.id"), index=True)
     version_index: Mapped[int] = mapped_column(Integer)  # начинается с 1
+    # генерация, выходы которой собраны в эту версию (дополняется по мере прихода webhook "output")
+    generation_id: Mapped[int | None] = mapped_column(ForeignKey("generations.id"), nullable=True, unique=True)
     keys: Mapped[list[str]] = mapped_column(JSON)
     created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
 
@@ -107,3 +127,27 @@ class FrameFavorite(Base):
 
     frame: Mapped["Frame"] = relationship(back_populates="favorites")
     __table_args__ = (UniqueConstraint("frame_id", "key"),)
+
+
+# ---- Счётчики дашборда (ведутся инкрементально в транзакциях store, см. app/rollups.py) ----
+class SkuFrameStats(Base):
+    __tablename__ = "sku_frame_stats"
+    sku_id: Mapped[int] = mapped_column(ForeignKey("skus.id", ondelete="CASCADE"), primary_key=True)
+    day: Mapped[date] = mapped_column(Date, index=True)  # UTC-дата создания SKU (денормализовано)
+    frames_total: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    frames_done: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    frames_failed: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), onupdate=func.now())
+
+
+class DailyFrameStats(Base):
+    __tablename__ = "daily_frame_stats"
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    skus_total: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    skus_done: Mapped[int] = mapped_column(Integer, default=0, server_default="0")     # все кадры DONE
+    skus_failed: Mapped[int] = mapped_column(Integer, default=0, server_default="0")   # все кадры FAILED
+    frames_total: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    frames_done: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    frames_failed: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), onupdate=func.now())
+    change_seq: Mapped[int] = mapped_column(BigInteger, default=0, server_default="0")  # +1 на каждое изменение дня
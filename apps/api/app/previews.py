@@ -0,0 +1,82 @@
+"""Превью оригиналов для маск-пейнтера: previews/{sku_code}/{frame_id}.jpg.
+
+Строит воркер (задача worker.build_preview) — при сабмите SKU сразу для всех кадров,
+либо по первому промаху в /internal/frame/{id}/preview. Сборка одна на кадр:
+fc:preview:{frame_id}:pending (SET NX) не даёт поставить вторую, пока идёт первая,
+сколько бы вкладок ни запросило превью. Готовность — fc:preview:{frame_id} = ключ S3
+(ставит воркер), так что готовое превью отдаётся без head_object.
+Ключ отдельный от resized/ предобработки воркера: та подаётся в модель вместе с маской
+её размеров, и превью, собранное параллельно, не должно её перезаписать.
+"""
+from __future__ import annotations
+
+import os
+from typing import List, Optional, Tuple
+
+import redis
+
+from .celery_client import queue_build_preview, queue_build_previews
+
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+# должны совпадать с воркером
+PREVIEW_PENDING_TTL_SEC = int(os.environ.get("PREVIEW_PENDING_TTL_SEC", "120"))
+PREVIEW_READY_TTL_SEC = int(os.environ.get("PREVIEW_READY_TTL_SEC", str(30 * 86400)))
+# пакетный сабмит ставит тысячи превью разом — очередь разбирается дольше обычного маркера
+PREVIEW_BULK_PENDING_TTL_SEC = int(os.environ.get("PREVIEW_BULK_PENDING_TTL_SEC", "3600"))
+PREVIEW_RETRY_AFTER_SEC = 2
+
+_redis = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+
+
+def preview_key(sku_code: str, frame_id: int) -> str:
+    return f"previews/{sku_code}/{int(frame_id)}.jpg"
+
+
+def _ready_key(frame_id: int) -> str:
+    return f"fc:preview:{int(frame_id)}"
+
+
+def _pending_key(frame_id: int) -> str:
+    return f"fc:preview:{int(frame_id)}:pending"
+
+
+def ready(frame_id: int) -> Optional[str]:
+    """Ключ S3 готового превью или None."""
+    return _redis.get(_ready_key(frame_id))
+
+
+def mark_ready(frame_id: int, key: str) -> None:
+    _redis.set(_ready_key(frame_id), key, ex=PREVIEW_READY_TTL_SEC)
+
+
+def is_pending(frame_id: int) -> bool:
+    return bool(_redis.exists(_pending_key(frame_id)))
+
+
+def request(frame_id: int, original_key: str, target_key: str) -> bool:
+    """Поставить сборку превью, если она ещё не идёт. True — поставлена этим вызовом."""
+    if not _redis.set(_pending_key(frame_id), "1", nx=True, ex=PREVIEW_PENDING_TTL_SEC):
+        return False
+    try:
+        queue_build_preview(int(frame_id), original_key, target_key)
+    except Exception:
+        _redis.delete(_pending_key(frame_id))
+        raise
+    return True
+
+
+def request_many(items: List[Tuple[int, str, str]]) -> int:
+    """Пакетный request: [(frame_id, original_key, target_key)]. Маркеры ставятся одним
+    pipeline (с PREVIEW_BULK_PENDING_TTL_SEC), задачи — кусками. Возвращает число поставленных."""
+    if not items:
+        return 0
+    pipe = _redis.pipeline(transaction=False)
+    for fid, _, _ in items:
+        pipe.set(_pending_key(fid), "1", nx=True, ex=PREVIEW_BULK_PENDING_TTL_SEC)
+    claimed = [it for it, ok in zip(items, pipe.execute()) if ok]
+    try:
+        queue_build_previews(claimed)
+    except Exception:
+        _redis.delete(*[_pending_key(fid) for fid, _, _ in claimed])
+        raise
+    return len(claimed)
@@ -0,0 +1,198 @@
+"""Счётчики дашборда: sku_frame_stats (по SKU) и daily_frame_stats (по дню создания SKU).
+
+Раньше /api/dashboard/batches и /skus на каждый опрос агрегировали все SKU x все кадры.
+Теперь store обновляет счётчики в той же транзакции, что и статус кадра (UPDATE ... + delta,
+строка SKU блокируется до commit), а дашборд читает O(показанных дней/SKU) строк.
+
+Дрейф (ручные правки БД, данные до появления таблиц) чинит пересчёт:
+    PYTHONPATH=. python -m app.rollups
+"""
+from __future__ import annotations
+
+from datetime import date
+from typing import Optional
+
+from sqlalchemy import case, func, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from . import models
+
+_SKU = models.SkuFrameStats.__table__
+_DAY = models.DailyFrameStats.__table__
+
+
+def _is(status, expected) -> int:
+    return 1 if status == expected else 0
+
+
+def sku_class(total: int, done: int, failed: int) -> str:
+    """Статус SKU на дашборде: DONE — все кадры готовы, FAILED — все упали, иначе IN_PROGRESS."""
+    if total and done == total:
+        return "DONE"
+    if total and failed == total:
+        return "FAILED"
+    return "IN_PROGRESS"
+
+
+def _bump_daily(sess, day: date, **deltas: int) -> None:
+    deltas = {k: v for k, v in deltas.items() if v}
+    if not deltas:
+        return
+    # change_seq — штамп ETag /batches: updated_at = начало транзакции и может отстать от уже отданного max
+    stmt = pg_insert(_DAY).values(day=day, change_seq=1, **deltas)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[_DAY.c.day],
+        set_={**{k: _DAY.c[k] + stmt.excluded[k] for k in deltas},
+              "change_seq": _DAY.c.change_seq + 1, "updated_at": func.now()},
+    )
+    sess.execute(stmt)
+
+
+def sku_created(sess, sku) -> None:
+    """Новый SKU (created_at уже загружен): пустая строка счётчиков + skus_total дня."""
+    day = sku.created_at.date()
+    sess.execute(pg_insert(_SKU).values(sku_id=sku.id, day=day).on_conflict_do_nothing())
+    _bump_daily(sess, day, skus_total=1)
+
+
+def skus_created(sess, skus) -> None:
+    """sku_created для пачки новых SKU: строки счётчиков одним INSERT, skus_total — по разу на день."""
+    if not skus:
+        return
+    sess.execute(
+        pg_insert(_SKU).values([{"sku_id": s.id, "day": s.created_at.date()} for s in skus]).on_conflict_do_nothing()
+    )
+    per_day: dict = {}
+    for s in skus:
+        per_day[s.created_at.date()] = per_day.get(s.created_at.date(), 0) + 1
+    for day, n in sorted(per_day.items()):
+        _bump_daily(sess, day, skus_total=n)
+
+
+def frame_changed(sess, sku_id: int, old_status, new_status) -> None:
+    """Кадр добавлен (old_status=None), удалён (new_status=None) или сменил статус."""
+    DONE, FAILED = models.FrameStatus.DONE, models.FrameStatus.FAILED
+    _apply(
+        sess, sku_id,
+        dt=(new_status is not None) - (old_status is not None),
+        dd=_is(new_status, DONE) - _is(old_status, DONE),
+        df=_is(new_status, FAILED) - _is(old_status, FAILED),
+    )
+
+
+def frames_added(sess, sku_id: int, n: int) -> None:
+    """n новых кадров SKU (статус NEW) одним обновлением — для пакетной вставки."""
+    _apply(sess, sku_id, dt=int(n), dd=0, df=0)
+
+
+def _apply(sess, sku_id: int, dt: int, dd: int, df: int) -> None:
+    if not (dt or dd or df):
+        return
+    row = sess.execute(
+        update(_SKU)
+        .where(_SKU.c.sku_id == int(sku_id))
+        .values(
+            frames_total=_SKU.c.frames_total + dt,
+            frames_done=_SKU.c.frames_done + dd,
+            frames_failed=_SKU.c.frames_failed + df,
+            updated_at=func.now(),
+        )
+        .returning(_SKU.c.day, _SKU.c.frames_total, _SKU.c.frames_done, _SKU.c.frames_failed)
+    ).first()
+    if row is None:
+        # SKU без строки счётчиков (создан до появления таблиц) — поправит пересчёт
+        print(f"[rollups] no sku_frame_stats row for sku={sku_id}; run `python -m app.rollups`")
+        return
+    _bump_daily(sess, row.day, **_day_deltas(row.frames_total, row.frames_done, row.frames_failed, dt, dd, df))
+
+
+def _day_deltas(total: int, done: int, failed: int, dt: int, dd: int, df: int) -> dict:
+    """Дельты счётчиков дня, если счётчики SKU стали (total, done, failed) после (dt, dd, df):
+    кадры — как есть, skus_done/skus_failed — по смене класса SKU (sku_class до и после)."""
+    before = sku_class(total - dt, done - dd, failed - df)
+    after = sku_class(total, done, failed)
+    return {
+        "frames_total": dt, "frames_done": dd, "frames_failed": df,
+        "skus_done": _is(after, "DONE") - _is(before, "DONE"),
+        "skus_failed": _is(after, "FAILED") - _is(before, "FAILED"),
+    }
+
+
+def sku_deleted(sess, sku_id: int) -> None:
+    """Вычесть SKU (со всеми кадрами) из счётчиков дня и удалить его строку."""
+    row = sess.execute(
+        _SKU.delete().where(_SKU.c.sku_id == int(sku_id))
+        .returning(_SKU.c.day, _SKU.c.frames_total, _SKU.c.frames_done, _SKU.c.frames_failed)
+    ).first()
+    if row is None:
+        return
+    cls = sku_class(row.frames_total, row.frames_done, row.frames_failed)
+    _bump_daily(
+        sess, row.day,
+        skus_total=-1, skus_done=-_is(cls, "DONE"), skus_failed=-_is(cls, "FAILED"),
+        frames_total=-row.frames_total, frames_done=-row.frames_done, frames_failed=-row.frames_failed,
+    )
+
+
+def reconcile(sess) -> int:
+    """Пересчитать обе таблицы из skus/frames. Таблицы счётчиков блокируются на время
+    пересчёта, параллельные обновления статусов подождут commit. Возвращает число SKU."""
+    sess.execute(text("LOCK TABLE sku_frame_stats, daily_frame_stats IN EXCLUSIVE MODE"))
+    F, S = models.Frame, models.SKU
+    rows = sess.execute(
+        select(
+            S.id, S.created_at,
+            func.count(F.id),
+            func.coalesce(func.sum(case((F.status == models.FrameStatus.DONE, 1), else_=0)), 0),
+            func.coalesce(func.sum(case((F.status == models.FrameStatus.FAILED, 1), else_=0)), 0),
+        )
+        .join(F, F.sku_id == S.id, isouter=True)
+        .group_by(S.id, S.created_at)
+    ).all()
+    # change_seq дня переносим с +1, иначе штамп ETag /batches мог бы вернуться к старому значению
+    prev_seq = dict(sess.execute(select(_DAY.c.day, _DAY.c.change_seq)).all())
+    sess.execute(_SKU.delete())
+    sess.execute(_DAY.delete())
+    daily: dict = {}
+    sku_rows = []
+    for sid, created_at, total, done, failed in rows:
+        day = created_at.date()
+        sku_rows.append({"sku_id": sid, "day": day, "frames_total": total, "frames_done": done, "frames_failed": failed})
+        d = daily.setdefault(day, {"day": day, "skus_total": 0, "skus_done": 0, "skus_failed": 0,
+                                   "frames_total": 0, "frames_done": 0, "frames_failed": 0,
+                                   "change_seq": (prev_seq.get(day) or 0) + 1})
+        cls = sku_class(total, done, failed)
+        d["skus_total"] += 1
+        d["skus_done"] += _is(cls, "DONE")
+        d["skus_failed"] += _is(cls, "FAILED")
+        d["frames_total"] += total
+        d["frames_done"] += done
+        d["frames_failed"] += failed
+    if sku_rows:
+        sess.execute(_SKU.insert(), sku_rows)
+    if daily:
+        sess.execute(_DAY.insert(), list(daily.values()))
+    # строки /skus читают пересчитанные счётчики — сдвигаем и их штамп
+    sess.execute(update(S.__table__).values(change_seq=S.__table__.c.change_seq + 1))
+    return len(sku_rows)
+
+
+def backfill_if_empty(sess) -> Optional[int]:
+    """Первый деплой с таблицами счётчиков: заполнить их, если SKU уже есть."""
+    if sess.execute(select(_SKU.c.sku_id).limit(1)).first() is not None:
+        return None
+    if sess.execute(select(models.SKU.id).limit(1)).first() is None:
+        return None
+    return reconcile(sess)
+
+
+if __name__ == "__main__":
+    from .database import get_session
+
+    sess = get_session()
+    try:
+        n = reconcile(sess)
+        sess.commit()
+        print(f"[rollups] reconciled {n} skus")
+    finally:
+        sess.close()
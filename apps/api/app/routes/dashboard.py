@@ -1,10 +1,14 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from datetime import datetime, timedelta
 from typing import Dict, Any, List
 from ..store import (
     list_frames_for_sku, get_frame, get_sku, get_sku_by_code,
-    SKU_BY_CODE, SKUS_BY_ID, SKU_FRAMES, FRAME_GENERATIONS, GENERATIONS_BY_ID
+    SKU_BY_CODE, SKUS_BY_ID, SKU_FRAMES, FRAME_GENERATIONS, GENERATIONS_BY_ID,
+    parse_sync_cursor, DELTA_SYNC_OVERLAP_SEC,
 )
+from ..http_cache import make_etag, not_modified
+from ..events import SSE_HEADERS, day_channel, hub
 from .internal import _s3_public_url, _s3_signed_get, S3_REQUIRE_SIGNED, S3_BUCKET
 import os
 
@@ -40,41 +44,55 @@ def list_brands():
             brands.add(b)
     return {"items": sorted(brands)}
 
+def _since_threshold(since: str | None):
+    """?since=<cursor> дашборда -> нижняя граница updated_at (с окном перекрытия, см. store)."""
+    if not since:
+        return None
+    try:
+        return parse_sync_cursor(since) - timedelta(seconds=DELTA_SYNC_OVERLAP_SEC)
+    except (ValueError, TypeError):
+        raise HTTPException(422, "invalid since cursor")
+
+@router.get("/events")
+async def dashboard_events(date: str | None = None):
+    """SSE-поток изменений кадров SKU, созданных в день date (по умолчанию — сегодня, UTC).
+    На event: update дашборд перечитывает /skus и /batches с ?since=."""
+    day = date or datetime.utcnow().strftime("%Y-%m-%d")
+    try:
+        datetime.strptime(day, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(422, "date must be YYYY-MM-DD")
+    return StreamingResponse(hub.stream(day_channel(day)), media_type="text/event-stream", headers=SSE_HEADERS)
+
 @router.get("/batches")
-def list_batches(limit: int = 14):
+def list_batches(request: Request, response: Response, limit: int = 14, since: str | None = None):
     if USE_DB:
         from sqlalchemy import select, func
+        threshold = _since_threshold(since)
         sess = get_session()
         try:
-            # aggregate frames per sku with status counts
-            Frame = models.Frame; SKU = models.SKU
-            from sqlalchemy import case
-            done_case = case((Frame.status == models.FrameStatus.DONE, 1), else_=0)
-            failed_case = case((Frame.status == models.FrameStatus.FAILED, 1), else_=0)
-            rows = sess.execute(
-                select(
-                    SKU.id, SKU.code, SKU.brand,
-                    func.date_trunc('day', SKU.created_at).label('d'),
-                    func.count(Frame.id).label('frames'),
-                    func.sum(done_case).label('done'),
-                    func.sum(failed_case).label('failed')
-                ).join(Frame, Frame.sku_id == SKU.id, isouter=True)
-                .group_by(SKU.id, SKU.code, SKU.brand, 'd')
-                .order_by(func.max(SKU.created_at).desc())
-            ).fetchall()
-            buckets: Dict[str, Dict[str, Any]] = {}
+            D = models.DailyFrameStats
+            # штамп версии: любое изменение счётчиков дня двигает его change_seq (rollups._bump_daily)
+            cnt, seq = sess.execute(select(func.count(D.day), func.sum(D.change_seq))).one()
+            cached = not_modified(request, response, make_etag("batches", cnt, seq, limit, since))
+            if cached is not None:
+                return cached
+            # счётчики по дням ведутся инкрементально (app/rollups.py) — читаем только показанные дни
+            rows = sess.execute(select(D).order_by(D.day.desc()).limit(limit)).scalars().all()
+            cursor = max((r.updated_at for r in rows if r.updated_at), default=None)
+            dates = [r.day.isoformat() for r in rows]  # все показанные дни: клиент delta убирает выпавшие
+            if threshold is not None:
+                rows = [r for r in rows if r.updated_at is None or r.updated_at > threshold]
+            items = []
             for r in rows:
-                date = r.d.date().isoformat() if hasattr(r.d, 'date') else str(r.d)[:10]
-                b = buckets.setdefault(date, {"date": date, "total": 0, "done": 0, "failed": 0, "inProgress": 0})
-                b["total"] += 1
-                if r.frames and r.frames == r.done:
-                    b["done"] += 1
-                elif r.frames and r.frames == r.failed:
-                    b["failed"] += 1
-                else:
-                    b["inProgress"] += 1
-            items = sorted(buckets.values(), key=lambda x: x["date"], reverse=True)[:limit]
-            return {"items": items}
+                items.append({
+                    "date": r.day.isoformat(),
+                    "total": r.skus_total,
+                    "done": r.skus_done,
+                    "failed": r.skus_failed,
+                    "inProgress": max(0, r.skus_total - r.skus_done - r.skus_failed),
+                })
+            return {"items": items, "dates": dates, "cursor": cursor.isoformat() if cursor else since, "delta": bool(since)}
         finally:
             sess.close()
     # fallback in-memory
@@ -97,55 +115,77 @@ def list_batches(limit: int = 14):
     return {"items": items}
 
 @router.get("/skus")
-def list_skus(date: str, brand: str | None = None):
-    # return per-sku progress for given date
+def list_skus(request: Request, response: Response, date: str, brand: str | None = None, since: str | None = None):
+    # return per-sku progress for given date; ?since=<cursor> — только изменившиеся SKU
     if USE_DB:
-        from sqlalchemy import select, func, and_, case
+        from sqlalchemy import select, and_, func
+        from ..rollups import sku_class
+        threshold = _since_threshold(since)
         sess = get_session()
         try:
-            Frame = models.Frame; SKU = models.SKU
+            St = models.SkuFrameStats; SKU = models.SKU
             try:
                 day_start = datetime.strptime(date, "%Y-%m-%d")
             except ValueError:
                 raise HTTPException(422, "invalid date format, expected YYYY-MM-DD")
             day_end = day_start + timedelta(days=1)
-            done_case = func.sum(case((Frame.status == models.FrameStatus.DONE, 1), else_=0))
-            failed_case = func.sum(case((Frame.status == models.FrameStatus.FAILED, 1), else_=0))
+            # штамп версии дня: count/max(id) — добавленные и удалённые SKU, sum(change_seq) — любое
+            # изменение SKU или его кадров (store._bump_sku) -> 304 без сборки списка
+            stamp_q = (
+                select(func.count(SKU.id), func.max(SKU.id), func.sum(SKU.change_seq))
+                .where(and_(SKU.created_at >= day_start, SKU.created_at < day_end))
+            )
+            if brand:
+                stamp_q = stamp_q.where(SKU.brand == brand)
+            cnt, max_id, seq = sess.execute(stamp_q).one()
+            cached = not_modified(request, response, make_etag("skus", date, brand, cnt, max_id, seq, since))
+            if cached is not None:
+                return cached
             # include manual is_done flag so dashboard can visually highlight completed SKU
             q = (
                 select(
                     SKU.id, SKU.code, SKU.brand, SKU.is_done,
-                    func.count(Frame.id),
-                    done_case,
-                    failed_case,
+                    St.frames_total, St.frames_done, St.frames_failed,
+                    func.greatest(SKU.updated_at, St.updated_at).label("updated_at"),
                 )
-                .join(Frame, Frame.sku_id == SKU.id, isouter=True)
+                .join(St, St.sku_id == SKU.id, isouter=True)
                 .where(and_(SKU.created_at >= day_start, SKU.created_at < day_end))
-                .group_by(SKU.id, SKU.code, SKU.brand, SKU.is_done)
                 .order_by(SKU.id.desc())
             )
             if brand:
                 q = q.where(SKU.brand == brand)
+            ids = None
+            if threshold is not None:
+                q = q.where(func.greatest(SKU.updated_at, St.updated_at) > threshold)
+                # delta не видит удалённые SKU — отдаём все текущие id дня, клиент убирает лишние
+                ids_q = (
+                    select(SKU.id)
+                    .where(and_(SKU.created_at >= day_start, SKU.created_at < day_end))
+                    .order_by(SKU.id.desc())
+                )
+                if brand:
+                    ids_q = ids_q.where(SKU.brand == brand)
+                ids = sess.execute(ids_q).scalars().all()
             rows = sess.execute(q).fetchall()
+            cursor = max((r.updated_at for r in rows if r.updated_at), default=None)
             items: List[Dict[str, Any]] = []
             for r in rows:
-                # row layout: id, code, brand, is_done, total(count), done(sum), failed(sum)
-                total = r[4] or 0; done = r[5] or 0; failed = r[6] or 0
-                status = "IN_PROGRESS"
-                if total and done == total: status = "DONE"
-                elif failed and failed == total: status = "FAILED"
+                total = r.frames_total or 0; done = r.frames_done or 0; failed = r.frames_failed or 0
                 items.append({
                     "id": r.id,
                     "sku": r.code,
                     "brand": r.brand,
                     "frames": total,
                     "done": done,
-                    "status": status,
-                    "updatedAt": datetime.utcnow().isoformat(),
+                    "status": sku_class(total, done, failed),
+                    "updatedAt": (r.updated_at or datetime.utcnow()).isoformat(),
                     "headProfile": None,
                     "is_done": bool(getattr(r, 'is_done', False)),
                 })
-            return {"items": items}
+            out: Dict[str, Any] = {"items": items, "cursor": cursor.isoformat() if cursor else since, "delta": bool(since)}
+            if ids is not None:
+                out["ids"] = ids
+            return out
         finally:
             sess.close()
     out: List[Dict[str, Any]] = []
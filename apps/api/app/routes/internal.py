@@ -9,7 +9,14 @@
 - GET  /internal/frame/{frame_id}
 - POST /internal/frame/{frame_id}/generation
 - POST /internal/generation/{generation_id}/prediction
+- POST /internal/generation/{generation_id}/checkpoint
+- POST /internal/frame/{frame_id}/refine (полный прогон после черновика draft_mode)
+- GET  /internal/generations/stale (для sweeper'а осиротевших prediction)
+- POST /internal/batch/{date}/export, POST /internal/sku/by-code/{code}/export, GET /internal/exports/{job_id}
+  (ZIP-экспорт фоновой задачей с кэшем архива в S3, см. app/exports.py)
+- GET  /internal/metrics/sku-view-cache (hit ratio кэша вида SKU, см. app/view_cache.py)
 - GET  /internal/frame/{frame_id}/generations
+- GET  /internal/sku/by-code/{code}/events (SSE: статусы кадров/генераций SKU, см. app/events.py)
 - (опционально) debug presign/public ссылок на S3
 
 Особенности:
@@ -21,24 +28,32 @@
 from __future__ import annotations
 
 import os
+import time
 from typing import Any, Dict, List, Optional
 
-import boto3
+from botocore.exceptions import ClientError
 from fastapi import APIRouter, HTTPException, Request
-from fastapi.responses import StreamingResponse, RedirectResponse, Response
+from fastapi.responses import JSONResponse, StreamingResponse, RedirectResponse, Response
 from pydantic import BaseModel
-import io
-from PIL import Image, ImageOps
 
 # ---- store API (функции должны быть реализованы в apps/api/app/store.py) ----
 from ..store import (
     list_frames_for_sku, get_frame, set_frame_status,
     register_generation, save_generation_prediction, generations_for_frame,
-    set_generation_outputs, set_frame_outputs, append_frame_outputs_version,
+    set_generation_outputs, set_frame_outputs,
     set_frame_favorites, get_frame_favorites, get_sku_by_code, set_frame_mask,
     get_all_sku_codes, list_sku_codes_by_date, set_frame_pending_params,
-    SKU_BY_CODE, delete_frame, delete_sku, set_sku_done, set_frame_accepted
+    SKU_BY_CODE, delete_frame, delete_sku, set_sku_done, set_frame_accepted,
+    save_generation_checkpoint, set_generation_failed, get_generation,
+    list_stale_running_generations, upsert_generation_output_version,
+    list_frames_for_sku_since, sku_view_version, set_frames_meta,
 )
+from ..http_cache import make_etag, not_modified, signing_bucket
+from ..events import SSE_HEADERS, hub, sku_channel
+from ..s3util import s3_client, signed_get_url
+from ..zipstream import Entry, stream_zip
+from .. import exports, previews, renditions, view_cache
+from starlette.concurrency import run_in_threadpool
 USE_DB = bool(os.environ.get("DATABASE_URL"))
 
 router = APIRouter(prefix="/internal", tags=["internal"])
@@ -50,22 +65,16 @@ S3_ENDPOINT = os.environ.get("S3_ENDPOINT")   # если MinIO / кастом
 AWS_KEY = os.environ.get("AWS_ACCESS_KEY_ID")
 AWS_SECRET = os.environ.get("AWS_SECRET_ACCESS_KEY")
 S3_REQUIRE_SIGNED = os.environ.get("S3_REQUIRE_SIGNED", "1").lower() in ("1","true","yes","on")
+# срок жизни presigned GET для UI; подпись стабильна в окне TTL/2 (час), см. s3util.signed_get_url
+SIGNED_URL_TTL_SEC = 7200
 
 
 # =============================================================================
 # S3 helpers
 # =============================================================================
 def _s3_client():
-    """
-    Клиент S3 с поддержкой кастомного endpoint и region.
-    """
-    return boto3.client(
-        "s3",
-        endpoint_url=S3_ENDPOINT or None,
-        region_name=S3_REGION or None,
-        aws_access_key_id=AWS_KEY or None,
-        aws_secret_access_key=AWS_SECRET or None,
-    )
+    """Общий S3-клиент процесса (s3util.s3_client, тот же endpoint/region/ключи из окружения)."""
+    return s3_client()
 
 
 def _s3_public_url(key: str) -> str:
@@ -78,16 +87,11 @@ def _s3_public_url(key: str) -> str:
     return f"https://{S3_BUCKET}.s3.amazonaws.com/{key}"
 
 
-def _s3_signed_get(key: str, expires: int = 3600) -> str:
+def _s3_signed_get(key: str, expires: int = SIGNED_URL_TTL_SEC) -> str:
     """
     Presigned GET URL (если бакет приватный) — годится и для воркера, и для UI.
     """
-    cli = _s3_client()
-    return cli.generate_presigned_url(
-        "get_object",
-        Params={"Bucket": S3_BUCKET, "Key": key},
-        ExpiresIn=expires,
-    )
+    return signed_get_url(S3_BUCKET, key, expires)
 
 def _best_url_for_key(key: str) -> str:
     """Return either public or presigned URL depending on config."""
@@ -102,18 +106,61 @@ def _best_url_for_key(key: str) -> str:
     else:
         return _s3_public_url(key)
 
-def _stream_object(key: str) -> Response:
-    """Stream object bytes directly from S3 as a Response.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+def _stream_object(key: str, request: Optional[Request] = None) -> Response:
+    """Stream object bytes directly from S3 (кусками, память на запрос постоянна).
     Fallback if redirect/presign is not desired or fails. Useful to keep same-origin URL for the browser.
+    Range и If-None-Match клиента передаются в GetObject: 206 / 304 / 416 отдаёт сам S3.
     """
+    cli = _s3_client()
+    params: Dict[str, Any] = {"Bucket": S3_BUCKET, "Key": key}
+    if request is not None:
+        if request.headers.get("range"):
+            params["Range"] = request.headers["range"]
+        if request.headers.get("if-none-match"):
+            params["IfNoneMatch"] = request.headers["if-none-match"]
     try:
-        cli = _s3_client()
-        obj = cli.get_object(Bucket=S3_BUCKET, Key=key)
-        data = obj["Body"].read()
-        ctype = obj.get("ContentType") or "application/octet-stream"
-        return Response(content=data, media_type=ctype)
+        obj = cli.get_object(**params)
+    except ClientError as e:
+        status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+        if status == 304:
+            etag = e.response.get("ResponseMetadata", {}).get("HTTPHeaders", {}).get("etag")
+            return Response(status_code=304, headers={"ETag": etag} if etag else None)
+        if status == 416:
+            try:
+                size = cli.head_object(Bucket=S3_BUCKET, Key=key)["ContentLength"]
+                content_range = f"bytes */{size}"
+            except Exception:
+                content_range = "bytes */*"
+            return Response(status_code=416, headers={"Content-Range": content_range})
+        raise HTTPException(status_code=404, detail=f"object not found: {e}")
     except Exception as e:
         raise HTTPException(status_code=404, detail=f"object not found: {e}")
+    headers = {"Accept-Ranges": "bytes", "Content-Length": str(obj["ContentLength"])}
+    if obj.get("ETag"):
+        headers["ETag"] = obj["ETag"]
+    if obj.get("LastModified"):
+        headers["Last-Modified"] = obj["LastModified"].strftime("%a, %d %b %Y %H:%M:%S GMT")
+    if obj.get("CacheControl"):
+        headers["Cache-Control"] = obj["CacheControl"]
+    if obj.get("ContentRange"):
+        headers["Content-Range"] = obj["ContentRange"]
+    body = obj["Body"]
+
+    def _chunks():
+        try:
+            for chunk in body.iter_chunks(STREAM_CHUNK_SIZE):
+                yield chunk
+        finally:
+            body.close()
+
+    return StreamingResponse(
+        _chunks(),
+        status_code=206 if obj.get("ContentRange") else 200,
+        media_type=obj.get("ContentType") or "application/octet-stream",
+        headers=headers,
+    )
 
 
 # =============================================================================
@@ -140,6 +187,16 @@ def _parse_sku_id(sku_id_or_code: str) -> int:
         raise HTTPException(status_code=422, detail="Invalid sku id format")
 
 
+def _output_json(key: str) -> Dict[str, Any]:
+    """Выход: оригинал + уменьшенные копии (thumb_url — сетка, preview_url — просмотр).
+    Ключи копий выводятся из ключа, их наличие не проверяется — UI откатывается на url."""
+    obj: Dict[str, Any] = {"key": key, "url": _best_url_for_key(key)}
+    if renditions.has_renditions(key):
+        obj["thumb_url"] = _best_url_for_key(renditions.rendition_key(key, "thumb"))
+        obj["preview_url"] = _best_url_for_key(renditions.rendition_key(key, "preview"))
+    return obj
+
+
 def _frame_to_public_json(fr: Dict[str, Any]) -> Dict[str, Any]:
     """
     Формируем JSON для ответа: добавляем original_url
@@ -179,14 +236,14 @@ def _frame_to_public_json(fr: Dict[str, Any]) -> Dict[str, Any]:
             if isinstance(item, dict):
                 key = item.get("key") or item.get("url")
                 if key and '://' not in key:
-                    out["outputs"].append({"key": key, "url": _best_url_for_key(key)})
+                    out["outputs"].append(_output_json(key))
                 else:
                     out["outputs"].append({"key": key, "url": item.get("url") or key})
             elif isinstance(item, str):
                 if '://' in item:
                     out["outputs"].append({"key": item, "url": item})
                 else:
-                    out["outputs"].append({"key": item, "url": _best_url_for_key(item)})
+                    out["outputs"].append(_output_json(item))
             else:
                 continue
 
@@ -203,6 +260,10 @@ def _frame_to_public_json(fr: Dict[str, Any]) -> Dict[str, Any]:
     if fr.get("pending_params"):
         out["pending_params"] = fr.get("pending_params")
 
+    # метаданные оригинала по заголовкам (app/frame_meta.py) — воркер планирует по ним предобработку
+    if fr.get("meta"):
+        out["meta"] = fr["meta"]
+
     return out
 
 
@@ -216,35 +277,80 @@ def internal_health():
 
 ## Public webhook now handled in routes/webhooks.py
 
-@router.get("/sku/by-code/{code}/view")
-def internal_sku_view_by_code(code: str):
-    if USE_DB:
-        sku = get_sku_by_code(code)
-        if not sku:
-            raise HTTPException(status_code=404, detail="sku not found")
-        sid = sku["id"]
-    else:
-        if code not in SKU_BY_CODE:
-            raise HTTPException(status_code=404, detail="sku not found")
-        sid = SKU_BY_CODE[code]
-    frames = list_frames_for_sku(sid) or []
+def _view_frames_json(frames: List[Dict[str, Any]], frame_ids: List[int]) -> List[Dict[str, Any]]:
+    """Кадры store -> JSON вида SKU (ссылки подписываются здесь, при каждом чтении)."""
+    seq_by_id = {fid: idx for idx, fid in enumerate(frame_ids, start=1)}
     items = []
-    for idx, fr in enumerate(frames, start=1):
+    for fr in frames:
         obj = _frame_to_public_json(fr)
-        obj["seq"] = idx  # local sequential number per SKU starting at 1
+        obj["seq"] = seq_by_id.get(fr["id"])  # local sequential number per SKU starting at 1
         # добавим версионность если есть
         if fr.get("outputs_versions"):
             obj["outputs_versions"] = []
             for vers in fr["outputs_versions"]:
-                obj["outputs_versions"].append([
-                    _s3_public_url(k) if not S3_REQUIRE_SIGNED else _best_url_for_key(k) for k in vers
-                ])
+                obj["outputs_versions"].append([_output_json(k) for k in vers])
         if fr.get("pending_params"):
             obj["pending_params"] = fr.get("pending_params")
         items.append(obj)
-    sku_payload = get_sku_by_code(code)
-    is_done = bool(sku_payload.get("is_done")) if sku_payload else False
-    return {"sku": {"id": sid, "code": code, "is_done": is_done}, "frames": items}
+    return items
+
+@router.get("/sku/by-code/{code}/view")
+def internal_sku_view_by_code(code: str, request: Request, response: Response, since: Optional[str] = None):
+    """Полный вид SKU; с ?since=<cursor> — только кадры, изменённые после курсора
+    (frame_ids — все текущие id по порядку, cursor — для следующего опроса).
+    ETag по штампу версии SKU: неизменившийся вид отдаём 304 без presign и сборки JSON.
+    Полный вид в DB-режиме берётся из кэша документа (app/view_cache.py), подпись — при чтении."""
+    sku = get_sku_by_code(code)
+    if not sku:
+        raise HTTPException(status_code=404, detail="sku not found")
+    sid = sku["id"]
+    etag = make_etag(
+        sku_view_version(sid), since,
+        signing_bucket(SIGNED_URL_TTL_SEC) if S3_REQUIRE_SIGNED else None,
+    )
+    cached = not_modified(request, response, etag)
+    if cached is not None:
+        return cached
+    use_cache = USE_DB and not since
+    doc = gen = None
+    if use_cache:
+        doc, gen = view_cache.load(sid)
+    if doc is None:
+        t0 = time.perf_counter()
+        try:
+            frames, cursor, frame_ids = list_frames_for_sku_since(sid, since)
+        except ValueError:
+            raise HTTPException(status_code=422, detail="invalid since cursor")
+        doc = {"frames": frames, "cursor": cursor, "frame_ids": frame_ids}
+        if use_cache:
+            view_cache.save(sid, doc, gen, (time.perf_counter() - t0) * 1000)
+    return {
+        "sku": {"id": sid, "code": code, "is_done": bool(sku.get("is_done"))},
+        "frames": _view_frames_json(doc["frames"], doc["frame_ids"]),
+        "frame_ids": doc["frame_ids"],
+        "cursor": doc["cursor"],
+        "delta": bool(since),
+    }
+
+@router.get("/metrics/sku-view-cache")
+def internal_sku_view_cache_metrics():
+    """Hit ratio и среднее время пересборки кэша вида SKU."""
+    return view_cache.stats()
+
+@router.get("/sku/by-code/{code}/events")
+async def internal_sku_events(code: str):
+    """SSE-поток изменений кадров SKU (event: update — перечитать ?since=, event: resync — целиком).
+    Заменяет частый опрос /view: клиент делает delta-запрос только по событию."""
+    if USE_DB:
+        sku = await run_in_threadpool(get_sku_by_code, code)
+        if not sku:
+            raise HTTPException(status_code=404, detail="sku not found")
+        sid = sku["id"]
+    else:
+        if code not in SKU_BY_CODE:
+            raise HTTPException(status_code=404, detail="sku not found")
+        sid = SKU_BY_CODE[code]
+    return StreamingResponse(hub.stream(sku_channel(sid)), media_type="text/event-stream", headers=SSE_HEADERS)
 
 @router.get("/internal/s3/presign-get")
 def presign_get_url(key: str):
@@ -298,7 +404,7 @@ def internal_frame_info(frame_id: int):
     return _frame_to_public_json(fr)
 
 @router.get("/frame/{frame_id}/original")
-def internal_frame_original(frame_id: int, download: bool = False):
+def internal_frame_original(frame_id: int, request: Request, download: bool = False):
     """Return a stable URL for the original image used for mask painting.
     Strategy:
     - If original_key is known, return a Redirect to a presigned GET URL (always signed regardless of S3_REQUIRE_SIGNED),
@@ -315,22 +421,21 @@ def internal_frame_original(frame_id: int, download: bool = False):
             return RedirectResponse(url)
         except Exception:
             # As a last resort, stream the object via API
-            return _stream_object(key)
+            return _stream_object(key, request)
     url = fr.get("original_url")
     if url:
         return RedirectResponse(url)
     raise HTTPException(status_code=404, detail="original not available")
 
 @router.get("/frame/{frame_id}/preview")
-def internal_frame_preview(frame_id: int):
-    """Return a stable URL for a resized preview used by the mask painter.
-    Logic:
-    - Read original image from S3 by original_key.
-    - Downscale if long side exceeds PREVIEW_MAX_LONG_SIDE (default 2560), maintaining aspect ratio and format preference (JPEG for RGB).
-    - Store under resized/{sku_code}/{frame_id}.jpg (consistent with worker) and return a presigned/public URL.
-    - If resized already exists, just return its URL.
+def internal_frame_preview(frame_id: int, fallback: Optional[str] = None):
+    """Превью оригинала для маск-пейнтера (previews/{sku_code}/{frame_id}.jpg, см. app/previews.py).
+    Готово — 302 на ссылку. Нет — сборка уходит воркеру (одна на кадр) и ответ 202 + Retry-After;
+    с ?fallback=original вместо 202 — 302 на оригинал (для <img>, который 202 не покажет).
     """
-    from ..store import get_frame
+    ready_key = previews.ready(frame_id)
+    if ready_key:
+        return RedirectResponse(_best_url_for_key(ready_key))
     fr = get_frame(int(frame_id))
     if not fr:
         raise HTTPException(status_code=404, detail="frame not found")
@@ -339,49 +444,22 @@ def internal_frame_preview(frame_id: int):
     sku_code = sku.get("code") or f"sku_{sku.get('id') or frame_id}"
     if not key:
         raise HTTPException(status_code=404, detail="original key missing")
-    # target key for resized preview
-    target_key = f"resized/{sku_code}/{frame_id}.jpg"
-    cli = _s3_client()
-    # try head on target
-    try:
-        cli.head_object(Bucket=S3_BUCKET, Key=target_key)
-        return RedirectResponse(_best_url_for_key(target_key))
-    except Exception:
-        pass
-    # fetch original bytes
-    try:
-        obj = cli.get_object(Bucket=S3_BUCKET, Key=key)
-        data = obj["Body"].read()
-        ctype = obj.get("ContentType") or "application/octet-stream"
-    except Exception as e:
-        raise HTTPException(status_code=404, detail=f"cannot read original: {e}")
-    # decode with EXIF and resize if needed
-    try:
-        im = Image.open(io.BytesIO(data))
+    target_key = previews.preview_key(sku_code, frame_id)
+    if not previews.is_pending(frame_id):
+        # превью есть в S3, но отметка в Redis истекла — один head_object, дальше снова из Redis
         try:
-            im = ImageOps.exif_transpose(im)
+            _s3_client().head_object(Bucket=S3_BUCKET, Key=target_key)
+            previews.mark_ready(frame_id, target_key)
+            return RedirectResponse(_best_url_for_key(target_key))
         except Exception:
-            pass
-        if im.mode not in ("RGB", "RGBA"):
-            im = im.convert("RGB")
-        W, H = im.size
-        max_long = int(os.environ.get("PREVIEW_MAX_LONG_SIDE", os.environ.get("PREPROCESS_TARGET_LONG_SIDE", "2560")))
-        if max(W, H) > max_long:
-            if W >= H:
-                new_w = max_long
-                new_h = int(H * (max_long / float(W)))
-            else:
-                new_h = max_long
-                new_w = int(W * (max_long / float(H)))
-            im = im.resize((new_w, new_h), resample=Image.Resampling.LANCZOS)
-        # always store JPEG for browser-friendly preview
-        out = io.BytesIO()
-        im.save(out, format="JPEG", quality=int(os.environ.get("PREVIEW_JPEG_QUALITY", "90")))
-        out.seek(0)
-        cli.put_object(Bucket=S3_BUCKET, Key=target_key, Body=out.getvalue(), ContentType="image/jpeg")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"cannot build preview: {e}")
-    return RedirectResponse(_best_url_for_key(target_key))
+            previews.request(frame_id, key, target_key)
+    if fallback == "original":
+        return RedirectResponse(_best_url_for_key(key))
+    return JSONResponse(
+        {"status": "pending", "frame_id": int(frame_id)},
+        status_code=202,
+        headers={"Retry-After": str(previews.PREVIEW_RETRY_AFTER_SEC)},
+    )
 
 
 @router.post("/frame/{frame_id}/generation")
@@ -415,6 +493,10 @@ class _GenerationCompleteBody(BaseModel):
     status: str | None = None
     error: str | None = None
 
+class _CheckpointBody(BaseModel):
+    stage: str
+    data: dict = {}
+
 class _RedoBody(BaseModel):
     prompt: str | None = None
     prompt_strength: float | None = None
@@ -455,10 +537,28 @@ def internal_set_prediction(generation_id: int, body: _PredictionBody):
     return {"ok": True}
 
 
+# Стадии пайплайна воркера в порядке выполнения (см. worker.PIPELINE_STAGES)
+GENERATION_STAGES = ("created", "preprocessed", "masked", "submitted", "ingested")
+
+@router.post("/generation/{generation_id}/checkpoint")
+def internal_generation_checkpoint(generation_id: int, body: _CheckpointBody):
+    """Воркер фиксирует завершённую стадию пайплайна (для продолжения после ретрая/рестарта)."""
+    if body.stage not in GENERATION_STAGES:
+        raise HTTPException(status_code=422, detail=f"unknown stage: {body.stage}")
+    save_generation_checkpoint(int(generation_id), body.stage, body.data)
+    return {"ok": True, "stage": body.stage}
+
+
 @router.post("/generation/{generation_id}/complete")
 def internal_generation_complete(generation_id: int, body: _GenerationCompleteBody):
     """Worker сообщает о завершении генерации и её выходах.
-    Передаём список outputs (ключи или URL)."""
+    Передаём список outputs (ключи или URL). status=failed|canceled — генерация неуспешна."""
+    if (body.status or "").lower() in ("failed", "canceled"):
+        gen_rec = get_generation(int(generation_id)) or {}
+        set_generation_failed(int(generation_id), body.error or body.status)
+        if gen_rec.get("frame_id") is not None:
+            set_frame_status(int(gen_rec["frame_id"]), "failed")
+        return {"ok": True, "count": 0}
     outs = body.outputs or []
     # Нормализуем public S3 URL (включая региональные) -> key
     import urllib.parse
@@ -480,28 +580,10 @@ def internal_generation_complete(generation_id: int, body: _GenerationCompleteBo
         norm.append(o)
     try:
         set_generation_outputs(int(generation_id), norm)
-        # Определяем frame_id корректно для обеих реализаций store.
-        frame_id = None
-        if USE_DB:
-            # В режиме БД in-memory GENERATIONS_BY_ID пустой — достанем напрямую.
-            try:
-                from ..store import get_generation  # lazy import чтобы избежать циклов
-                gen_rec = get_generation(int(generation_id)) or {}
-                frame_id = gen_rec.get("frame_id")
-            except Exception:
-                frame_id = None
-        else:
-            # Старый путь через in-memory словарь
-            from ..store import GENERATIONS_BY_ID  # type: ignore
-            gen_rec = GENERATIONS_BY_ID.get(int(generation_id)) or {}
-            frame_id = gen_rec.get("frame_id")
-
+        # Версия выходов привязана к генерации: если webhook "output" уже создал её
+        # и дописывал выходы по одному — заменяем полным списком, а не добавляем ещё одну.
+        frame_id = upsert_generation_output_version(int(generation_id), norm, final=True)
         if frame_id is not None:
-            try:
-                append_frame_outputs_version(int(frame_id), norm)
-            except Exception:
-                # Логически не критично если версия не добавилась — продолжаем.
-                pass
             try:
                 set_frame_status(int(frame_id), "done")
             except Exception:
@@ -511,6 +593,14 @@ def internal_generation_complete(generation_id: int, body: _GenerationCompleteBo
     return {"ok": True, "count": len(norm)}
 
 
+@router.get("/generations/stale")
+def internal_stale_generations(older_than_sec: int = 900, limit: int = 20):
+    """RUNNING генерации с prediction_id без обновлений дольше older_than_sec.
+    Используется периодической задачей воркера для восстановления осиротевших prediction."""
+    limit = max(1, min(int(limit), 200))
+    return {"items": list_stale_running_generations(int(older_than_sec), limit)}
+
+
 @router.get("/frame/{frame_id}/generations")
 def internal_list_generations(frame_id: int):
     """
@@ -563,15 +653,14 @@ def internal_redo_frame(frame_id: int, body: _RedoBody | None = None):
             print(f"[api] /redo frame={frame_id} REPLACED pending_params -> {fr_after.get('pending_params')}")
         except Exception as e:
             print(f"[api] /redo frame={frame_id} debug fetch failed: {e}")
-        # Небольшая задержка чтобы транзакция точно видна воркеру (на всякий случай)
-        import time as _t; _t.sleep(0.1)
-    # enqueue
+    # enqueue (задача уходит после commit транзакции запроса — воркер увидит свежие pending_params)
     from ..celery_client import queue_process_frame
     try:
-        queue_process_frame(int(frame_id))
+        task = queue_process_frame(int(frame_id))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"enqueue failed: {e}")
-    return {"ok": True, "frame_id": int(frame_id), "params": params}
+    # coalesced=True: задача по кадру уже в очереди и возьмёт свежие pending_params
+    return {"ok": True, "frame_id": int(frame_id), "params": params, "coalesced": task is None}
 
 @router.post("/frame/{frame_id}/mask")
 def internal_set_mask(frame_id: int, body: _MaskBody):
@@ -598,6 +687,59 @@ def internal_set_mask(frame_id: int, body: _MaskBody):
         raise HTTPException(status_code=500, detail=f"failed to set mask: {e}")
     return {"ok": True, "frame_id": int(frame_id), "mask_key": key, "mask_url": _best_url_for_key(key)}
 
+class _FrameMetaBatchBody(BaseModel):
+    items: List[Dict[str, Any]]  # [{frame_id, width, height, orientation, image_format, byte_size, content_hash}]
+
+@router.post("/frames/meta")
+def internal_set_frames_meta(body: _FrameMetaBatchBody):
+    """Метаданные оригиналов от worker.extract_frame_meta (большие пачки сабмита, app/frame_meta.py)."""
+    metas = {int(it["frame_id"]): it for it in body.items if it.get("frame_id") is not None}
+    set_frames_meta(metas)
+    return {"ok": True, "frames": len(metas)}
+
+def _latest_draft_generation(frame_id: int) -> Optional[Dict[str, Any]]:
+    """Последняя генерация кадра, если это завершённый черновик (draft_mode) без полного прогона после него."""
+    gens = generations_for_frame(int(frame_id)) or []
+    if not gens:
+        return None
+    last = max(gens, key=lambda g: int(g.get("id") or 0))
+    ckpt = last.get("checkpoint") or {}
+    if ckpt.get("phase") != "draft" or str(last.get("status") or "").upper() != "COMPLETED":
+        return None
+    return last
+
+
+def _queue_refine(frame_id: int, fr: Dict[str, Any]) -> Dict[str, Any]:
+    """Полный прогон кадра (phase=full) с seed последнего черновика, если он есть."""
+    draft = _latest_draft_generation(int(frame_id))
+    seed = ((draft or {}).get("checkpoint") or {}).get("seed")
+    params = dict(fr.get("pending_params") or {})
+    params["phase"] = "full"
+    if seed is not None:
+        params["seed"] = seed
+    else:
+        params.pop("seed", None)
+    from ..store import replace_frame_pending_params
+    replace_frame_pending_params(int(frame_id), params)
+    set_frame_status(int(frame_id), "queued")
+    from ..celery_client import queue_process_frame
+    task = queue_process_frame(int(frame_id))
+    return {"seed": seed, "coalesced": task is None}
+
+
+@router.post("/frame/{frame_id}/refine")
+def internal_refine_frame(frame_id: int):
+    """Явный запрос полного прогона после черновика (тот же seed)."""
+    fr = get_frame(int(frame_id))
+    if not fr:
+        raise HTTPException(status_code=404, detail="frame not found")
+    try:
+        res = _queue_refine(int(frame_id), fr)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"enqueue failed: {e}")
+    return {"ok": True, "frame_id": int(frame_id), **res}
+
+
 @router.post("/frame/{frame_id}/accepted")
 def internal_set_accepted(frame_id: int, body: _AcceptedBody):
     fr = get_frame(int(frame_id))
@@ -607,7 +749,14 @@ def internal_set_accepted(frame_id: int, body: _AcceptedBody):
         set_frame_accepted(int(frame_id), body.accepted)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"failed to set accepted: {e}")
-    return {"ok": True, "frame_id": int(frame_id), "accepted": body.accepted}
+    refine = None
+    # принят черновик -> автоматически запускаем полный прогон с тем же seed
+    if body.accepted and _latest_draft_generation(int(frame_id)):
+        try:
+            refine = _queue_refine(int(frame_id), fr)
+        except Exception as e:
+            print(f"[api] frame={frame_id} refine enqueue failed: {e}")
+    return {"ok": True, "frame_id": int(frame_id), "accepted": body.accepted, "refine": refine}
 
 
 @router.get("/sku/by-code/{code}/export-urls")
@@ -659,171 +808,126 @@ def internal_set_favorites(frame_id: int, body: _FavBody):
 def internal_get_favorites(frame_id: int):
     return {"frame_id": int(frame_id), "favorites": get_frame_favorites(int(frame_id))}
 
-@router.get("/sku/by-code/{code}/favorites.zip")
-def internal_download_favorites_zip(code: str):
-    from io import BytesIO
-    import zipfile
-    # SKU_BY_CODE already imported
+# ---- ZIP-экспорты: архив стримится клиенту по мере скачивания объектов (app/zipstream.py) ----
+def _export_keys_for_frame(fr: Dict[str, Any]) -> List[str]:
+    """Ключи S3 для экспорта кадра: все outputs, а если их нет — favorites. Без дублей."""
+    keys: List[str] = []
+    for o in fr.get("outputs") or []:
+        k = (o.get("key") or "") if isinstance(o, dict) else str(o)
+        if k and "://" not in k:  # expect S3 key
+            keys.append(k)
+    if not keys:
+        for fv in fr.get("favorites") or []:
+            k = fv.get("key") if isinstance(fv, dict) else fv
+            if isinstance(k, str) and k:
+                keys.append(k)
+    return list(dict.fromkeys(keys))
+
+def _sku_export_entries(code: str, frames: List[Dict[str, Any]]) -> List[Entry]:
+    entries: List[Entry] = []
+    for fr in frames:
+        for k in _export_keys_for_frame(fr):
+            entries.append((f"{code}/frame_{fr['id']}/{k.split('/')[-1]}", k))
+    if not entries:
+        # маркер пустого SKU
+        entries.append((f"{code}/README.txt", b"No outputs"))
+    return entries
+
+def _s3_fetch_bytes(key: str) -> bytes:
+    return _s3_client().get_object(Bucket=S3_BUCKET, Key=key)["Body"].read()
+
+def _zip_response(entries: List[Entry], filename: str) -> StreamingResponse:
+    # список ключей собран в ручке (БД отпущена), байты качаются уже во время отдачи
+    return StreamingResponse(
+        stream_zip(entries, _s3_fetch_bytes),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
+
+def _sku_id_by_code(code: str) -> Optional[int]:
     if USE_DB:
         sku = get_sku_by_code(code)
-        if not sku:
-            raise HTTPException(status_code=404, detail="sku not found")
-        sid = sku["id"]
-    else:
-        if code not in SKU_BY_CODE:
-            raise HTTPException(status_code=404, detail="sku not found")
-        sid = SKU_BY_CODE[code]
+        return sku["id"] if sku else None
+    return SKU_BY_CODE.get(code)
+
+@router.get("/sku/by-code/{code}/favorites.zip")
+def internal_download_favorites_zip(code: str):
+    sid = _sku_id_by_code(code)
+    if not sid:
+        raise HTTPException(status_code=404, detail="sku not found")
     frames = list_frames_for_sku(sid) or []
-    # collect favorite keys
-    fav_items: list[tuple[str,str]] = []  # (key, arcname)
+    fav_items: List[Entry] = []  # (arcname, key)
     for fr in frames:
-        # safety: reload frame to ensure favorites current
-        fr_full = get_frame(int(fr.get('id')))
-        favs = (fr_full or fr).get("favorites") or []
-        for fav in favs:
+        for fav in fr.get("favorites") or []:
             k = fav.get("key") if isinstance(fav, dict) else fav
             if not isinstance(k, str) or not k:
                 continue
             name = k.split('/')[-1] or k.replace('/', '_')
-            arcname = f"{code}/frame_{fr['id']}/{name}"
-            fav_items.append((k, arcname))
+            fav_items.append((f"{code}/frame_{fr['id']}/{name}", k))
     if not fav_items:
         return {"error": "no favorites"}
-    buf = BytesIO()
-    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zf:
-        s3c = _s3_client()
-        for key, arcname in fav_items:
-            try:
-                obj = s3c.get_object(Bucket=S3_BUCKET, Key=key)
-                data = obj['Body'].read()
-                zf.writestr(arcname, data)
-            except Exception:
-                continue
-    buf.seek(0)
-    return StreamingResponse(buf, media_type='application/zip', headers={"Content-Disposition": f"attachment; filename={code}_favorites.zip"})
+    return _zip_response(fav_items, f"{code}_favorites.zip")
 
 @router.get("/sku/by-code/{code}/export.zip")
 def internal_download_sku_export(code: str):
     """Скачать ZIP со всеми результатами генераций для одного SKU.
     Если у кадра нет outputs — используем его favorites как запасной вариант.
     """
-    from io import BytesIO
-    import zipfile
+    sid = _sku_id_by_code(code)
+    if not sid:
+        raise HTTPException(status_code=404, detail="sku not found")
+    frames = list_frames_for_sku(sid) or []
+    return _zip_response(_sku_export_entries(code, frames), f"{code}.zip")
+
+def _batch_export_entries(date: str) -> List[Entry]:
+    # batch = все SKU созданные в этот date; по каждому — outputs кадров (или favorites)
     if USE_DB:
-        sku = get_sku_by_code(code)
-        if not sku:
-            raise HTTPException(status_code=404, detail="sku not found")
-        sid = sku["id"]
+        sku_codes = list(list_sku_codes_by_date(date))
     else:
-        if code not in SKU_BY_CODE:
-            raise HTTPException(status_code=404, detail="sku not found")
-        sid = SKU_BY_CODE[code]
-    frames = list_frames_for_sku(sid) or []
-    buf = BytesIO()
-    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zf:
-        s3c = _s3_client()
-        any_added = False
-        for fr in frames:
-            keys: list[str] = []
-            outs = fr.get("outputs") or []
-            if isinstance(outs, list) and outs:
-                for o in outs:
-                    if isinstance(o, dict):
-                        k = o.get("key") or ""
-                    else:
-                        k = str(o)
-                    if k and "://" not in k:
-                        keys.append(k)
-            if not keys:
-                favs = fr.get("favorites") or []
-                for fv in favs:
-                    k = fv.get("key") if isinstance(fv, dict) else fv
-                    if isinstance(k, str) and k:
-                        keys.append(k)
-            seen = set()
-            for k in keys:
-                if k in seen:
-                    continue
-                seen.add(k)
-                try:
-                    obj = s3c.get_object(Bucket=S3_BUCKET, Key=k)
-                    data = obj['Body'].read()
-                    arcname = f"{code}/frame_{fr['id']}/{k.split('/')[-1]}"
-                    zf.writestr(arcname, data)
-                    any_added = True
-                except Exception:
-                    continue
-        if not any_added:
-            zf.writestr(f"{code}/README.txt", "No outputs")
-    buf.seek(0)
-    return StreamingResponse(buf, media_type='application/zip', headers={"Content-Disposition": f"attachment; filename={code}.zip"})
+        # фильтрацию по дате опускаем (in-memory store без точной привязки) — отдаём все
+        sku_codes = list(SKU_BY_CODE.keys())
+    entries: List[Entry] = []
+    for code in sku_codes:
+        sid = _sku_id_by_code(code)
+        if not sid:
+            continue
+        entries.extend(_sku_export_entries(code, list_frames_for_sku(sid) or []))
+    return entries
 
 @router.get("/batch/{date}/export.zip")
 def internal_download_batch_export(date: str):
-    from io import BytesIO
-    import zipfile
-    # StreamingResponse imported globally
-    # batch = все SKU созданные в этот date
-    # Для каждого SKU включаем только избранные (если есть), иначе ничего.
-    sku_codes: list[str] = []
-    if USE_DB:
-        sku_codes.extend(list_sku_codes_by_date(date))
-    else:
-        for code, sid in list(SKU_BY_CODE.items()):
-            # фильтрацию по дате опускаем (in-memory store без точной привязки) — отдаём все
-            sku_codes.append(code)
-    buf = BytesIO()
-    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zf:
-        s3c = _s3_client()
-        for code in sku_codes:
-            if USE_DB:
-                sku = get_sku_by_code(code)
-                if not sku:
-                    continue
-                sid = sku["id"]
-            else:
-                sid = SKU_BY_CODE.get(code)
-                if not sid:
-                    continue
-            frames = list_frames_for_sku(sid) or []
-            any_added = False
-            for fr in frames:
-                # Prefer all outputs; if empty, fallback to favorites list
-                keys: list[str] = []
-                outs = fr.get("outputs") or []
-                if isinstance(outs, list) and outs:
-                    for o in outs:
-                        if isinstance(o, dict):
-                            k = o.get("key") or ""
-                        else:
-                            k = str(o)
-                        if k and "://" not in k:  # expect S3 key
-                            keys.append(k)
-                if not keys:
-                    favs = fr.get("favorites") or []
-                    for fv in favs:
-                        k = fv.get("key") if isinstance(fv, dict) else fv
-                        if isinstance(k, str) and k:
-                            keys.append(k)
-                # de-dup
-                seen = set()
-                for k in keys:
-                    if k in seen:
-                        continue
-                    seen.add(k)
-                    try:
-                        obj = s3c.get_object(Bucket=S3_BUCKET, Key=k)
-                        data = obj['Body'].read()
-                        arcname = f"{code}/frame_{fr['id']}/{k.split('/')[-1]}"
-                        zf.writestr(arcname, data)
-                        any_added = True
-                    except Exception:
-                        continue
-            if not any_added:
-                # маркер пустого SKU
-                zf.writestr(f"{code}/README.txt", "No outputs")
-    buf.seek(0)
-    return StreamingResponse(buf, media_type='application/zip', headers={"Content-Disposition": f"attachment; filename=batch_{date}.zip"})
+    return _zip_response(_batch_export_entries(date), f"batch_{date}.zip")
+
+# ---- экспорт как задача: архив собирает воркер в S3, клиент опрашивает статус (app/exports.py) ----
+def _export_job_response(job: Dict[str, Any]) -> JSONResponse:
+    body = dict(job)
+    if job.get("status") == "done" and job.get("key"):
+        body["url"] = _best_url_for_key(job["key"])
+        return JSONResponse(body)
+    headers = {"Location": f"/internal/exports/{job['job_id']}"}
+    if job.get("status") == "failed":
+        return JSONResponse(body, headers=headers)
+    return JSONResponse(body, status_code=202, headers=headers)
+
+@router.post("/batch/{date}/export")
+def internal_start_batch_export(date: str):
+    """Поставить (или переиспользовать) экспорт батча. 202 — собирается, 200 + url — готов."""
+    return _export_job_response(exports.ensure_job("batch", f"batch_{date}.zip", _batch_export_entries(date)))
+
+@router.post("/sku/by-code/{code}/export")
+def internal_start_sku_export(code: str):
+    sid = _sku_id_by_code(code)
+    if not sid:
+        raise HTTPException(status_code=404, detail="sku not found")
+    frames = list_frames_for_sku(sid) or []
+    return _export_job_response(exports.ensure_job("sku", f"{code}.zip", _sku_export_entries(code, frames)))
+
+@router.get("/exports/{job_id}")
+def internal_export_status(job_id: str):
+    job = exports.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="export job not found")
+    return _export_job_response(job)
 
 
 # =============================================================================
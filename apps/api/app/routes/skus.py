@@ -1,16 +1,21 @@
-import os, uuid, math
+import asyncio, os, uuid, math
 from typing import List, Optional, Dict, Any
-import boto3
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+from ..s3util import s3_client
+from fastapi import APIRouter, BackgroundTasks, UploadFile, File, HTTPException
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 from ..store import (
     SKU_BY_CODE, register_sku, register_frame, get_frame, list_frames_for_sku,
     FRAME_GENERATIONS, GENERATIONS_BY_ID, HEADS, delete_frame, delete_sku,
-    get_sku_by_code
+    get_sku_by_code, register_frames_bulk, register_skus_bulk, set_skus_head_profile
 )
 import os
 USE_DB = bool(os.environ.get("DATABASE_URL"))
-from ..celery_client import queue_process_sku, queue_process_frame
+from ..celery_client import queue_process_sku, queue_process_skus, queue_process_frame
+from ..database import after_commit
+from .. import frame_meta, previews
 
 router = APIRouter(prefix="/skus", tags=["skus"])
 
@@ -21,13 +26,7 @@ AWS_KEY = os.environ.get("AWS_ACCESS_KEY_ID")
 AWS_SECRET = os.environ.get("AWS_SECRET_ACCESS_KEY")
 
 def s3():
-    return boto3.client(
-        "s3",
-        endpoint_url=S3_ENDPOINT or None,
-        region_name=S3_REGION or None,
-        aws_access_key_id=AWS_KEY or None,
-        aws_secret_access_key=AWS_SECRET or None,
-    )
+    return s3_client()
 
 def public_url(key: str) -> str:
     return f"https://{S3_BUCKET}.s3.amazonaws.com/{key}"
@@ -89,8 +88,129 @@ def create_upload_urls(sku_code: str, body: UploadUrlsReq):
         out.append({"name": fname, "key": key, "put_url": put_url, "public_url": public_url(key)})
     return {"items": out}
 
+# ---------------- multipart upload крупных оригиналов ----------------
+# initiate -> parts (presign пачками) -> complete | abort. Клиент грузит части параллельно
+# и перезапрашивает/повторяет только упавшие. Брошенные загрузки (вкладку закрыли)
+# убирает beat-задача воркера worker.abort_stale_multipart_uploads.
+MULTIPART_PART_SIZE = max(5 * 1024 * 1024, int(os.environ.get("MULTIPART_PART_SIZE", str(8 * 1024 * 1024))))
+MULTIPART_MAX_PARTS = 10000  # лимит S3
+MULTIPART_PRESIGN_BATCH = 100
+MULTIPART_URL_TTL_SEC = 3600
+
+class MultipartInitReq(BaseModel):
+    name: Optional[str] = None
+    filename: Optional[str] = None
+    type: Optional[str] = None
+    size: int
+
+class MultipartPartsReq(BaseModel):
+    key: str
+    upload_id: str
+    part_numbers: List[int]
+
+class CompletedPart(BaseModel):
+    part_number: int
+    etag: str
+
+class MultipartCompleteReq(BaseModel):
+    key: str
+    upload_id: str
+    # без parts список частей берётся из S3 (ETag не всегда виден браузеру через CORS)
+    parts: Optional[List[CompletedPart]] = None
+
+class MultipartAbortReq(BaseModel):
+    key: str
+    upload_id: str
+
+def _check_upload_key(sku_code: str, key: str) -> None:
+    if not key.startswith(f"uploads/{sku_code}/") or ".." in key:
+        raise HTTPException(400, "key does not belong to sku")
+
+@router.post("/{sku_code}/multipart/initiate")
+def multipart_initiate(sku_code: str, body: MultipartInitReq):
+    if body.size <= 0:
+        raise HTTPException(422, "size required")
+    part_size = max(MULTIPART_PART_SIZE, math.ceil(body.size / MULTIPART_MAX_PARTS))
+    fname = FileSpec(name=body.name, filename=body.filename).real_name()
+    key = f"uploads/{sku_code}/{uuid.uuid4().hex}_{fname}"
+    r = s3().create_multipart_upload(
+        Bucket=S3_BUCKET, Key=key, ContentType=body.type or "application/octet-stream",
+    )
+    return {
+        "name": fname, "key": key, "upload_id": r["UploadId"],
+        "part_size": part_size, "part_count": math.ceil(body.size / part_size),
+        "presign_batch": MULTIPART_PRESIGN_BATCH,
+    }
+
+@router.post("/{sku_code}/multipart/parts")
+def multipart_presign_parts(sku_code: str, body: MultipartPartsReq):
+    _check_upload_key(sku_code, body.key)
+    nums = sorted(set(body.part_numbers))
+    if not nums or len(nums) > MULTIPART_PRESIGN_BATCH:
+        raise HTTPException(422, f"1..{MULTIPART_PRESIGN_BATCH} part_numbers required")
+    if nums[0] < 1 or nums[-1] > MULTIPART_MAX_PARTS:
+        raise HTTPException(422, "part_number out of range")
+    cli = s3()
+    items = [
+        {"part_number": n, "url": cli.generate_presigned_url(
+            "upload_part",
+            Params={"Bucket": S3_BUCKET, "Key": body.key, "UploadId": body.upload_id, "PartNumber": n},
+            ExpiresIn=MULTIPART_URL_TTL_SEC,
+        )}
+        for n in nums
+    ]
+    return {"items": items}
+
+def _uploaded_parts(cli, key: str, upload_id: str) -> List[Dict[str, Any]]:
+    parts: List[Dict[str, Any]] = []
+    for page in cli.get_paginator("list_parts").paginate(Bucket=S3_BUCKET, Key=key, UploadId=upload_id):
+        parts.extend({"PartNumber": p["PartNumber"], "ETag": p["ETag"]} for p in page.get("Parts") or [])
+    return parts
+
+@router.post("/{sku_code}/multipart/complete")
+def multipart_complete(sku_code: str, body: MultipartCompleteReq):
+    _check_upload_key(sku_code, body.key)
+    cli = s3()
+    if body.parts:
+        parts = [{"PartNumber": p.part_number, "ETag": p.etag} for p in body.parts]
+    else:
+        parts = _uploaded_parts(cli, body.key, body.upload_id)
+    if not parts:
+        raise HTTPException(422, "no parts uploaded")
+    parts.sort(key=lambda p: p["PartNumber"])
+    try:
+        cli.complete_multipart_upload(
+            Bucket=S3_BUCKET, Key=body.key, UploadId=body.upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+    except ClientError as e:
+        code = e.response.get("Error", {}).get("Code")
+        if code in ("InvalidPart", "InvalidPartOrder", "EntityTooSmall", "NoSuchUpload"):
+            raise HTTPException(409, f"multipart complete failed: {code}")
+        raise
+    return {"name": body.key.rsplit("/", 1)[-1].split("_", 1)[-1], "key": body.key, "public_url": public_url(body.key)}
+
+@router.post("/{sku_code}/multipart/abort")
+def multipart_abort(sku_code: str, body: MultipartAbortReq):
+    _check_upload_key(sku_code, body.key)
+    try:
+        s3().abort_multipart_upload(Bucket=S3_BUCKET, Key=body.key, UploadId=body.upload_id)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") != "NoSuchUpload":
+            raise
+    return {"ok": True}
+
+def _style_params(body) -> Dict[str, Any]:
+    return {
+        "hair_style": body.hair_style,
+        "hair_color": body.hair_color,
+        "eye_color": body.eye_color,
+        # bump prompt_strength default to 0.9 unless user changes later
+        "prompt_strength": 0.9,
+    }
+
 @router.post("/{sku_code}/submit")
-def submit_sku(sku_code: str, body: SubmitReq):
+def submit_sku(sku_code: str, body: SubmitReq, background: BackgroundTasks):
     """Register frames for SKU and optionally enqueue processing.
 
     Replaces buggy previous implementation (undefined vars)."""
@@ -111,24 +231,8 @@ def submit_sku(sku_code: str, body: SubmitReq):
     if USE_DB and body.head_id:
         head_obj = HEADS.get(body.head_id)
         if head_obj:
-            from ..database import get_session
-            from sqlalchemy import select
-            from .. import models
-            sess = get_session()
-            try:
-                trig = head_obj.get("trigger")
-                hp = None
-                if trig:
-                    hp = sess.execute(select(models.HeadProfile).where(models.HeadProfile.trigger_token == trig)).scalar_one_or_none()
-                if not hp and head_obj.get("name"):
-                    hp = sess.execute(select(models.HeadProfile).where(models.HeadProfile.name == head_obj.get("name"))).scalar_one_or_none()
-                if hp:
-                    sku_row = sess.get(models.SKU, int(sku_id))
-                    if sku_row and sku_row.head_profile_id != hp.id:
-                        sku_row.head_profile_id = hp.id
-                        sess.add(sku_row); sess.commit()
-            finally:
-                sess.close()
+            from ..store import set_sku_head_profile
+            set_sku_head_profile(sku_id, trigger=head_obj.get("trigger"), name=head_obj.get("name"))
 
     head_obj = HEADS.get(body.head_id) if body.head_id else None
     head_payload = None
@@ -142,13 +246,7 @@ def submit_sku(sku_code: str, body: SubmitReq):
 
     frame_ids: List[int] = []
     # Compose style params to persist into pending_params for each frame
-    style_params = {
-        "hair_style": body.hair_style,
-        "hair_color": body.hair_color,
-        "eye_color": body.eye_color,
-        # bump prompt_strength default to 0.9 unless user changes later
-        "prompt_strength": 0.9,
-    }
+    style_params = _style_params(body)
     from ..store import replace_frame_pending_params as _set_pending
     for it in body.items:
         fid = register_frame(sku_id, original_key=it.key, head=head_payload)
@@ -157,13 +255,91 @@ def submit_sku(sku_code: str, body: SubmitReq):
         except Exception:
             pass
         frame_ids.append(fid)
+        # превью для маск-пейнтера строит воркер заранее, не дожидаясь открытия страницы
+        after_commit(lambda fid=fid, key=it.key: previews.request(fid, key, previews.preview_key(sku_code, fid)))
 
     queued = False
     if body.enqueue:
         queue_process_sku(sku_id)
         queued = True
+    # размеры/ориентация/хэш оригиналов — по заголовкам, после ответа
+    frame_meta.schedule(background, [(fid, it.key) for fid, it in zip(frame_ids, body.items)])
     return {"sku_id": sku_id, "frame_ids": frame_ids, "queued": queued}
 
+# ---------------- пакетный сабмит (онбординг каталога) ----------------
+BULK_SUBMIT_MAX_ITEMS = int(os.environ.get("BULK_SUBMIT_MAX_ITEMS", "5000"))
+
+class BulkSku(BaseModel):
+    sku: str
+    items: List[SubmitItem]
+    brand: Optional[str] = None
+
+class BulkSubmitReq(BaseModel):
+    skus: List[BulkSku]
+    head_id: Optional[int] = 1
+    enqueue: bool = True
+    brand: Optional[str] = None  # по умолчанию для SKU без своего brand
+    hair_style: Optional[str] = None
+    hair_color: Optional[str] = None
+    eye_color: Optional[str] = None
+
+@router.post("/bulk-submit")
+def bulk_submit(body: BulkSubmitReq, background: BackgroundTasks):
+    """Много SKU за один запрос: кадры и pending_params — одним INSERT в транзакции
+    запроса (register_frames_bulk), SKU ставятся в очередь кусками после commit."""
+    if not body.skus or not any(b.items for b in body.skus):
+        raise HTTPException(422, "skus with items required")
+    total = sum(len(b.items) for b in body.skus)
+    if total > BULK_SUBMIT_MAX_ITEMS:
+        raise HTTPException(422, f"maximum {BULK_SUBMIT_MAX_ITEMS} items per bulk submit")
+    if not body.head_id:
+        raise HTTPException(422, "head_id is required")
+    if not body.hair_style or not body.hair_color or not body.eye_color:
+        raise HTTPException(422, "hair_style, hair_color and eye_color are required")
+
+    head_obj = HEADS.get(body.head_id)
+    head_payload = None
+    if head_obj and not USE_DB:
+        head_payload = {
+            "trigger_token": head_obj.get("trigger"),
+            "prompt_template": head_obj.get("prompt_template") or "a photo of {token} female model",
+            "model_version": head_obj.get("model_version"),
+            "params": head_obj.get("params") or {},
+        }
+    style_params = _style_params(body)
+    brands: Dict[str, Optional[str]] = {}
+    for b in body.skus:
+        if b.items:
+            brands.setdefault(b.sku, b.brand or body.brand)
+    # SKU — одним SELECT + одним INSERT для новых (а не get/register на каждый)
+    sku_ids = register_skus_bulk(brands)
+    rows: List[Dict[str, Any]] = []
+    for b in body.skus:
+        rows.extend({"sku_id": sku_ids[b.sku], "sku": b.sku, "original_key": it.key,
+                     "pending_params": style_params, "head": head_payload} for it in b.items)
+
+    frame_ids = register_frames_bulk(rows)
+    if head_obj:
+        # после кадров: строки счётчиков блокируются раньше строк SKU, как во всех транзакциях store
+        set_skus_head_profile(list(sku_ids.values()), trigger=head_obj.get("trigger"), name=head_obj.get("name"))
+    by_sku: Dict[str, List[int]] = {}
+    for r, fid in zip(rows, frame_ids):
+        by_sku.setdefault(r["sku"], []).append(fid)
+
+    if body.enqueue:
+        queue_process_skus(list(sku_ids.values()))
+    # после ответа (и commit): превью — пакетом в очередь "previews", метаданные — по заголовкам
+    # (большие пачки — воркеру, см. frame_meta.schedule)
+    background.add_task(previews.request_many, [
+        (fid, r["original_key"], previews.preview_key(r["sku"], fid)) for r, fid in zip(rows, frame_ids)
+    ])
+    frame_meta.schedule(background, [(fid, r["original_key"]) for r, fid in zip(rows, frame_ids)])
+    return {
+        "skus": [{"sku": code, "sku_id": sku_ids[code], "frame_ids": fids} for code, fids in by_sku.items()],
+        "frames": len(frame_ids),
+        "queued": bool(body.enqueue),
+    }
+
 @router.get("/{sku_code}")
 def sku_view_simple(sku_code: str):
     """Simple SKU view used by legacy frontend call /skus/{code}.
@@ -251,17 +427,36 @@ def delete_frame_public(sku_code: str, frame_id: int):
     return {"ok": True, "deleted_frame_id": int(frame_id)}
 
 
+# Загрузка через API (fallback, когда PUT в S3 из браузера не проходит). upload_fileobj
+# синхронный — уходит в threadpool, чтобы не держать event loop; файлы грузятся
+# параллельно (не больше UPLOAD_FILE_CONCURRENCY на процесс), крупные — частями
+# UPLOAD_PART_SIZE в UPLOAD_PART_CONCURRENCY потоков boto3.
+UPLOAD_PART_SIZE = max(5 * 1024 * 1024, int(os.environ.get("UPLOAD_PART_SIZE", str(8 * 1024 * 1024))))
+UPLOAD_PART_CONCURRENCY = int(os.environ.get("UPLOAD_PART_CONCURRENCY", "4"))
+UPLOAD_FILE_CONCURRENCY = int(os.environ.get("UPLOAD_FILE_CONCURRENCY", "4"))
+_upload_config = TransferConfig(
+    multipart_threshold=UPLOAD_PART_SIZE,
+    multipart_chunksize=UPLOAD_PART_SIZE,
+    max_concurrency=UPLOAD_PART_CONCURRENCY,
+)
+_upload_slots = asyncio.Semaphore(UPLOAD_FILE_CONCURRENCY)
+
 @router.post("/{sku_code}/upload")
 async def upload_via_api(sku_code: str, files: List[UploadFile] = File(...)):
     cli = s3()
-    out = []
-    for f in files:
+
+    async def _one(f: UploadFile) -> Dict[str, Any]:
         key = f"uploads/{sku_code}/{uuid.uuid4().hex}_{f.filename}"
-        cli.upload_fileobj(
-            f.file,
-            S3_BUCKET,
-            key,
-            ExtraArgs={"ContentType": f.content_type or "application/octet-stream"},
-        )
-        out.append({"name": f.filename, "key": key})
-    return {"items": out}
+        async with _upload_slots:
+            await run_in_threadpool(
+                cli.upload_fileobj,
+                f.file,
+                S3_BUCKET,
+                key,
+                ExtraArgs={"ContentType": f.content_type or "application/octet-stream"},
+                Config=_upload_config,
+            )
+        return {"name": f.filename, "key": key}
+
+    out = await asyncio.gather(*(_one(f) for f in files))
+    return {"items": list(out)}
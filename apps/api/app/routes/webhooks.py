@@ -1,11 +1,134 @@
-from fastapi import APIRouter, Request
+"""Публичный webhook Replicate (события start/output/completed).
+
+Prediction создаётся воркером с webhook_events_filter=["start", "output", "completed"].
+На событиях с новыми выходами (status=processing, output растёт по мере генерации)
+сразу складываем новые картинки в S3 и дописываем их в версию выходов генерации —
+UI видит первую картинку, не дожидаясь всех num_outputs. Финальное состояние
+по-прежнему фиксирует воркер через /internal/generation/{id}/complete: ключи
+детерминированы (outputs/{sku}/{frame}/{pred[:8]}_{i}{ext}), так что повторная
+выгрузка тех же выходов ничего не дублирует. Вместе с выходом кладутся его
+уменьшенные копии для UI (app/renditions.py).
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+from typing import Any, Dict, List
+from urllib.parse import urlparse
+
+import httpx
+from fastapi import APIRouter, HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+
+from .. import renditions
+from ..config import settings
+from ..database import outside_request
+from ..s3util import IMMUTABLE_CACHE_CONTROL, s3_client
+from ..store import get_frame, get_generation_by_prediction, upsert_generation_output_version
 
 router = APIRouter()
 
+# выходы качаем только с доменов Replicate (URL приходит в теле публичного запроса)
+OUTPUT_HOSTS = ("replicate.delivery", "replicate.com")
+_CONTENT_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".webp": "image/webp"}
+
+
+def _verify_signature(request: Request, body: bytes) -> bool:
+    """Подпись Replicate: HMAC-SHA256("{webhook-id}.{webhook-timestamp}.{body}") ключом из whsec_... секрета."""
+    secret = settings.replicate_webhook_secret
+    msg_id = request.headers.get("webhook-id", "")
+    ts = request.headers.get("webhook-timestamp", "")
+    sigs = request.headers.get("webhook-signature", "")
+    if not (msg_id and ts and sigs):
+        return False
+    key = base64.b64decode(secret.split("_", 1)[1] if secret.startswith("whsec_") else secret)
+    expected = base64.b64encode(hmac.new(key, f"{msg_id}.{ts}.".encode() + body, hashlib.sha256).digest()).decode()
+    for part in sigs.split():
+        _, _, sig = part.partition(",")
+        if sig and hmac.compare_digest(sig, expected):
+            return True
+    return False
+
+
+def _allowed_output_url(url: str) -> bool:
+    try:
+        u = urlparse(url)
+    except Exception:
+        return False
+    host = (u.hostname or "").lower()
+    return u.scheme == "https" and any(host == h or host.endswith("." + h) for h in OUTPUT_HOSTS)
+
+
+def _output_key(sku_code: str, frame_id: int, pred_id: str, index: int, url: str) -> str:
+    # та же схема ключей, что у воркера (ingest_prediction_outputs)
+    ext = os.path.splitext(os.path.basename(urlparse(url).path))[1].lower() or ".png"
+    if ext not in _CONTENT_TYPES:
+        ext = ".png"
+    return f"outputs/{sku_code}/{frame_id}/{pred_id[:8]}_{index}{ext}"
+
+
+def _ingest_new_outputs(gen: Dict[str, Any], pred_id: str, raw_outputs: List[str]) -> int:
+    """Скачивание, S3 и копии — без открытой транзакции запроса (уже известные ключи читаются
+    своей короткой сессией); в транзакции запроса остаётся только upsert версии выходов."""
+    frame_id = int(gen["frame_id"])
+    sku_code = gen.get("sku_code")
+    if not sku_code:
+        return 0
+    fr = outside_request(get_frame, frame_id) or {}
+    known = set(fr.get("outputs") or [])
+    new_keys: List[str] = []
+    with httpx.Client(timeout=60) as client:
+        for i, url in enumerate(raw_outputs):
+            if not isinstance(url, str) or not _allowed_output_url(url):
+                continue
+            key = _output_key(sku_code, frame_id, pred_id, i, url)
+            if key in known:
+                continue
+            try:
+                r = client.get(url)
+                r.raise_for_status()
+                s3_client().put_object(
+                    Bucket=settings.s3_bucket, Key=key, Body=r.content,
+                    ContentType=_CONTENT_TYPES.get(os.path.splitext(key)[1], "application/octet-stream"),
+                    CacheControl=IMMUTABLE_CACHE_CONTROL,
+                )
+                renditions.upload(s3_client(), settings.s3_bucket, key, r.content, IMMUTABLE_CACHE_CONTROL)
+            except Exception as e:
+                print(f"[webhook/public] output {i} of {pred_id} not ingested: {e}")
+                continue
+            new_keys.append(key)
+    if new_keys:
+        upsert_generation_output_version(int(gen["id"]), new_keys)
+    return len(new_keys)
+
+
 @router.post("/webhooks/replicate")
-async def replicate_webhook_public(payload: dict, request: Request):
+async def replicate_webhook_public(request: Request):
     # Public endpoint for Replicate webhook events (start/output/completed)
+    body = await request.body()
+    if settings.replicate_webhook_secret and not _verify_signature(request, body):
+        raise HTTPException(status_code=403, detail="bad signature")
+    try:
+        payload = json.loads(body.decode() or "{}")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid json")
     status = payload.get("status")
     pid = payload.get("id")
     print(f"[webhook/public] replicate status={status} id={pid}")
-    return {"ok": True}
+
+    raw_outputs = payload.get("output") or []
+    if not isinstance(raw_outputs, list):
+        raw_outputs = [raw_outputs]
+    # только промежуточные выходы: финальный список (succeeded) фиксирует воркер через /complete
+    if not pid or not raw_outputs or status != "processing":
+        return {"ok": True}
+
+    gen = await run_in_threadpool(outside_request, get_generation_by_prediction, pid)
+    # завершённые/упавшие генерации уже зафиксированы воркером
+    if not gen or str(gen.get("status") or "").lower() in ("completed", "failed"):
+        return {"ok": True}
+    ingested = await run_in_threadpool(_ingest_new_outputs, gen, pid, raw_outputs)
+    return {"ok": True, "ingested": ingested}
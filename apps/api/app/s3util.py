@@ -1,15 +1,174 @@
-import boto3, uuid, os, httpx
+import boto3, uuid, os, httpx, threading, time, hashlib, hmac
+from collections import OrderedDict
+from contextvars import ContextVar
 from datetime import datetime
+from typing import Optional
+from urllib.parse import quote, urlparse
+from botocore.config import Config
 from .config import settings
 
+# Один клиент на процесс: boto3-клиент потокобезопасен, а создание стоит заметных
+# миллисекунд CPU (загрузка моделей сервиса) — раньше его строили на каждую ссылку.
+S3_MAX_POOL_CONNECTIONS = int(os.environ.get("S3_MAX_POOL_CONNECTIONS", "32"))
+_client = None
+_client_pid: Optional[int] = None
+_client_lock = threading.Lock()
+
 def s3_client():
-    return boto3.client(
-        "s3",
-        endpoint_url=settings.s3_endpoint or None,
-        region_name=settings.s3_region or None,
-        aws_access_key_id=settings.aws_key or None,
-        aws_secret_access_key=settings.aws_secret or None,
+    global _client, _client_pid
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = boto3.client(
+                "s3",
+                endpoint_url=settings.s3_endpoint or None,
+                region_name=settings.s3_region or None,
+                aws_access_key_id=settings.aws_key or None,
+                aws_secret_access_key=settings.aws_secret or None,
+                config=Config(max_pool_connections=S3_MAX_POOL_CONNECTIONS),
+            )
+            _client_pid = os.getpid()
+        return _client
+
+# ---------------- presigned GET: стабильные ссылки + LRU + учёт CPU подписи ----------------
+# Ссылка подписывается началом окна (X-Amz-Date), а не текущим моментом: в пределах окна
+# (expires/2 — то же окно, что у ETag вида SKU, http_cache.signing_bucket) URL побайтно
+# одинаков между опросами и браузер берёт картинку из своего кэша. Срок жизни считается от
+# начала окна, так что в любой момент окна ссылке осталось жить не меньше expires/2.
+# boto3 подписывает только текущим временем, поэтому SigV4 query-подпись GET — своя
+# (нет ключей/сессии — fallback на boto3, без стабильности).
+SIGNED_URL_CACHE_SIZE = int(os.environ.get("SIGNED_URL_CACHE_SIZE", "20000"))
+_signed: "OrderedDict[tuple, str]" = OrderedDict()  # (bucket, key, expires, signed_at) -> url
+_signed_lock = threading.Lock()
+
+# выходы и маски пишутся под уникальными ключами и не перезаписываются
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# для уже лежащих в бакете выходов (без метаданных) Cache-Control подставляется в ответ S3
+_IMMUTABLE_GET_PREFIXES = ("outputs/",)
+_session_credentials = None
+
+def _signing_time(expires: int) -> int:
+    window = max(1, int(expires) // 2)
+    return int(time.time() // window) * window
+
+def _credentials():
+    global _session_credentials
+    if settings.aws_key and settings.aws_secret:
+        return settings.aws_key, settings.aws_secret, None
+    if _session_credentials is None:
+        _session_credentials = boto3.Session().get_credentials()
+    if _session_credentials is None:
+        return None
+    frozen = _session_credentials.get_frozen_credentials()
+    return frozen.access_key, frozen.secret_key, frozen.token
+
+def _object_location(bucket: str, key: str):
+    """(scheme, host, canonical path) объекта: кастомный endpoint (MinIO) — path-style."""
+    qkey = quote(key, safe="/~")
+    if settings.s3_endpoint:
+        u = urlparse(settings.s3_endpoint)
+        return u.scheme or "https", u.netloc, f"{u.path.rstrip('/')}/{bucket}/{qkey}"
+    region = settings.s3_region or "us-east-1"
+    if "." in bucket:  # virtual-host с точками в имени бакета ломает TLS
+        return "https", f"s3.{region}.amazonaws.com", f"/{bucket}/{qkey}"
+    return "https", f"{bucket}.s3.{region}.amazonaws.com", f"/{qkey}"
+
+def _presign_get_at(bucket: str, key: str, expires: int, signed_at: int, extra: Optional[dict] = None) -> Optional[str]:
+    """SigV4 presigned GET с заданным временем подписи. None — нет учётных данных."""
+    creds = _credentials()
+    if creds is None:
+        return None
+    access, secret, token = creds
+    region = settings.s3_region or "us-east-1"
+    t = datetime.utcfromtimestamp(signed_at)
+    amz_date, day = t.strftime("%Y%m%dT%H%M%SZ"), t.strftime("%Y%m%d")
+    scope = f"{day}/{region}/s3/aws4_request"
+    scheme, host, path = _object_location(bucket, key)
+    params = {
+        "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+        "X-Amz-Credential": f"{access}/{scope}",
+        "X-Amz-Date": amz_date,
+        "X-Amz-Expires": str(int(expires)),
+        "X-Amz-SignedHeaders": "host",
+    }
+    if token:
+        params["X-Amz-Security-Token"] = token
+    if extra:
+        params.update(extra)
+    qs = "&".join(f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}" for k, v in sorted(params.items()))
+    canonical = "\n".join(["GET", path, qs, f"host:{host}", "", "host", "UNSIGNED-PAYLOAD"])
+    to_sign = "\n".join(["AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(canonical.encode()).hexdigest()])
+    k = ("AWS4" + secret).encode()
+    for part in (day, region, "s3", "aws4_request"):
+        k = hmac.new(k, part.encode(), hashlib.sha256).digest()
+    sig = hmac.new(k, to_sign.encode(), hashlib.sha256).hexdigest()
+    return f"{scheme}://{host}{path}?{qs}&X-Amz-Signature={sig}"
+
+class SignStats:
+    __slots__ = ("signed", "cached", "seconds")
+
+    def __init__(self):
+        self.signed = 0
+        self.cached = 0
+        self.seconds = 0.0
+
+_sign_stats: ContextVar[Optional[SignStats]] = ContextVar("s3_sign_stats", default=None)
+
+def signed_get_url(bucket: str, key: str, expires: int = 3600) -> str:
+    signed_at = _signing_time(expires)
+    ck = (bucket, key, int(expires), signed_at)
+    stats = _sign_stats.get()
+    with _signed_lock:
+        url = _signed.get(ck)
+        if url is not None:
+            _signed.move_to_end(ck)
+            if stats is not None:
+                stats.cached += 1
+            return url
+    t0 = time.perf_counter()
+    immutable = key.startswith(_IMMUTABLE_GET_PREFIXES)
+    url = _presign_get_at(
+        bucket, key, expires, signed_at,
+        {"response-cache-control": IMMUTABLE_CACHE_CONTROL} if immutable else None,
     )
+    if url is None:
+        params = {"Bucket": bucket, "Key": key}
+        if immutable:
+            params["ResponseCacheControl"] = IMMUTABLE_CACHE_CONTROL
+        url = s3_client().generate_presigned_url("get_object", Params=params, ExpiresIn=expires)
+    if stats is not None:
+        stats.signed += 1
+        stats.seconds += time.perf_counter() - t0
+    with _signed_lock:
+        _signed[ck] = url
+        _signed.move_to_end(ck)
+        while len(_signed) > SIGNED_URL_CACHE_SIZE:
+            _signed.popitem(last=False)
+    return url
+
+class SigningTimingMiddleware:
+    """ASGI: считает подписи за запрос и отдаёт их в Server-Timing
+    (s3sign;dur=<мс CPU на подпись>;desc="signed=N cached=M")."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = SignStats()
+        token = _sign_stats.set(stats)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and (stats.signed or stats.cached):
+                value = f's3sign;dur={stats.seconds * 1000:.2f};desc="signed={stats.signed} cached={stats.cached}"'
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"server-timing", value.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _sign_stats.reset(token)
 
 def make_upload_key(sku: str, filename: str) -> str:
     today = datetime.utcnow().strftime("%Y/%m/%d")
@@ -37,5 +196,8 @@ async def upload_from_url(key: str, url: str):
     async with httpx.AsyncClient(timeout=60) as client:
         r = await client.get(url)
         r.raise_for_status()
-        s3_client().put_object(Bucket=settings.s3_bucket, Key=key, Body=r.content, ContentType="image/png")
+        s3_client().put_object(
+            Bucket=settings.s3_bucket, Key=key, Body=r.content, ContentType="image/png",
+            CacheControl=IMMUTABLE_CACHE_CONTROL,
+        )
     return public_url(key)
@@ -16,8 +16,8 @@ import os
 USE_DB = bool(os.environ.get("DATABASE_URL"))
 if USE_DB:
     try:
-        from .database import get_session
-        from . import models
+        from .database import get_session, request_session, after_commit
+        from . import models, rollups
     except Exception as e:  # если импорт не удался — откатываемся
         print(f"[store] disable DB mode: {e}")
         USE_DB = False
@@ -159,6 +159,24 @@ def _seed_head_egor():
 _seed_head_egor()
 
 
+# ---------------- DB session helpers ----------------
+# Внутри HTTP-запроса store-функции работают в одной сессии запроса (database.unit_of_work):
+# вместо commit — flush, единый commit (или rollback) делает зависимость после ручки.
+# Вне запроса (celery, старт приложения) — как раньше: своя сессия и commit на функцию.
+def _session():
+    sess = request_session()
+    return sess if sess is not None else get_session()
+
+def _commit(sess) -> None:
+    if sess is request_session():
+        sess.flush()
+    else:
+        sess.commit()
+
+def _release(sess) -> None:
+    if sess is not request_session():
+        sess.close()
+
 def _now() -> float: return time()
 
 # ---------------- ID helpers ----------------
@@ -181,16 +199,18 @@ def next_generation_id() -> int:
 def register_sku(code: str, brand: str | None = None) -> int:
     if USE_DB:
         from sqlalchemy import select
-        sess = get_session()
+        sess = _session()
         try:
             sku = sess.execute(select(models.SKU).where(models.SKU.code == code)).scalar_one_or_none()
             if sku:
                 return sku.id
             sku = models.SKU(code=code, brand=brand)
-            sess.add(sku); sess.commit(); sess.refresh(sku)
+            sess.add(sku); sess.flush(); sess.refresh(sku)
+            rollups.sku_created(sess, sku)
+            _commit(sess)
             return sku.id
         finally:
-            sess.close()
+            _release(sess)
     with _lock:
         if code in SKU_BY_CODE:
             return SKU_BY_CODE[code]
@@ -200,16 +220,44 @@ def register_sku(code: str, brand: str | None = None) -> int:
         SKUS_BY_ID[sid] = {"id": sid, "code": code, "brand": brand, "created_at": _now()}
         return sid
 
+def register_skus_bulk(brands: Dict[str, Optional[str]]) -> Dict[str, int]:
+    """register_sku для многих SKU ({code: brand}) -> {code: id}. В DB-режиме — один SELECT
+    по code IN (...) и один INSERT ... RETURNING для новых (+ их строки счётчиков пакетом).
+    Уникального ограничения на skus.code нет, поэтому, как и register_sku, без ON CONFLICT."""
+    if not brands:
+        return {}
+    if USE_DB:
+        from sqlalchemy import select, insert
+        S = models.SKU
+        sess = _session()
+        try:
+            out: Dict[str, int] = {}
+            for sid, code in sess.execute(select(S.id, S.code).where(S.code.in_(list(brands))).order_by(S.id)):
+                out.setdefault(code, sid)
+            missing = [c for c in brands if c not in out]
+            if missing:
+                created = sess.scalars(
+                    insert(S).returning(S, sort_by_parameter_order=True),
+                    [{"code": c, "brand": brands[c]} for c in missing],
+                ).all()
+                rollups.skus_created(sess, created)
+                _commit(sess)
+                out.update({sku.code: sku.id for sku in created})
+            return out
+        finally:
+            _release(sess)
+    return {code: register_sku(code, brand=brand) for code, brand in brands.items()}
+
 def get_sku(sku_id: int) -> Optional[Dict[str, Any]]:
     if USE_DB:
-        sess = get_session()
+        sess = _session()
         try:
             sku = sess.get(models.SKU, int(sku_id))
             if not sku:
                 return None
             return {"id": sku.id, "code": sku.code, "brand": sku.brand, "created_at": sku.created_at.timestamp() if getattr(sku.created_at,'timestamp',None) else None, "is_done": getattr(sku, 'is_done', False)}
         finally:
-            sess.close()
+            _release(sess)
     return SKUS_BY_ID.get(int(sku_id))
 
 def upsert_sku(sku_id: int, data: Dict[str, Any]) -> None:
@@ -218,6 +266,59 @@ def upsert_sku(sku_id: int, data: Dict[str, Any]) -> None:
         rec.update(data)
 
 # ---------------- Frame helpers ----------------
+def set_sku_head_profile(sku_id: int, trigger: Optional[str] = None, name: Optional[str] = None) -> None:
+    """Привязать HeadProfile (по trigger_token, иначе по имени) к SKU. Только DB-режим."""
+    if not USE_DB:
+        return
+    from sqlalchemy import select
+    sess = _session()
+    try:
+        hp = None
+        if trigger:
+            hp = sess.execute(select(models.HeadProfile).where(models.HeadProfile.trigger_token == trigger)).scalar_one_or_none()
+        if not hp and name:
+            hp = sess.execute(select(models.HeadProfile).where(models.HeadProfile.name == name)).scalar_one_or_none()
+        if hp:
+            sku_row = sess.get(models.SKU, int(sku_id))
+            if sku_row and sku_row.head_profile_id != hp.id:
+                sku_row.head_profile_id = hp.id
+                sess.add(sku_row); _bump_sku(sess, sku_row.id); _commit(sess)
+                _invalidate_view(sku_row.id)
+    finally:
+        _release(sess)
+
+def set_skus_head_profile(sku_ids: List[int], trigger: Optional[str] = None, name: Optional[str] = None) -> None:
+    """set_sku_head_profile для многих SKU одним UPDATE (строки блокируются заранее по порядку id).
+    Только DB-режим."""
+    if not USE_DB or not sku_ids:
+        return
+    from sqlalchemy import select, update
+    S = models.SKU
+    sess = _session()
+    try:
+        hp = None
+        if trigger:
+            hp = sess.execute(select(models.HeadProfile).where(models.HeadProfile.trigger_token == trigger)).scalar_one_or_none()
+        if not hp and name:
+            hp = sess.execute(select(models.HeadProfile).where(models.HeadProfile.name == name)).scalar_one_or_none()
+        if not hp:
+            return
+        ids = sorted({int(s) for s in sku_ids})
+        sess.execute(select(S.id).where(S.id.in_(ids)).order_by(S.id).with_for_update())
+        changed = sess.scalars(
+            update(S)
+            .where(S.id.in_(ids), S.head_profile_id.is_distinct_from(hp.id))
+            .values(head_profile_id=hp.id, change_seq=S.change_seq + 1)
+            .returning(S.id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        if changed:
+            _commit(sess)
+            for sid in changed:
+                _invalidate_view(sid)
+    finally:
+        _release(sess)
+
 def register_frame(
     sku_id: int,
     original_key: Optional[str] = None,
@@ -225,7 +326,7 @@ def register_frame(
     head: Optional[Dict[str, Any]] = None,
 ) -> int:
     if USE_DB:
-        sess = get_session()
+        sess = _session()
         try:
             # Optionally resolve/persist head profile id (by trigger token) if head payload present
             head_profile_id = None
@@ -239,10 +340,13 @@ def register_frame(
                 # attach via sku.head_profile_id? No, Frame only links to SKU; we keep head_profile per frame via SKU relation
                 # For now we do nothing extra; could denormalize later.
                 pass
-            sess.add(fr); sess.commit(); sess.refresh(fr)
+            sess.add(fr)
+            rollups.frame_changed(sess, int(sku_id), None, models.FrameStatus.NEW)
+            _bump_sku(sess, sku_id); _commit(sess); sess.refresh(fr)
+            _invalidate_view(sku_id)
             return fr.id
         finally:
-            sess.close()
+            _release(sess)
     fid = next_frame_id()
     add_frame({
         "id": fid,
@@ -252,9 +356,51 @@ def register_frame(
         "head": head or {"trigger_token": "tnkfwm1", "prompt_template": "a photo of {token} female model"},
         "status": "queued",
         "created_at": _now(),
+        "updated_at": _now(),
     })
     return fid
 
+def register_frames_bulk(rows: List[Dict[str, Any]]) -> List[int]:
+    """Пакетная регистрация кадров: rows = [{sku_id, original_key, pending_params, head}]
+    (head — только для in-memory, как у register_frame).
+    В DB-режиме — один INSERT ... RETURNING id на все строки и по одному обновлению
+    счётчиков на SKU, всё в одной транзакции. Возвращает id в порядке rows."""
+    if not rows:
+        return []
+    if USE_DB:
+        from sqlalchemy import insert
+        sess = _session()
+        try:
+            values = [{
+                "sku_id": int(r["sku_id"]),
+                "original_key": r.get("original_key") or "",
+                "status": models.FrameStatus.NEW,
+                "pending_params": dict(r["pending_params"]) if r.get("pending_params") is not None else None,
+            } for r in rows]
+            ids = list(sess.scalars(
+                insert(models.Frame).returning(models.Frame.id, sort_by_parameter_order=True),
+                values,
+            ))
+            per_sku: Dict[int, int] = {}
+            for v in values:
+                per_sku[v["sku_id"]] = per_sku.get(v["sku_id"], 0) + 1
+            for sid, n in sorted(per_sku.items()):  # строки счётчиков блокируются в одном порядке
+                rollups.frames_added(sess, sid, n)
+            for sid in sorted(per_sku):
+                _bump_sku(sess, sid)
+            _commit(sess)
+            for sid in per_sku:
+                _invalidate_view(sid)
+            return ids
+        finally:
+            _release(sess)
+    ids = []
+    for r in rows:
+        fid = register_frame(int(r["sku_id"]), original_key=r.get("original_key"), head=r.get("head"))
+        replace_frame_pending_params(fid, r.get("pending_params"))
+        ids.append(fid)
+    return ids
+
 def add_frame(frame: Dict[str, Any]) -> int:
     with _lock:
         fid = int(frame["id"])
@@ -263,49 +409,124 @@ def add_frame(frame: Dict[str, Any]) -> int:
         FRAME_GENERATIONS.setdefault(fid, [])
     return fid
 
-def get_frame(frame_id: int) -> Optional[Dict[str, Any]]:
+def _frame_to_dict(fr) -> Dict[str, Any]:
+    """ORM Frame -> dict. sku/head/output_versions/favorites должны быть уже загружены (_load_frames)."""
+    sku = fr.sku
+    hp = sku.head if sku is not None else None
+    head_payload = None
+    if hp is not None:
+        head_payload = {
+            "id": hp.id,
+            "name": hp.name,
+            "trigger_token": hp.trigger_token,
+            "model_version": hp.replicate_model,
+            "params": hp.params or {},
+            "prompt_template": hp.prompt_template,
+        }
+    outs_versions = [list(v.keys) for v in sorted(fr.output_versions, key=lambda v: v.version_index)]
+    flat: List[str] = []
+    for v in outs_versions:
+        flat.extend(v)
+    return {
+        "id": fr.id,
+        "sku": {"id": sku.id if sku else fr.sku_id, "code": sku.code if sku else None},
+        "original_key": fr.original_key,
+        "mask_key": fr.mask_key,
+        "status": fr.status.value if hasattr(fr.status,'value') else fr.status,
+        "outputs": flat,
+        "outputs_versions": outs_versions or None,
+        "favorites": [f.key for f in sorted(fr.favorites, key=lambda f: f.id)],
+        "accepted": getattr(fr, 'accepted', False),
+        "pending_params": fr.pending_params,
+        "head": head_payload,
+        "meta": _frame_meta(fr),
+    }
+
+# метаданные оригинала, извлечённые по заголовкам при сабмите (app/frame_meta.py)
+FRAME_META_FIELDS = ("width", "height", "orientation", "image_format", "byte_size", "content_hash")
+
+def _frame_meta(fr) -> Optional[Dict[str, Any]]:
+    if getattr(fr, "width", None) is None and getattr(fr, "content_hash", None) is None:
+        return None
+    return {f: getattr(fr, f, None) for f in FRAME_META_FIELDS}
+
+def set_frame_meta(frame_id: int, meta: Dict[str, Any]) -> None:
+    meta = {k: meta.get(k) for k in FRAME_META_FIELDS}
     if USE_DB:
-        from sqlalchemy import select
-        sess = get_session()
+        sess = _session()
         try:
             fr = sess.get(models.Frame, int(frame_id))
             if not fr:
-                return None
-            sku = sess.get(models.SKU, fr.sku_id)
-            head_payload = None
-            if sku and sku.head_profile_id:
-                hp = sess.get(models.HeadProfile, sku.head_profile_id)
-                if hp:
-                    head_payload = {
-                        "id": hp.id,
-                        "name": hp.name,
-                        "trigger_token": hp.trigger_token,
-                        "model_version": hp.replicate_model,
-                        "params": hp.params or {},
-                        "prompt_template": hp.prompt_template,
-                    }
-            versions = sess.execute(select(models.FrameOutputVersion).where(models.FrameOutputVersion.frame_id == fr.id).order_by(models.FrameOutputVersion.version_index)).scalars().all()
-            outs_versions = [list(v.keys) for v in versions]
-            flat: List[str] = []
-            for v in outs_versions:
-                flat.extend(v)
-            favs = sess.execute(select(models.FrameFavorite).where(models.FrameFavorite.frame_id == fr.id)).scalars().all()
-            favorites = [f.key for f in favs]
-            return {
-                "id": fr.id,
-                "sku": {"id": sku.id if sku else fr.sku_id, "code": sku.code if sku else None},
-                "original_key": fr.original_key,
-                "mask_key": fr.mask_key,
-                "status": fr.status.value if hasattr(fr.status,'value') else fr.status,
-                "outputs": flat,
-                "outputs_versions": outs_versions or None,
-                "favorites": favorites,
-                "accepted": getattr(fr, 'accepted', False),
-                "pending_params": fr.pending_params,
-                "head": head_payload,
-            }
+                return
+            for k, v in meta.items():
+                setattr(fr, k, v)
+            sess.add(fr); _bump_sku(sess, fr.sku_id); _commit(sess)
+            _invalidate_view(fr.sku_id)
+            return
         finally:
-            sess.close()
+            _release(sess)
+    with _lock:
+        fr = FRAMES_BY_ID.get(int(frame_id))
+        if fr is not None:
+            fr["meta"] = meta
+            fr["updated_at"] = _now()
+
+def set_frames_meta(metas: Dict[int, Dict[str, Any]]) -> None:
+    """set_frame_meta для многих кадров {frame_id: meta}: одна транзакция, один UPDATE по
+    первичному ключу на все кадры, штамп и кэш вида — по разу на SKU."""
+    if not metas:
+        return
+    if USE_DB:
+        from sqlalchemy import select, update
+        sess = _session()
+        try:
+            sku_of = dict(sess.execute(
+                select(models.Frame.id, models.Frame.sku_id).where(models.Frame.id.in_([int(f) for f in metas]))
+            ).all())
+            if not sku_of:
+                return
+            sess.execute(update(models.Frame), [
+                {"id": fid, **{k: meta.get(k) for k in FRAME_META_FIELDS}}
+                for fid, meta in ((int(f), m) for f, m in metas.items()) if fid in sku_of
+            ])
+            sku_ids = sorted(set(sku_of.values()))
+            for sid in sku_ids:
+                _bump_sku(sess, sid)
+            _commit(sess)
+            for sid in sku_ids:
+                _invalidate_view(sid)
+            return
+        finally:
+            _release(sess)
+    for fid, meta in metas.items():
+        set_frame_meta(int(fid), meta)
+
+def _load_frames(sess, *where) -> List[Dict[str, Any]]:
+    """Кадры со всем, что нужно для _frame_to_dict, за фиксированное число запросов
+    (кадры+SKU+профиль одним JOIN, версии и избранное — по одному selectin) независимо от числа кадров."""
+    from sqlalchemy import select
+    from sqlalchemy.orm import joinedload, selectinload
+    rows = sess.execute(
+        select(models.Frame)
+        .where(*where)
+        .options(
+            joinedload(models.Frame.sku).joinedload(models.SKU.head),
+            selectinload(models.Frame.output_versions),
+            selectinload(models.Frame.favorites),
+        )
+        # Order frames deterministically by id for stable per-SKU sequencing in UI
+        .order_by(models.Frame.id.asc())
+    ).unique().scalars().all()
+    return [_frame_to_dict(fr) for fr in rows]
+
+def get_frame(frame_id: int) -> Optional[Dict[str, Any]]:
+    if USE_DB:
+        sess = _session()
+        try:
+            items = _load_frames(sess, models.Frame.id == int(frame_id))
+            return items[0] if items else None
+        finally:
+            _release(sess)
     return FRAMES_BY_ID.get(int(frame_id))
 
 def list_frames() -> List[Dict[str, Any]]:
@@ -313,30 +534,148 @@ def list_frames() -> List[Dict[str, Any]]:
 
 def list_frames_for_sku(sku_id: int) -> List[Dict[str, Any]]:
     if USE_DB:
-        from sqlalchemy import select
-        sess = get_session()
+        sess = _session()
         try:
-            # Order frames deterministically by id for stable per-SKU sequencing in UI
-            rows = sess.execute(
-                select(models.Frame).where(models.Frame.sku_id == int(sku_id)).order_by(models.Frame.id.asc())
-            ).scalars().all()
-            out = []
-            for fr in rows:
-                obj = get_frame(fr.id)
-                if obj:
-                    out.append(obj)
-            return out
+            return _load_frames(sess, models.Frame.sku_id == int(sku_id))
         finally:
-            sess.close()
+            _release(sess)
     sid = _normalize_sku_id(sku_id)
     ids = SKU_FRAMES.get(sid, [])
     return [FRAMES_BY_ID[i] for i in ids if i in FRAMES_BY_ID]
 
+# ---------------- Push events (SSE) ----------------
+def _frame_event(kind: str, fr, **data) -> None:
+    """Событие об изменении кадра в каналы SKU и дня (app/events.py). Вызывать после _commit:
+    внутри HTTP-запроса публикация отложится до commit транзакции запроса."""
+    from . import events
+    if USE_DB:
+        sku = fr.sku
+        sku_id = fr.sku_id
+        frame_id = fr.id
+        day = sku.created_at.date().isoformat() if sku is not None and sku.created_at else None
+    else:
+        sku_id = (fr.get("sku") or {}).get("id")
+        frame_id = fr.get("id")
+        created = (SKUS_BY_ID.get(int(sku_id or 0)) or {}).get("created_at")
+        from datetime import datetime
+        day = datetime.utcfromtimestamp(created).strftime("%Y-%m-%d") if created else None
+    payload = {"type": kind, "frame_id": frame_id, "sku_id": sku_id, **data}
+    publish = lambda: events.publish(payload, sku_id=sku_id, day=day)
+    if USE_DB:
+        after_commit(publish)
+    else:
+        publish()
+
+def _invalidate_view(sku_id) -> None:
+    """Сбросить кэш документа вида SKU (app/view_cache.py) после commit. In-memory режим не кэширует."""
+    if not USE_DB or sku_id is None:
+        return
+    from . import view_cache
+    sid = int(sku_id)
+    after_commit(lambda: view_cache.invalidate(sid))
+
+def _bump_sku(sess, sku_id) -> None:
+    """skus.change_seq += 1 в транзакции изменения — штамп ETag вида SKU и строки дашборда.
+    updated_at = now() = начало транзакции: долгая транзакция коммитит значение меньше уже
+    отданного max и ETag не сдвигается; счётчик под блокировкой строки растёт при каждом commit.
+    Вызывать после rollups.* (порядок блокировок: счётчики кадров -> строка SKU)."""
+    if not USE_DB or sku_id is None:
+        return
+    from sqlalchemy import update
+    sess.execute(
+        update(models.SKU).where(models.SKU.id == int(sku_id)).values(change_seq=models.SKU.change_seq + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+# ---------------- Delta sync (?since=<cursor>) ----------------
+# Курсор — max(updated_at) кадров, отданных клиенту. Изменения, записанные транзакцией, которая
+# началась раньше чтения, а закоммитилась позже, могут иметь updated_at меньше курсора —
+# поэтому фильтр берёт окно перекрытия назад; повторно отданный кадр клиент просто перезапишет.
+DELTA_SYNC_OVERLAP_SEC = int(os.environ.get("DELTA_SYNC_OVERLAP_SEC", "30"))
+
+def _touch_frame(sess, fr) -> None:
+    """Поднять frames.updated_at при изменениях в связанных таблицах (версии выходов, избранное)."""
+    from sqlalchemy import func
+    fr.updated_at = func.now()
+    sess.add(fr)
+
+def parse_sync_cursor(cursor: Optional[str]):
+    """Курсор -> datetime (DB) / epoch float (in-memory). ValueError на мусор."""
+    if not cursor:
+        return None
+    if USE_DB:
+        from datetime import datetime
+        return datetime.fromisoformat(cursor)
+    return float(cursor)
+
+def _format_sync_cursor(value) -> Optional[str]:
+    if value is None:
+        return None
+    return value.isoformat() if hasattr(value, "isoformat") else repr(float(value))
+
+def sku_view_version(sku_id: int) -> str:
+    """Дешёвый штамп версии вида SKU для ETag. DB — skus.change_seq (_bump_sku в транзакции
+    каждого изменения кадров/связанных таблиц); in-memory — число кадров + max(updated_at)."""
+    if USE_DB:
+        from sqlalchemy import select
+        sess = _session()
+        try:
+            seq = sess.execute(select(models.SKU.change_seq).where(models.SKU.id == int(sku_id))).scalar()
+            return f"{int(sku_id)}:{seq}"  # id: пересозданный SKU с тем же кодом начинает счётчик заново
+        finally:
+            _release(sess)
+    frames = list_frames_for_sku(sku_id)
+    sku = SKUS_BY_ID.get(_normalize_sku_id(sku_id)) or {}
+    latest = max((fr.get("updated_at") or fr.get("created_at") or 0 for fr in frames), default=0)
+    return f"{len(frames)}:{latest}:{sku.get('updated_at')}:{sku.get('is_done')}"
+
+def list_frames_for_sku_since(sku_id: int, cursor: Optional[str]):
+    """Кадры SKU, изменённые после cursor (все — если cursor пуст).
+    Возвращает (frames, new_cursor, frame_ids): frame_ids — все текущие id по порядку,
+    чтобы клиент убрал удалённые кадры и сохранил нумерацию."""
+    since = parse_sync_cursor(cursor)
+    if USE_DB:
+        from sqlalchemy import select
+        from datetime import timedelta
+        sess = _session()
+        try:
+            rows = sess.execute(
+                select(models.Frame.id, models.Frame.updated_at)
+                .where(models.Frame.sku_id == int(sku_id))
+                .order_by(models.Frame.id.asc())
+            ).all()
+            ids = [r[0] for r in rows]
+            latest = max((r[1] for r in rows if r[1] is not None), default=since)
+            if since is None:
+                changed = ids
+            else:
+                threshold = since - timedelta(seconds=DELTA_SYNC_OVERLAP_SEC)
+                changed = [fid for fid, upd in rows if upd is None or upd > threshold]
+            frames = _load_frames(sess, models.Frame.id.in_(changed)) if changed else []
+            return frames, _format_sync_cursor(latest), ids
+        finally:
+            _release(sess)
+    frames_all = list_frames_for_sku(sku_id)
+    ids = [fr["id"] for fr in frames_all]
+    stamps = [fr.get("updated_at") or fr.get("created_at") or 0 for fr in frames_all]
+    latest = max(stamps, default=since)
+    if since is None:
+        return frames_all, _format_sync_cursor(latest), ids
+    threshold = since - DELTA_SYNC_OVERLAP_SEC
+    return [fr for fr, ts in zip(frames_all, stamps) if ts > threshold], _format_sync_cursor(latest), ids
+
+def _lock_frame(sess, frame_id: int):
+    """Кадр под SELECT ... FOR UPDATE (с перечитыванием, даже если он уже в сессии запроса).
+    Старый статус для rollups.frame_changed читать только так: иначе два параллельных
+    перехода (redo против /complete воркера) увидят один и тот же старый статус и оба
+    применят дельту к счётчикам."""
+    return sess.get(models.Frame, int(frame_id), with_for_update=True, populate_existing=True)
+
 def set_frame_status(frame_id: int, status: str) -> None:
     if USE_DB:
-        sess = get_session()
+        sess = _session()
         try:
-            fr = sess.get(models.Frame, int(frame_id))
+            fr = _lock_frame(sess, frame_id)
             if not fr:
                 return
             norm = status.upper()
@@ -350,15 +689,21 @@ def set_frame_status(frame_id: int, status: str) -> None:
                 "MASKED": models.FrameStatus.MASKED,
                 "NEW": models.FrameStatus.NEW,
             }
+            old_status = fr.status
             fr.status = mapping.get(norm, fr.status)
-            sess.add(fr); sess.commit(); return
+            rollups.frame_changed(sess, fr.sku_id, old_status, fr.status)
+            sess.add(fr); _bump_sku(sess, fr.sku_id); _commit(sess)
+            _invalidate_view(fr.sku_id)
+            _frame_event("status", fr, status=fr.status.value)
+            return
         finally:
-            sess.close()
+            _release(sess)
     with _lock:
         fr = FRAMES_BY_ID.get(int(frame_id))
         if fr is not None:
             fr["status"] = status
             fr["updated_at"] = _now()
+            _frame_event("status", fr, status=status)
 
 def set_frame_outputs(frame_id: int, outputs: List[str]) -> None:
     """Attach outputs (list of S3 keys) to a frame record.
@@ -374,20 +719,24 @@ def set_frame_outputs(frame_id: int, outputs: List[str]) -> None:
 def append_frame_outputs_version(frame_id: int, outputs: List[str]) -> None:
     if USE_DB:
         from sqlalchemy import select, func
-        sess = get_session()
+        sess = _session()
         try:
-            fr = sess.get(models.Frame, int(frame_id))
+            fr = _lock_frame(sess, frame_id)
             if not fr:
                 return
             count_versions = sess.execute(select(func.count(models.FrameOutputVersion.id)).where(models.FrameOutputVersion.frame_id == fr.id)).scalar() or 0
             ver = models.FrameOutputVersion(frame_id=fr.id, version_index=count_versions + 1, keys=list(outputs))
             sess.add(ver)
             if fr.status not in (models.FrameStatus.FAILED, models.FrameStatus.DONE):
+                rollups.frame_changed(sess, fr.sku_id, fr.status, models.FrameStatus.DONE)
                 fr.status = models.FrameStatus.DONE
-                sess.add(fr)
-            sess.commit(); return
+            _touch_frame(sess, fr)
+            _bump_sku(sess, fr.sku_id); _commit(sess)
+            _invalidate_view(fr.sku_id)
+            _frame_event("outputs", fr, count=len(outputs))
+            return
         finally:
-            sess.close()
+            _release(sess)
     with _lock:
         fr = FRAMES_BY_ID.get(int(frame_id))
         if fr is None:
@@ -401,27 +750,94 @@ def append_frame_outputs_version(frame_id: int, outputs: List[str]) -> None:
             flat.extend(v)
         fr["outputs"] = flat
         fr["updated_at"] = _now()
+        _frame_event("outputs", fr, count=len(outputs))
+
+def upsert_generation_output_version(generation_id: int, outputs: List[str], final: bool = False) -> Optional[int]:
+    """Версия выходов, привязанная к генерации: создаётся при первом выходе и дополняется
+    по мере появления новых (webhook "output"), без дублей. final=True — генерация завершена:
+    список заменяется полным и кадр помечается done. Возвращает frame_id."""
+    if USE_DB:
+        from sqlalchemy import select, func
+        sess = _session()
+        try:
+            # generation_id у версии UNIQUE: webhook "output" и /complete воркера по одной
+            # генерации сериализуются на её строке, иначе оба увидят ver is None и вставят
+            gen = sess.get(models.Generation, int(generation_id), with_for_update=True, populate_existing=True)
+            if not gen:
+                return None
+            fr = _lock_frame(sess, gen.frame_id)
+            if not fr:
+                return None
+            ver = sess.execute(
+                select(models.FrameOutputVersion).where(models.FrameOutputVersion.generation_id == gen.id)
+            ).scalar_one_or_none()
+            if ver is None:
+                max_idx = sess.execute(select(func.max(models.FrameOutputVersion.version_index)).where(models.FrameOutputVersion.frame_id == fr.id)).scalar() or 0
+                ver = models.FrameOutputVersion(frame_id=fr.id, generation_id=gen.id, version_index=max_idx + 1, keys=[])
+            keys = list(outputs) if final else list(ver.keys or []) + [k for k in outputs if k not in (ver.keys or [])]
+            ver.keys = keys
+            sess.add(ver)
+            if final and fr.status not in (models.FrameStatus.FAILED, models.FrameStatus.DONE):
+                rollups.frame_changed(sess, fr.sku_id, fr.status, models.FrameStatus.DONE)
+                fr.status = models.FrameStatus.DONE
+            _touch_frame(sess, fr)
+            _bump_sku(sess, fr.sku_id); _commit(sess)
+            _invalidate_view(fr.sku_id)
+            _frame_event("outputs", fr, count=len(keys), final=bool(final))
+            return fr.id
+        finally:
+            _release(sess)
+    with _lock:
+        gen = GENERATIONS_BY_ID.get(int(generation_id))
+        fr = FRAMES_BY_ID.get(int((gen or {}).get("frame_id") or 0))
+        if gen is None or fr is None:
+            return None
+        vers = fr.setdefault("outputs_versions", [])
+        if not vers and fr.get("outputs"):
+            vers.append(list(fr["outputs"]))
+        by_gen = fr.setdefault("output_version_by_gen", {})
+        idx = by_gen.get(int(generation_id))
+        if idx is None:
+            vers.append([])
+            idx = by_gen[int(generation_id)] = len(vers) - 1
+        if final:
+            vers[idx] = list(outputs)
+        else:
+            vers[idx].extend(k for k in outputs if k not in vers[idx])
+        flat: List[str] = []
+        for v in vers:
+            flat.extend(v)
+        fr["outputs"] = flat
+        if final and fr.get("status") not in ("failed", "done"):
+            fr["status"] = "done"
+        fr["updated_at"] = _now()
+        _frame_event("outputs", fr, count=len(vers[idx]), final=bool(final))
+        return int(gen["frame_id"])
 
 def set_frame_mask(frame_id: int, mask_key: str) -> None:
     if USE_DB:
-        sess = get_session()
+        sess = _session()
         try:
             fr = sess.get(models.Frame, int(frame_id))
             if not fr:
                 return
             fr.mask_key = mask_key
-            sess.add(fr); sess.commit(); return
+            sess.add(fr); _bump_sku(sess, fr.sku_id); _commit(sess)
+            _invalidate_view(fr.sku_id)
+            _frame_event("mask", fr)
+            return
         finally:
-            sess.close()
+            _release(sess)
     with _lock:
         fr = FRAMES_BY_ID.get(int(frame_id))
         if fr is not None:
             fr["mask_key"] = mask_key
             fr["updated_at"] = _now()
+            _frame_event("mask", fr)
 
 def set_frame_pending_params(frame_id: int, params: Dict[str, Any]) -> None:
     if USE_DB:
-        sess = get_session()
+        sess = _session()
         try:
             fr = sess.get(models.Frame, int(frame_id))
             if not fr:
@@ -429,9 +845,11 @@ def set_frame_pending_params(frame_id: int, params: Dict[str, Any]) -> None:
             merged = fr.pending_params or {}
             merged.update(params)
             fr.pending_params = merged
-            sess.add(fr); sess.commit(); return
+            sess.add(fr); _bump_sku(sess, fr.sku_id); _commit(sess)
+            _invalidate_view(fr.sku_id)
+            return
         finally:
-            sess.close()
+            _release(sess)
     with _lock:
         fr = FRAMES_BY_ID.get(int(frame_id))
         if fr is not None:
@@ -444,15 +862,17 @@ def replace_frame_pending_params(frame_id: int, params: Dict[str, Any]) -> None:
     воркер возьмёт ровно эти значения поверх head defaults.
     """
     if USE_DB:
-        sess = get_session()
+        sess = _session()
         try:
             fr = sess.get(models.Frame, int(frame_id))
             if not fr:
                 return
             fr.pending_params = dict(params) if params is not None else None
-            sess.add(fr); sess.commit(); return
+            sess.add(fr); _bump_sku(sess, fr.sku_id); _commit(sess)
+            _invalidate_view(fr.sku_id)
+            return
         finally:
-            sess.close()
+            _release(sess)
     with _lock:
         fr = FRAMES_BY_ID.get(int(frame_id))
         if fr is not None:
@@ -468,7 +888,7 @@ def set_frame_favorites(frame_id: int, keys: List[str]) -> None:
         seen.add(k); clean.append(k)
     if USE_DB:
         from sqlalchemy import delete as sqldelete, select
-        sess = get_session()
+        sess = _session()
         try:
             fr = sess.get(models.Frame, int(frame_id))
             if not fr:
@@ -477,9 +897,12 @@ def set_frame_favorites(frame_id: int, keys: List[str]) -> None:
             sess.execute(sqldelete(models.FrameFavorite).where(models.FrameFavorite.frame_id == fr.id))
             for k in clean:
                 sess.add(models.FrameFavorite(frame_id=fr.id, key=k))
-            sess.commit(); return
+            _touch_frame(sess, fr)
+            _bump_sku(sess, fr.sku_id); _commit(sess)
+            _invalidate_view(fr.sku_id)
+            return
         finally:
-            sess.close()
+            _release(sess)
     with _lock:
         fr = FRAMES_BY_ID.get(int(frame_id))
         if fr is not None:
@@ -489,12 +912,12 @@ def set_frame_favorites(frame_id: int, keys: List[str]) -> None:
 def get_frame_favorites(frame_id: int) -> List[str]:
     if USE_DB:
         from sqlalchemy import select
-        sess = get_session()
+        sess = _session()
         try:
             favs = sess.execute(select(models.FrameFavorite).where(models.FrameFavorite.frame_id == int(frame_id))).scalars().all()
             return [f.key for f in favs]
         finally:
-            sess.close()
+            _release(sess)
     fr = FRAMES_BY_ID.get(int(frame_id))
     if not fr:
         return []
@@ -502,15 +925,17 @@ def get_frame_favorites(frame_id: int) -> List[str]:
 
 def set_frame_accepted(frame_id: int, accepted: bool) -> None:
     if USE_DB:
-        sess = get_session()
+        sess = _session()
         try:
             fr = sess.get(models.Frame, int(frame_id))
             if not fr:
                 return
             fr.accepted = bool(accepted)
-            sess.add(fr); sess.commit(); return
+            sess.add(fr); _bump_sku(sess, fr.sku_id); _commit(sess)
+            _invalidate_view(fr.sku_id)
+            return
         finally:
-            sess.close()
+            _release(sess)
     with _lock:
         fr = FRAMES_BY_ID.get(int(frame_id))
         if fr is not None:
@@ -519,17 +944,21 @@ def set_frame_accepted(frame_id: int, accepted: bool) -> None:
 def delete_frame(frame_id: int) -> None:
     if USE_DB:
         from sqlalchemy import delete as sqldelete
-        sess = get_session()
+        sess = _session()
         try:
-            fr = sess.get(models.Frame, int(frame_id))
+            fr = _lock_frame(sess, frame_id)
             if not fr:
                 return
             sess.execute(sqldelete(models.FrameFavorite).where(models.FrameFavorite.frame_id == fr.id))
             sess.execute(sqldelete(models.FrameOutputVersion).where(models.FrameOutputVersion.frame_id == fr.id))
             sess.execute(sqldelete(models.Generation).where(models.Generation.frame_id == fr.id))
-            sess.delete(fr); sess.commit(); return
+            sku_id = fr.sku_id
+            rollups.frame_changed(sess, sku_id, fr.status, None)
+            sess.delete(fr); _bump_sku(sess, sku_id); _commit(sess)
+            _invalidate_view(sku_id)
+            return
         finally:
-            sess.close()
+            _release(sess)
     fid = int(frame_id)
     fr = FRAMES_BY_ID.pop(fid, None)
     if not fr:
@@ -545,7 +974,7 @@ def delete_frame(frame_id: int) -> None:
 def delete_sku(code_or_id) -> None:
     if USE_DB:
         from sqlalchemy import select, delete as sqldelete
-        sess = get_session()
+        sess = _session()
         try:
             sid: Optional[int] = None
             if isinstance(code_or_id, int):
@@ -569,11 +998,14 @@ def delete_sku(code_or_id) -> None:
                 sess.execute(sqldelete(models.FrameFavorite).where(models.FrameFavorite.frame_id == fid))
                 sess.execute(sqldelete(models.FrameOutputVersion).where(models.FrameOutputVersion.frame_id == fid))
                 sess.execute(sqldelete(models.Generation).where(models.Generation.frame_id == fid))
+            rollups.sku_deleted(sess, sid)
             sess.execute(sqldelete(models.Frame).where(models.Frame.sku_id == sid))
             sess.execute(sqldelete(models.SKU).where(models.SKU.id == sid))
-            sess.commit(); return
+            _commit(sess)
+            _invalidate_view(sid)
+            return
         finally:
-            sess.close()
+            _release(sess)
     sid = None
     if isinstance(code_or_id, int):
         sid = code_or_id
@@ -604,13 +1036,13 @@ mark_frame_status = set_frame_status
 # ---------------- Generation helpers ----------------
 def register_generation(frame_id: int) -> int:
     if USE_DB:
-        sess = get_session()
+        sess = _session()
         try:
             gen = models.Generation(frame_id=int(frame_id))
-            sess.add(gen); sess.commit(); sess.refresh(gen)
+            sess.add(gen); _commit(sess); sess.refresh(gen)
             return gen.id
         finally:
-            sess.close()
+            _release(sess)
     gid = next_generation_id()
     with _lock:
         GENERATIONS_BY_ID[gid] = {"id": gid, "frame_id": int(frame_id), "created_at": _now(), "prediction_id": None, "status": "created", "outputs": [], "meta": {}}
@@ -626,16 +1058,16 @@ def save_generation_registration(frame_id: int) -> Dict[str, Any]:
 
 def save_generation_prediction(generation_id: int, prediction_id: str) -> None:
     if USE_DB:
-        sess = get_session()
+        sess = _session()
         try:
             gen = sess.get(models.Generation, int(generation_id))
             if not gen:
                 return
             gen.replicate_prediction_id = prediction_id
             gen.status = models.GenStatus.RUNNING
-            sess.add(gen); sess.commit(); return
+            sess.add(gen); _commit(sess); return
         finally:
-            sess.close()
+            _release(sess)
     with _lock:
         gen = GENERATIONS_BY_ID.setdefault(int(generation_id), {"id": int(generation_id)})
         gen["prediction_id"] = prediction_id
@@ -644,47 +1076,187 @@ def save_generation_prediction(generation_id: int, prediction_id: str) -> None:
 
 def set_generation_outputs(generation_id: int, outputs: List[str]) -> None:
     if USE_DB:
-        sess = get_session()
+        sess = _session()
         try:
             gen = sess.get(models.Generation, int(generation_id))
             if not gen:
                 return
             gen.output_keys = list(outputs)
             gen.status = models.GenStatus.COMPLETED
-            sess.add(gen); sess.commit(); return
+            sess.add(gen); _commit(sess)
+            fr = sess.get(models.Frame, gen.frame_id)
+            if fr is not None:
+                _frame_event("generation", fr, generation_id=gen.id, status="completed")
+            return
         finally:
-            sess.close()
+            _release(sess)
     with _lock:
         gen = GENERATIONS_BY_ID.get(int(generation_id))
         if gen is not None:
             gen["outputs"] = outputs
             gen["updated_at"] = _now()
             gen["status"] = "completed"
+            fr = FRAMES_BY_ID.get(int(gen.get("frame_id") or 0))
+            if fr is not None:
+                _frame_event("generation", fr, generation_id=int(generation_id), status="completed")
+
+def set_generation_failed(generation_id: int, error: Optional[str] = None) -> None:
+    if USE_DB:
+        sess = _session()
+        try:
+            gen = sess.get(models.Generation, int(generation_id))
+            if not gen:
+                return
+            gen.status = models.GenStatus.FAILED
+            gen.error = (error or "failed")[:2048]
+            sess.add(gen); _commit(sess)
+            fr = sess.get(models.Frame, gen.frame_id)
+            if fr is not None:
+                _frame_event("generation", fr, generation_id=gen.id, status="failed")
+            return
+        finally:
+            _release(sess)
+    with _lock:
+        gen = GENERATIONS_BY_ID.get(int(generation_id))
+        if gen is not None:
+            gen["status"] = "failed"
+            gen["error"] = error or "failed"
+            gen["updated_at"] = _now()
+            fr = FRAMES_BY_ID.get(int(gen.get("frame_id") or 0))
+            if fr is not None:
+                _frame_event("generation", fr, generation_id=int(generation_id), status="failed")
+
+def save_generation_checkpoint(generation_id: int, stage: str, data: Optional[Dict[str, Any]] = None) -> None:
+    """Зафиксировать завершённую стадию пайплайна воркера и её данные (мерджим в checkpoint)."""
+    if USE_DB:
+        sess = _session()
+        try:
+            gen = sess.get(models.Generation, int(generation_id))
+            if not gen:
+                return
+            merged = dict(gen.checkpoint or {})
+            merged.update(data or {})
+            gen.checkpoint = merged
+            gen.stage = stage
+            sess.add(gen); _commit(sess); return
+        finally:
+            _release(sess)
+    with _lock:
+        gen = GENERATIONS_BY_ID.get(int(generation_id))
+        if gen is not None:
+            gen.setdefault("checkpoint", {}).update(data or {})
+            gen["stage"] = stage
+            gen["updated_at"] = _now()
+
+def _generation_to_dict(g) -> Dict[str, Any]:
+    return {
+        "id": g.id,
+        "frame_id": g.frame_id,
+        "prediction_id": g.replicate_prediction_id,
+        "status": g.status.value if hasattr(g.status,'value') else g.status,
+        "outputs": g.output_keys or [],
+        "stage": g.stage,
+        "checkpoint": g.checkpoint or {},
+    }
 
 def get_generation(generation_id: int) -> Optional[Dict[str, Any]]:
     if USE_DB:
-        sess = get_session()
+        sess = _session()
         try:
             gen = sess.get(models.Generation, int(generation_id))
             if not gen:
                 return None
-            return {"id": gen.id, "frame_id": gen.frame_id, "prediction_id": gen.replicate_prediction_id, "status": gen.status.value if hasattr(gen.status,'value') else gen.status, "outputs": gen.output_keys or []}
+            return _generation_to_dict(gen)
         finally:
-            sess.close()
+            _release(sess)
     return GENERATIONS_BY_ID.get(int(generation_id))
 
 def generations_for_frame(frame_id: int) -> List[Dict[str, Any]]:
     if USE_DB:
         from sqlalchemy import select
-        sess = get_session()
+        sess = _session()
         try:
             gens = sess.execute(select(models.Generation).where(models.Generation.frame_id == int(frame_id))).scalars().all()
-            return [{"id": g.id, "frame_id": g.frame_id, "prediction_id": g.replicate_prediction_id, "status": g.status.value if hasattr(g.status,'value') else g.status, "outputs": g.output_keys or []} for g in gens]
+            return [_generation_to_dict(g) for g in gens]
         finally:
-            sess.close()
+            _release(sess)
     gids = FRAME_GENERATIONS.get(int(frame_id), [])
     return [GENERATIONS_BY_ID[g] for g in gids if g in GENERATIONS_BY_ID]
 
+def get_generation_by_prediction(prediction_id: str) -> Optional[Dict[str, Any]]:
+    """Генерация по id prediction в Replicate (+ sku_code кадра) — для публичного webhook."""
+    if not prediction_id:
+        return None
+    if USE_DB:
+        from sqlalchemy import select
+        sess = _session()
+        try:
+            row = sess.execute(
+                select(models.Generation, models.SKU.code)
+                .join(models.Frame, models.Frame.id == models.Generation.frame_id)
+                .join(models.SKU, models.SKU.id == models.Frame.sku_id)
+                .where(models.Generation.replicate_prediction_id == prediction_id)
+                .order_by(models.Generation.id.desc())
+                .limit(1)
+            ).first()
+            if not row:
+                return None
+            d = _generation_to_dict(row[0])
+            d["sku_code"] = row[1]
+            return d
+        finally:
+            _release(sess)
+    for g in GENERATIONS_BY_ID.values():
+        if g.get("prediction_id") == prediction_id:
+            fr = FRAMES_BY_ID.get(int(g.get("frame_id") or 0)) or {}
+            return dict(g, sku_code=(fr.get("sku") or {}).get("code"))
+    return None
+
+def list_stale_running_generations(older_than_sec: int, limit: int = 20) -> List[Dict[str, Any]]:
+    """RUNNING генерации с prediction_id, которые не обновлялись дольше older_than_sec
+    (воркер, опрашивавший prediction, скорее всего перезапустился). Самые старые первыми."""
+    if USE_DB:
+        from sqlalchemy import select
+        from datetime import datetime, timedelta
+        cutoff = datetime.utcnow() - timedelta(seconds=int(older_than_sec))
+        # updated_at без coalesce — чтобы работал индекс (status, updated_at); NULL бывает
+        # только у строк до миграции 0005 (колонка добавлена с DEFAULT now())
+        touched = models.Generation.updated_at
+        sess = _session()
+        try:
+            rows = sess.execute(
+                select(models.Generation, models.SKU.code)
+                .join(models.Frame, models.Frame.id == models.Generation.frame_id)
+                .join(models.SKU, models.SKU.id == models.Frame.sku_id)
+                .where(
+                    models.Generation.status == models.GenStatus.RUNNING,
+                    models.Generation.replicate_prediction_id.is_not(None),
+                    touched < cutoff,
+                )
+                .order_by(touched.asc())
+                .limit(int(limit))
+            ).all()
+            out = []
+            for g, code in rows:
+                d = _generation_to_dict(g)
+                d["sku_code"] = code
+                out.append(d)
+            return out
+        finally:
+            _release(sess)
+    cutoff_ts = _now() - int(older_than_sec)
+    out = []
+    for g in sorted(GENERATIONS_BY_ID.values(), key=lambda x: x.get("updated_at") or x.get("created_at") or 0):
+        if g.get("status") != "submitted" or not g.get("prediction_id"):
+            continue
+        if (g.get("updated_at") or g.get("created_at") or 0) >= cutoff_ts:
+            continue
+        fr = FRAMES_BY_ID.get(int(g.get("frame_id") or 0)) or {}
+        out.append(dict(g, sku_code=(fr.get("sku") or {}).get("code")))
+        if len(out) >= int(limit):
+            break
+    return out
+
 # ---------------- Utilities ----------------
 def _normalize_sku_id(sku_id_like) -> int:
     """
@@ -711,16 +1283,19 @@ __all__ = [
     "SKU_BY_CODE", "SKU_FRAMES", "SKUS_BY_ID",
     "FRAMES_BY_ID", "FRAMES",
     "next_sku_id", "next_frame_id", "next_generation_id",
-    "register_sku", "get_sku", "upsert_sku",
+    "register_sku", "get_sku", "upsert_sku", "set_sku_head_profile",
     "get_sku_by_code",
     "get_all_sku_codes", "list_sku_codes_by_date",
     "add_frame", "register_frame", "get_frame",
-    "list_frames", "list_frames_for_sku",
+    "list_frames", "list_frames_for_sku", "list_frames_for_sku_since", "parse_sync_cursor",
+    "sku_view_version",
     "set_frame_status", "mark_frame_status",
     "GENERATIONS_BY_ID", "FRAME_GENERATIONS",
     "register_generation", "save_generation_registration",
-    "save_generation_prediction", "set_generation_outputs",
-    "get_generation", "generations_for_frame",
+    "save_generation_prediction", "set_generation_outputs", "set_generation_failed",
+    "get_generation", "generations_for_frame", "save_generation_checkpoint",
+    "list_stale_running_generations", "get_generation_by_prediction",
+    "upsert_generation_output_version",
     "set_frame_favorites", "get_frame_favorites",
         "set_frame_accepted",
     "delete_frame", "delete_sku", "set_sku_done",
@@ -730,14 +1305,14 @@ def get_sku_by_code(code: str) -> Optional[Dict[str, Any]]:
     """Return SKU dict by code (DB-aware)."""
     if USE_DB:
         from sqlalchemy import select
-        sess = get_session()
+        sess = _session()
         try:
             sku = sess.execute(select(models.SKU).where(models.SKU.code == code)).scalar_one_or_none()
             if not sku:
                 return None
             return {"id": sku.id, "code": sku.code, "brand": sku.brand, "created_at": sku.created_at.timestamp() if getattr(sku.created_at,'timestamp',None) else None, "is_done": getattr(sku, 'is_done', False)}
         finally:
-            sess.close()
+            _release(sess)
     sid = SKU_BY_CODE.get(code)
     if not sid:
         return None
@@ -747,27 +1322,33 @@ def get_all_sku_codes() -> List[str]:
     """Возвращает список всех SKU code (DB-aware)."""
     if USE_DB:
         from sqlalchemy import select
-        sess = get_session()
+        sess = _session()
         try:
             rows = sess.execute(select(models.SKU.code)).scalars().all()
             return list(rows)
         finally:
-            sess.close()
+            _release(sess)
     return list(SKU_BY_CODE.keys())
 
 def list_sku_codes_by_date(date: str) -> List[str]:
     """Список SKU codes по UTC дате (YYYY-MM-DD)."""
     if USE_DB:
-        from sqlalchemy import select, func
-        sess = get_session()
+        from sqlalchemy import select
+        from datetime import datetime as dt, timedelta
+        try:
+            day_start = dt.strptime(date, "%Y-%m-%d")
+        except ValueError:
+            return []
+        sess = _session()
         try:
+            # диапазон, а не to_char(created_at): так работает индекс ix_skus_created_at
             rows = sess.execute(
                 select(models.SKU.code)
-                .where(func.to_char(models.SKU.created_at, 'YYYY-MM-DD') == date)
+                .where(models.SKU.created_at >= day_start, models.SKU.created_at < day_start + timedelta(days=1))
             ).scalars().all()
             return list(rows)
         finally:
-            sess.close()
+            _release(sess)
     # fallback: фильтруем по created_at из in-memory
     out = []
     for code, sid in SKU_BY_CODE.items():
@@ -784,7 +1365,7 @@ def set_sku_done(code_or_id, done: bool = True) -> None:
     """Mark SKU as manually done (persistent flag)."""
     if USE_DB:
         from sqlalchemy import select
-        sess = get_session()
+        sess = _session()
         try:
             sku_obj = None
             if isinstance(code_or_id, int):
@@ -794,9 +1375,9 @@ def set_sku_done(code_or_id, done: bool = True) -> None:
             if not sku_obj:
                 return
             sku_obj.is_done = bool(done)
-            sess.add(sku_obj); sess.commit(); return
+            sess.add(sku_obj); _bump_sku(sess, sku_obj.id); _commit(sess); return
         finally:
-            sess.close()
+            _release(sess)
     # in-memory
     sid = None
     if isinstance(code_or_id, int):
@@ -805,3 +1386,4 @@ def set_sku_done(code_or_id, done: bool = True) -> None:
         sid = SKU_BY_CODE.get(str(code_or_id))
     if sid and sid in SKUS_BY_ID:
         SKUS_BY_ID[sid]['is_done'] = bool(done)
+        SKUS_BY_ID[sid]['updated_at'] = _now()
@@ -0,0 +1,98 @@
+"""Кэш документа вида SKU (/internal/sku/by-code/{code}/view) в Redis.
+
+Документ — уже сериализованный JSON кадров SKU в форме store (ключи S3, без URL):
+подпись ссылок делается при чтении, поэтому срок жизни документа не связан со сроком
+жизни presigned URL. Сбрасывают кэш store-мутации (статус, маска, выходы, избранное,
+accepted, pending_params, удаление) — после commit, через store._invalidate_view.
+
+Гонка «пересборка прочитала старые данные, инвалидация прошла до записи в кэш»
+закрыта счётчиком поколения: invalidate делает INCR fc:skuview:gen:{id}, документ
+хранит поколение, с которым собирался, и при расхождении считается промахом.
+
+Метрики (hits/misses/rebuilds/rebuild_ms) копятся в hash fc:metrics:skuview
+и видны через GET /internal/metrics/sku-view-cache. Redis недоступен — кэша нет,
+вид собирается как раньше.
+"""
+from __future__ import annotations
+
+import json
+import os
+from typing import Any, Dict, Optional, Tuple
+
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+VIEW_CACHE_TTL_SEC = int(os.environ.get("SKU_VIEW_CACHE_TTL_SEC", "600"))
+METRICS_KEY = "fc:metrics:skuview"
+
+_client = None
+
+
+def _redis():
+    global _client
+    if _client is None:
+        import redis
+        _client = redis.Redis.from_url(REDIS_URL)
+    return _client
+
+
+def _doc_key(sku_id: int) -> str:
+    return f"fc:skuview:{int(sku_id)}"
+
+
+def _gen_key(sku_id: int) -> str:
+    return f"fc:skuview:gen:{int(sku_id)}"
+
+
+def load(sku_id: int) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """(документ, поколение). Документ None — промах; поколение передать в save() после
+    пересборки. Поколение None — Redis недоступен, сохранять нечего."""
+    try:
+        r = _redis()
+        raw, gen = r.mget(_doc_key(sku_id), _gen_key(sku_id))
+        gen = gen.decode() if gen else "0"
+        doc = json.loads(raw) if raw else None
+        hit = doc is not None and doc.get("gen") == gen
+        r.hincrby(METRICS_KEY, "hits" if hit else "misses", 1)
+        return (doc if hit else None), gen
+    except Exception as e:
+        print(f"[view_cache] load failed: {e}")
+        return None, None
+
+
+def save(sku_id: int, doc: Dict[str, Any], gen: Optional[str], build_ms: float) -> None:
+    if gen is None:
+        return
+    try:
+        pipe = _redis().pipeline(transaction=False)
+        pipe.set(_doc_key(sku_id), json.dumps({**doc, "gen": gen}, default=str), ex=VIEW_CACHE_TTL_SEC)
+        pipe.hincrby(METRICS_KEY, "rebuilds", 1)
+        pipe.hincrbyfloat(METRICS_KEY, "rebuild_ms", round(build_ms, 3))
+        pipe.execute()
+    except Exception as e:
+        print(f"[view_cache] save failed: {e}")
+
+
+def invalidate(sku_id: int) -> None:
+    try:
+        pipe = _redis().pipeline(transaction=False)
+        pipe.incr(_gen_key(sku_id))
+        pipe.expire(_gen_key(sku_id), VIEW_CACHE_TTL_SEC * 2)
+        pipe.delete(_doc_key(sku_id))
+        pipe.execute()
+    except Exception as e:
+        print(f"[view_cache] invalidate failed: {e}")
+
+
+def stats() -> Dict[str, Any]:
+    try:
+        raw = _redis().hgetall(METRICS_KEY)
+    except Exception as e:
+        return {"error": str(e)}
+    vals = {k.decode(): float(v) for k, v in raw.items()}
+    hits, misses, rebuilds = vals.get("hits", 0), vals.get("misses", 0), vals.get("rebuilds", 0)
+    return {
+        "hits": int(hits),
+        "misses": int(misses),
+        "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else None,
+        "rebuilds": int(rebuilds),
+        "avg_rebuild_ms": round(vals.get("rebuild_ms", 0) / rebuilds, 2) if rebuilds else None,
+    }
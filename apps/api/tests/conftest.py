@@ -0,0 +1,11 @@
+import os
+import sys
+
+# app/ импортируется пакетом из apps/api, как при запуске uvicorn app.main:app
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# модули читают окружение при импорте; БД, Redis и S3 тесты не трогают
+os.environ.setdefault("S3_BUCKET", "test-bucket")
+os.environ.setdefault("S3_REGION", "eu-central-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "AKIDEXAMPLE")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY")
@@ -0,0 +1,82 @@
+import io
+
+import pytest
+
+pytest.importorskip("PIL")
+pytest.importorskip("boto3")
+from PIL import Image
+
+from app import frame_meta
+from app.frame_meta import _parse, _total_size
+
+
+def _jpeg(size=(640, 480), orientation=None, **save):
+    im = Image.new("RGB", size, (200, 10, 10))
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    buf = io.BytesIO()
+    im.save(buf, "JPEG", exif=exif.tobytes(), **save)
+    return buf.getvalue()
+
+
+def _encoded(fmt, size=(300, 200), mode="RGB"):
+    buf = io.BytesIO()
+    Image.new(mode, size).save(buf, fmt)
+    return buf.getvalue()
+
+
+def test_jpeg_with_orientation():
+    assert _parse(_jpeg((640, 480), orientation=6)) == {
+        "width": 640, "height": 480, "image_format": "jpeg", "orientation": 6,
+    }
+
+
+def test_jpeg_without_exif():
+    assert _parse(_jpeg((64, 32)))["orientation"] is None
+
+
+@pytest.mark.parametrize("fmt,mode", [("PNG", "RGBA"), ("WEBP", "RGB"), ("GIF", "P")])
+def test_other_formats(fmt, mode):
+    meta = _parse(_encoded(fmt, mode=mode))
+    assert meta == {"width": 300, "height": 200, "image_format": fmt.lower(), "orientation": None}
+
+
+def test_header_prefix_is_enough():
+    data = _jpeg((2000, 1500), orientation=3, quality=95)
+    meta = _parse(data[:4096])
+    assert (meta["width"], meta["height"], meta["orientation"]) == (2000, 1500, 3)
+
+
+def test_truncated_png_does_not_decode():
+    data = _encoded("PNG", size=(1200, 900))
+    assert _parse(data[:64])["width"] == 1200
+
+
+@pytest.mark.parametrize("data", [b"", b"not an image", b"\xff\xd8\xff"])
+def test_garbage_is_none(data):
+    assert _parse(data) is None
+
+
+def test_total_size():
+    assert _total_size({"ContentRange": "bytes 0-65535/31457280", "ContentLength": 65536}) == 31457280
+    assert _total_size({"ContentLength": 1234}) == 1234  # объект меньше окна — без Content-Range
+    assert _total_size({"ContentRange": "bytes 0-9/*", "ContentLength": 10}) == 10
+
+
+def test_extract_grows_window_until_header_fits(monkeypatch):
+    # большой EXIF до SOF: первого окна не хватает
+    data = _jpeg((800, 600), orientation=8, comment=b"x" * 60_000)
+    monkeypatch.setattr(frame_meta, "FRAME_META_HEAD_BYTES", 1024)
+    monkeypatch.setattr(frame_meta, "FRAME_META_MAX_BYTES", 1 << 20)
+    windows = []
+
+    def fake_head(key, n):
+        windows.append(n)
+        return data[:n], {"ContentRange": f"bytes 0-{n - 1}/{len(data)}", "ETag": '"abc-2"'}
+
+    monkeypatch.setattr(frame_meta, "_head", fake_head)
+    meta = frame_meta.extract("uploads/x.jpg")
+    assert meta == {"byte_size": len(data), "content_hash": "abc-2", "width": 800, "height": 600,
+                    "image_format": "jpeg", "orientation": 8}
+    assert windows[0] == 1024 and windows == sorted(windows) and len(windows) > 1
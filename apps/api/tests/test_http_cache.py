@@ -0,0 +1,58 @@
+import pytest
+
+pytest.importorskip("fastapi")
+from fastapi import Request, Response
+
+from app import http_cache
+from app.http_cache import make_etag, not_modified, signing_bucket
+
+
+def _request(if_none_match=None):
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match is not None else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+
+def test_make_etag_is_weak_and_stable():
+    tag = make_etag("skus", "2025-09-01", None, 3, "7:12")
+    assert tag.startswith('W/"') and tag.endswith('"')
+    assert tag == make_etag("skus", "2025-09-01", None, 3, "7:12")
+    assert tag != make_etag("skus", "2025-09-01", None, 3, "7:13")
+    # разбиение на части входит в штамп
+    assert make_etag("ab", "c") != make_etag("a", "bc")
+
+
+def test_first_request_gets_etag_and_body():
+    response = Response()
+    tag = make_etag("v", 1)
+    assert not_modified(_request(), response, tag) is None
+    assert response.headers["ETag"] == tag
+    assert response.headers["Cache-Control"] == "no-cache"
+
+
+@pytest.mark.parametrize("header", [
+    "{tag}",
+    '"other", {tag}',
+    "{bare}",  # прокси снял W/ — слабое сравнение всё равно совпадает
+    "*",
+])
+def test_matching_if_none_match_gets_304(header):
+    tag = make_etag("v", 1)
+    resp = not_modified(_request(header.format(tag=tag, bare=tag[2:])), Response(), tag)
+    assert resp is not None and resp.status_code == 304
+    assert resp.headers["ETag"] == tag
+    assert resp.headers["Cache-Control"] == "no-cache"
+    assert resp.body == b""
+
+
+def test_changed_version_is_not_304():
+    old, new = make_etag("v", 1), make_etag("v", 2)
+    response = Response()
+    assert not_modified(_request(old), response, new) is None
+    assert response.headers["ETag"] == new
+
+
+def test_signing_bucket_changes_every_half_ttl(monkeypatch):
+    monkeypatch.setattr(http_cache.time, "time", lambda: 3599.0)
+    assert signing_bucket(7200) == 0
+    monkeypatch.setattr(http_cache.time, "time", lambda: 3600.0)
+    assert signing_bucket(7200) == 1
@@ -0,0 +1,105 @@
+import random
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+from app import rollups
+from app.models import FrameStatus
+from app.rollups import _day_deltas, sku_class
+
+NEW, RUNNING, DONE, FAILED = FrameStatus.NEW, FrameStatus.RUNNING, FrameStatus.DONE, FrameStatus.FAILED
+
+
+@pytest.mark.parametrize("total,done,failed,expected", [
+    (0, 0, 0, "IN_PROGRESS"),  # SKU без кадров не считается готовым
+    (3, 3, 0, "DONE"),
+    (3, 0, 3, "FAILED"),
+    (3, 2, 1, "IN_PROGRESS"),
+    (3, 2, 0, "IN_PROGRESS"),
+])
+def test_sku_class(total, done, failed, expected):
+    assert sku_class(total, done, failed) == expected
+
+
+@pytest.mark.parametrize("old,new,expected", [
+    (None, NEW, (1, 0, 0)),
+    (NEW, RUNNING, (0, 0, 0)),  # счётчики не меняются — _apply ничего не пишет
+    (RUNNING, DONE, (0, 1, 0)),
+    (DONE, FAILED, (0, -1, 1)),
+    (FAILED, RUNNING, (0, 0, -1)),
+    (DONE, None, (-1, -1, 0)),
+    (FAILED, None, (-1, 0, -1)),
+])
+def test_frame_changed_deltas(monkeypatch, old, new, expected):
+    seen = []
+    monkeypatch.setattr(rollups, "_apply", lambda sess, sku_id, dt, dd, df: seen.append((dt, dd, df)))
+    rollups.frame_changed(None, 1, old, new)
+    assert seen == [expected]
+
+
+def test_apply_without_changes_touches_nothing():
+    # sess=None: любое обращение к сессии упало бы
+    rollups._apply(None, 1, 0, 0, 0)
+
+
+@pytest.mark.parametrize("after,delta,skus_done,skus_failed", [
+    ((2, 2, 0), (0, 1, 0), 1, 0),     # последний кадр готов -> SKU DONE
+    ((2, 1, 0), (0, -1, 0), -1, 0),   # redo готового кадра -> SKU снова в работе
+    ((2, 0, 2), (0, 0, 1), 0, 1),     # упал последний кадр -> SKU FAILED
+    ((3, 2, 0), (1, 0, 0), -1, 0),    # новый кадр в готовый SKU
+    ((1, 1, 0), (-1, -1, 0), 0, 0),   # удалён готовый кадр, SKU остался DONE
+    ((0, 0, 0), (-1, -1, 0), -1, 0),  # удалён единственный (готовый) кадр
+    ((1, 0, 1), (0, -1, 1), -1, 1),   # DONE -> FAILED одним переходом
+])
+def test_day_deltas(after, delta, skus_done, skus_failed):
+    d = _day_deltas(*after, *delta)
+    assert d == {
+        "frames_total": delta[0], "frames_done": delta[1], "frames_failed": delta[2],
+        "skus_done": skus_done, "skus_failed": skus_failed,
+    }
+
+
+def test_incremental_counters_match_recount(monkeypatch):
+    """Случайные переходы кадров через frame_changed/_apply сходятся с пересчётом с нуля."""
+    rng = random.Random(7)
+    sku_stats = {sid: [0, 0, 0] for sid in range(5)}
+    day = {k: 0 for k in ("frames_total", "frames_done", "frames_failed", "skus_done", "skus_failed")}
+
+    def fake_apply(sess, sku_id, dt, dd, df):
+        st = sku_stats[sku_id]
+        st[0] += dt; st[1] += dd; st[2] += df
+        for k, v in _day_deltas(*st, dt, dd, df).items():
+            day[k] += v
+
+    monkeypatch.setattr(rollups, "_apply", fake_apply)
+    frames = {}  # frame_id -> (sku_id, status)
+    statuses = [NEW, RUNNING, DONE, FAILED]
+    for fid in range(400):
+        op = rng.random()
+        if op < 0.4 or not frames:
+            sid = rng.randrange(5)
+            frames[fid] = (sid, NEW)
+            rollups.frame_changed(None, sid, None, NEW)
+        elif op < 0.9:
+            f = rng.choice(list(frames))
+            sid, old = frames[f]
+            new = rng.choice(statuses)
+            frames[f] = (sid, new)
+            rollups.frame_changed(None, sid, old, new)
+        else:
+            f = rng.choice(list(frames))
+            sid, old = frames.pop(f)
+            rollups.frame_changed(None, sid, old, None)
+
+    expected = {k: 0 for k in day}
+    for sid in sku_stats:
+        sts = [s for (fs, s) in frames.values() if fs == sid]
+        total, done, failed = len(sts), sts.count(DONE), sts.count(FAILED)
+        assert sku_stats[sid] == [total, done, failed]
+        cls = sku_class(total, done, failed)
+        expected["frames_total"] += total
+        expected["frames_done"] += done
+        expected["frames_failed"] += failed
+        expected["skus_done"] += cls == "DONE"
+        expected["skus_failed"] += cls == "FAILED"
+    assert day == expected
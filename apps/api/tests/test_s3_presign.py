@@ -0,0 +1,93 @@
+"""s3util._presign_get_at (своя SigV4-подпись со временем начала окна) против botocore."""
+import datetime as dt
+from urllib.parse import parse_qsl, urlsplit
+
+import pytest
+
+pytest.importorskip("boto3")
+import boto3
+import botocore.auth
+from botocore.config import Config
+
+from app import s3util
+from app.config import settings
+
+SIGNED_AT = 1_757_000_000  # 2025-09-04T15:33:20Z
+
+
+class _FrozenDatetime(dt.datetime):
+    @classmethod
+    def utcnow(cls):
+        return dt.datetime(1970, 1, 1) + dt.timedelta(seconds=SIGNED_AT)
+
+
+@pytest.fixture
+def frozen_botocore(monkeypatch):
+    monkeypatch.setattr(botocore.auth.datetime, "datetime", _FrozenDatetime)
+
+
+def _botocore_url(bucket, key, expires, token=None, endpoint=None, addressing="virtual", extra=None):
+    client = boto3.client(
+        "s3",
+        region_name=settings.s3_region,
+        endpoint_url=endpoint,
+        aws_access_key_id=settings.aws_key,
+        aws_secret_access_key=settings.aws_secret,
+        aws_session_token=token,
+        config=Config(signature_version="s3v4", s3={"addressing_style": addressing}),
+    )
+    return client.generate_presigned_url(
+        "get_object", Params={"Bucket": bucket, "Key": key, **(extra or {})}, ExpiresIn=expires,
+    )
+
+
+def _parts(url):
+    u = urlsplit(url)
+    return u.scheme, u.netloc, u.path, dict(parse_qsl(u.query, keep_blank_values=True))
+
+
+@pytest.mark.parametrize("key", [
+    "outputs/SKU-1/42/ab12cd34_0.png",
+    "uploads/SKU 1/a+b (copy)/фото №1.jpg",
+    "masks/x~y/_-.png",
+])
+def test_matches_botocore(frozen_botocore, key):
+    ours = s3util._presign_get_at("test-bucket", key, 7200, SIGNED_AT)
+    assert _parts(ours) == _parts(_botocore_url("test-bucket", key, 7200))
+
+
+def test_extra_params_are_signed(frozen_botocore):
+    ours = s3util._presign_get_at(
+        "test-bucket", "outputs/a.png", 3600, SIGNED_AT,
+        extra={"response-content-disposition": 'attachment; filename="a b.png"'},
+    )
+    theirs = _botocore_url(
+        "test-bucket", "outputs/a.png", 3600,
+        extra={"ResponseContentDisposition": 'attachment; filename="a b.png"'},
+    )
+    assert _parts(ours) == _parts(theirs)
+
+
+def test_session_token(frozen_botocore, monkeypatch):
+    monkeypatch.setattr(s3util, "_credentials", lambda: (settings.aws_key, settings.aws_secret, "TOKEN/+="))
+    ours = s3util._presign_get_at("test-bucket", "k.png", 600, SIGNED_AT)
+    assert _parts(ours) == _parts(_botocore_url("test-bucket", "k.png", 600, token="TOKEN/+="))
+
+
+def test_dotted_bucket_uses_path_style(frozen_botocore):
+    ours = s3util._presign_get_at("my.bucket", "k.png", 600, SIGNED_AT)
+    assert _parts(ours) == _parts(_botocore_url("my.bucket", "k.png", 600, addressing="path"))
+
+
+def test_custom_endpoint(frozen_botocore, monkeypatch):
+    monkeypatch.setattr(settings, "s3_endpoint", "http://minio:9000")
+    ours = s3util._presign_get_at("test-bucket", "a/b.png", 600, SIGNED_AT)
+    theirs = _botocore_url("test-bucket", "a/b.png", 600, endpoint="http://minio:9000", addressing="path")
+    assert _parts(ours) == _parts(theirs)
+
+
+def test_signing_time_is_window_start(monkeypatch):
+    monkeypatch.setattr(s3util.time, "time", lambda: 10_000.5)
+    assert s3util._signing_time(7200) == 7200
+    monkeypatch.setattr(s3util.time, "time", lambda: 10_800.0)
+    assert s3util._signing_time(7200) == 10_800
@@ -0,0 +1,51 @@
+import io
+import zipfile
+
+from app import zipstream
+from app.zipstream import stream_zip
+
+
+def _unzip(chunks):
+    return zipfile.ZipFile(io.BytesIO(b"".join(chunks)))
+
+
+def test_archive_keeps_entry_order_and_content():
+    objects = {f"k{i}": f"payload {i}".encode() * (i + 1) for i in range(10)}
+    entries = [(f"dir/{i}.txt", f"k{i}") for i in range(10)] + [("manifest.json", b"{}")]
+    zf = _unzip(stream_zip(entries, objects.get, prefetch=3))
+    assert zf.namelist() == [name for name, _ in entries]
+    for i in range(10):
+        assert zf.read(f"dir/{i}.txt") == objects[f"k{i}"]
+    assert zf.read("manifest.json") == b"{}"
+    assert zf.testzip() is None
+
+
+def test_images_stored_other_files_deflated():
+    zf = _unzip(stream_zip([("a.PNG", b"x" * 1000), ("b.txt", b"y" * 1000)], lambda k: None))
+    assert zf.getinfo("a.PNG").compress_type == zipfile.ZIP_STORED
+    assert zf.getinfo("b.txt").compress_type == zipfile.ZIP_DEFLATED
+
+
+def test_missing_and_failing_objects_are_skipped():
+    def fetch(key):
+        if key == "boom":
+            raise RuntimeError("s3 down")
+        return None if key == "gone" else key.encode()
+
+    zf = _unzip(stream_zip([("1", "ok"), ("2", "gone"), ("3", "boom"), ("4", "fine")], fetch))
+    assert zf.namelist() == ["1", "4"]
+
+
+def test_streams_before_the_whole_archive_is_built(monkeypatch):
+    monkeypatch.setattr(zipstream, "ZIP_WRITE_CHUNK", 1024)
+    fetched = []
+
+    def fetch(key):
+        fetched.append(key)
+        return b"z" * 4096
+
+    gen = stream_zip([(f"{i}.png", str(i)) for i in range(50)], fetch, prefetch=2)
+    next(gen)
+    # первый кусок отдан, когда скачано не больше окна предвыборки (+1 запись, взятая на его место)
+    assert len(fetched) <= 3
+    gen.close()
@@ -51,7 +51,7 @@ export async function startProcess(sku: string) {
 export async function fetchSkuView(code: string) {
   // Use richer internal view that includes outputs, versions, favorites
   const base = API_BASE || "";
-  const r = await fetch(`${base}/internal/sku/by-code/${code}/view`, { cache: "no-store" });
+  const r = await fetch(`${base}/internal/sku/by-code/${code}/view`, { cache: "no-cache" });
   if (!r.ok) throw new Error("Failed to fetch sku view");
   return r.json();
 }
@@ -67,11 +67,45 @@ export async function redoFrame(frameId: number, params: any = {}) {
   return r.json();
 }
 
+// presigned-ссылки API живут 2 ч и подписываются началом часового окна: кадры, которые
+// delta не присылала заново, держат старые ссылки — не дольше этого срока, дальше полный запрос
+export const SIGNED_URL_REFRESH_MS = 50 * 60 * 1000;
+
 export async function fetchSkuViewByCode(code: string) {
   const base = API_BASE || "";
-  const r = await fetch(`${base}/internal/sku/by-code/${code}/view`, { cache: "no-store" });
+  const r = await fetch(`${base}/internal/sku/by-code/${code}/view`, { cache: "no-cache" });
   if (!r.ok) throw new Error(`Failed to load SKU view: ${r.status}`);
-  return r.json();
+  return { ...(await r.json()), fetchedAt: Date.now() };
+}
+
+// Delta-опрос вида SKU: ?since=<cursor> отдаёт только изменившиеся кадры (+ frame_ids всех
+// текущих) — сливаем с предыдущим ответом. Без курсора или со старыми ссылками — полный запрос.
+export async function fetchSkuViewDelta(code: string, prev: any | null) {
+  if (!prev?.cursor || !prev.fetchedAt || Date.now() - prev.fetchedAt > SIGNED_URL_REFRESH_MS) {
+    return fetchSkuViewByCode(code);
+  }
+  const base = API_BASE || "";
+  const r = await fetch(`${base}/internal/sku/by-code/${code}/view?since=${encodeURIComponent(prev.cursor)}`, { cache: "no-cache" });
+  if (!r.ok) throw new Error(`Failed to load SKU view: ${r.status}`);
+  const d = await r.json();
+  const byId = new Map<number, any>((prev.frames || []).map((f: any) => [f.id, f]));
+  for (const f of d.frames || []) byId.set(f.id, f);
+  const ids: number[] = d.frame_ids || [];
+  const frames = ids.map(id => byId.get(id)).filter(Boolean);
+  if (frames.length !== ids.length) return fetchSkuViewByCode(code);
+  return { ...d, frames, delta: false, fetchedAt: prev.fetchedAt };
+}
+
+// SSE-поток изменений кадров SKU: event "update" — дочитать delta (?since=), "resync" — события
+// потеряны, дочитать тоже (без курсора fetchSkuViewDelta сделает полный запрос).
+// EventSource сам переподключается (retry от сервера).
+export function subscribeSkuEvents(code: string, onChange: () => void) {
+  if (typeof window === "undefined" || typeof EventSource === "undefined") return () => {};
+  const base = API_BASE || "";
+  const es = new EventSource(`${base}/internal/sku/by-code/${encodeURIComponent(code)}/events`);
+  es.addEventListener("update", onChange);
+  es.addEventListener("resync", onChange);
+  return () => es.close();
 }
 
 export async function requestMaskUploadUrl(frameId: number, filename: string, size?: number, type?: string) {
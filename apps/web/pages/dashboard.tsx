@@ -1,5 +1,5 @@
 // @ts-nocheck
-import React, { useMemo, useState, useEffect } from "react";
+import React, { useMemo, useState, useEffect, useRef } from "react";
 import { useRouter } from "next/router";
 import {
   CalendarDays, Search, Package, ChevronLeft, ChevronRight, RefreshCcw,
@@ -19,12 +19,36 @@ const fetcher = (u: string) => fetch(u).then(r => { if(!r.ok) throw new Error(r.
 
 const percent = (part: number, total: number) => total ? Math.round((part/total)*100) : 0;
 
+// delta-ответ (?since=) поверх прошлого: изменившиеся строки заменяют старые, состав и порядок —
+// по списку текущих ключей ответа (ids / dates), так что удалённые строки уходят.
+// null — слить нельзя (нет списка или строки, которой нет ни там, ни там): нужен полный запрос
+function mergeDelta(prev: any, d: any, keyOf: (r: any) => any, order: any[] | undefined) {
+  if (!prev?.items || !Array.isArray(order)) return null;
+  const byKey = new Map<any, any>(prev.items.map((r: any) => [keyOf(r), r]));
+  for (const r of d.items || []) byKey.set(keyOf(r), r);
+  const items = order.map(k => byKey.get(k)).filter(Boolean);
+  if (items.length !== order.length) return null;
+  return { ...d, items, delta: false };
+}
+
+// дочитать url?since=<cursor прошлого ответа> и положить слитый ответ в кэш SWR без перезапроса
+async function refreshDelta(url: string, prev: any, mutate: any, keyOf: (r: any) => any, orderField: string) {
+  if (!prev?.cursor) return mutate();
+  try {
+    const d = await fetcher(`${url}${url.includes('?') ? '&' : '?'}since=${encodeURIComponent(prev.cursor)}`);
+    const merged = mergeDelta(prev, d, keyOf, d?.[orderField]);
+    return merged ? mutate(merged, { revalidate: false }) : mutate();
+  } catch (e) {
+    return mutate();
+  }
+}
+
 export default function DashboardBatches() {
   const router = useRouter(); // <— добавили
   // load batch summaries
   const apiBase = (process.env.NEXT_PUBLIC_API_URL || 'https://api-backend-ypst.onrender.com').replace(/\/+$/, '');
   const dashBase = apiBase ? `${apiBase}/api/dashboard` : `/api/dashboard`;
-  const { data: batchesResp, error: batchesError, mutate: refetchBatches } = useSWR<{items: BatchSummary[]}>(`${dashBase}/batches`, fetcher, { refreshInterval: 15000 });
+  const { data: batchesResp, error: batchesError, mutate: refetchBatches } = useSWR<{items: BatchSummary[]}>(`${dashBase}/batches`, fetcher, { refreshInterval: 60000 });
   const batches = batchesResp?.items || [];
   const [activeDate, setActiveDate] = useState<string>(batches[0]?.date || "");
   const [query, setQuery] = useState("");
@@ -36,10 +60,56 @@ export default function DashboardBatches() {
   useEffect(()=>{
     fetch(`${dashBase}/brands`).then(r=>r.ok?r.json():Promise.reject()).then(d=>{ if(d.items?.length){ setBrands(d.items); if(!d.items.includes(activeBrand)) setActiveBrand(d.items[0]); }}).catch(()=>{});
   },[]);
-  const { data: skusResp, error: skusError, mutate: refetchSkus } = useSWR<{items: SkuRow[]}>(activeDate && activeBrand ? `${dashBase}/skus?date=${activeDate}&brand=${encodeURIComponent(activeBrand)}` : null, fetcher, { refreshInterval: 5000 });
+  const skusUrl = activeDate && activeBrand ? `${dashBase}/skus?date=${activeDate}&brand=${encodeURIComponent(activeBrand)}` : null;
+  const { data: skusResp, error: skusError, mutate: refetchSkus } = useSWR<{items: SkuRow[]}>(skusUrl, fetcher, { refreshInterval: 60000 });
+  // последние ответы для обработчика SSE (эффект не пересоздаётся на каждый ответ)
+  const latestRef = useRef<any>({});
+  latestRef.current = { batchesResp, skusResp };
+  // push-обновления дня (SSE): по событию дочитываем только изменившееся (?since=), редкий
+  // refreshInterval — полный запрос и запасной путь
+  useEffect(()=>{
+    if (!activeDate || !skusUrl || typeof EventSource === "undefined") return;
+    let timer: any = null;
+    const refresh = () => {
+      if (timer) return;
+      timer = setTimeout(() => {
+        timer = null;
+        const { batchesResp, skusResp } = latestRef.current;
+        refreshDelta(skusUrl, skusResp, refetchSkus, (r) => r.id, "ids");
+        refreshDelta(`${dashBase}/batches`, batchesResp, refetchBatches, (r) => r.date, "dates");
+      }, 1000);
+    };
+    const es = new EventSource(`${dashBase}/events?date=${activeDate}`);
+    es.addEventListener("update", refresh);
+    es.addEventListener("resync", refresh);
+    return () => { es.close(); if (timer) clearTimeout(timer); };
+  }, [activeDate, skusUrl, dashBase]);
   const rowsRaw = skusResp?.items || [];
   const rows = useMemo(() => rowsRaw.filter(r => statusFilter === "ALL" ? true : r.status === statusFilter), [rowsRaw, statusFilter]);
 
+  // экспорт батча — фоновая задача: POST ставит (или находит готовый) архив, дальше опрос статуса
+  const [exportProgress, setExportProgress] = useState<string | null>(null);
+  const exportBatch = async () => {
+    if (!activeDate) return;
+    setExportProgress('Экспорт…');
+    try {
+      let r = await fetch(`${apiBase}/internal/batch/${activeDate}/export`, { method: 'POST' });
+      let job = await r.json();
+      while (job.status === 'queued' || job.status === 'running') {
+        setExportProgress(job.total ? `Экспорт ${job.done || 0}/${job.total}` : 'Экспорт…');
+        await new Promise(res => setTimeout(res, 2000));
+        r = await fetch(`${apiBase}/internal/exports/${job.job_id}`, { cache: 'no-store' });
+        job = await r.json();
+      }
+      if (job.status === 'done' && job.url) window.location.href = job.url;
+      else alert(`Экспорт не удался: ${job.error || job.status || r.status}`);
+    } catch (e) {
+      alert(`Экспорт не удался: ${e}`);
+    } finally {
+      setExportProgress(null);
+    }
+  };
+
   // было: alert(...). стало: переход на страницу SKU
   const goToSku = (sku: string) => router.push(`/sku/${encodeURIComponent(sku)}`);
 
@@ -58,7 +128,7 @@ export default function DashboardBatches() {
           </div>
           <div className="flex items-center gap-2">
             <Button onClick={() => {refetchBatches(); refetchSkus();}} className="flex items-center gap-2"><RefreshCcw size={16} /> Обновить</Button>
-            <Button disabled={!activeDate} onClick={() => { if(activeDate){ window.open(`${apiBase}/internal/batch/${activeDate}/export.zip`, '_blank'); } }} variant="primary" className={!activeDate? 'opacity-60 cursor-not-allowed':''}><Download size={16} /> Экспорт батча</Button>
+            <Button disabled={!activeDate || exportProgress !== null} onClick={exportBatch} variant="primary" className={!activeDate || exportProgress !== null ? 'opacity-60 cursor-not-allowed':''}><Download size={16} /> {exportProgress ?? 'Экспорт батча'}</Button>
           </div>
         </div>
 
@@ -2,7 +2,7 @@
 // @ts-nocheck
 import React, { useEffect, useState, useMemo } from "react";
 import { useRouter } from "next/router";
-import { fetchSkuViewByCode as fetchSkuView, setFrameMask, requestUploadUrls, putToSignedUrl } from "../../lib/api";
+import { fetchSkuViewByCode as fetchSkuView, fetchSkuViewDelta, subscribeSkuEvents, SIGNED_URL_REFRESH_MS, setFrameMask, requestUploadUrls, putToSignedUrl } from "../../lib/api";
 import Button from "../../components/ui/Button";
 import { Card } from "../../components/ui/Card";
 import { Badge } from "../../components/ui/Badge";
@@ -36,6 +36,15 @@ function FrameMedia({ original, maskUrl, versions, onPreview, frame }: any) {
   );
 }
 
+// Выход кадра: уменьшенная копия (thumb_url/preview_url), а если её нет (старые выходы) — полный url.
+function OutputImg({ o, size = 'thumb', ...rest }: any) {
+  const full = o?.url || o;
+  const src = (size === 'preview' ? o?.preview_url : o?.thumb_url) || full;
+  const [failed, setFailed] = useState(false);
+  useEffect(() => { setFailed(false); }, [src]);
+  return <img src={failed ? full : src} onError={() => { if (!failed && src !== full) setFailed(true); }} loading="lazy" decoding="async" {...rest} />;
+}
+
 function Modal({ open, onClose, children }: { open: boolean; onClose: () => void; children: React.ReactNode }) {
   if (!open) return null;
   return (
@@ -142,9 +151,9 @@ function FrameCard({ frame, onPreview }: { frame: any; onPreview: (variantIndex:
         requestAnimationFrame(syncOverlay);
       };
       im.onerror = () => setPaintMsg('Не удалось загрузить оригинал');
-  // Use preview endpoint (resized image for mask painting)
+  // Use preview endpoint (resized image for mask painting); пока превью собирается — оригинал
   const base = process.env.NEXT_PUBLIC_API_URL || '';
-  im.src = `${base}/internal/frame/${frame.id}/preview`;
+  im.src = `${base}/internal/frame/${frame.id}/preview?fallback=original`;
       // eslint-disable-next-line react-hooks/exhaustive-deps
     }, [frame?.id]);
 
@@ -244,7 +253,7 @@ function FrameCard({ frame, onPreview }: { frame: any; onPreview: (variantIndex:
         </div>
         <div ref={containerRef} className="relative w-full" style={{ maxWidth: '100%' }}>
           {/* Preview image (resized) rendered via internal endpoint for stability */}
-          <img src={`${process.env.NEXT_PUBLIC_API_URL || ''}/internal/frame/${frame.id}/preview`} alt="preview" className="__painter_original block w-full select-none pointer-events-none" draggable={false} />
+          <img src={`${process.env.NEXT_PUBLIC_API_URL || ''}/internal/frame/${frame.id}/preview?fallback=original`} alt="preview" className="__painter_original block w-full select-none pointer-events-none" draggable={false} />
           {/* overlay canvas used for mask preview and pointer events */}
           <canvas
             ref={overlayRef}
@@ -310,7 +319,7 @@ function FrameCard({ frame, onPreview }: { frame: any; onPreview: (variantIndex:
                 return (
       <div key={i} className="relative w-full rounded-lg overflow-hidden border flex items-center justify-center bg-black/5" style={{ aspectRatio: (frame._ratioStr||'1 / 1') }}>
                     <button onClick={()=>onPreview(i, frame)} className="absolute inset-0 hover:opacity-80">
-                      <img src={o.url || o} alt={`v1-${i+1}`} className="object-cover w-full h-full"/>
+                      <OutputImg o={o} alt={`v1-${i+1}`} className="object-cover w-full h-full"/>
                     </button>
                   </div>
                 );
@@ -329,7 +338,7 @@ function FrameCard({ frame, onPreview }: { frame: any; onPreview: (variantIndex:
                 return (
       <div key={i} className="relative w-full rounded-lg overflow-hidden border flex items-center justify-center bg-black/5" style={{ aspectRatio: (frame._ratioStr||'1 / 1') }}>
                     <button onClick={()=>onPreview(flatIndex, frame)} className="absolute inset-0 hover:opacity-80">
-                      <img src={o.url || o} alt={`v${vi+2}-${i+1}`} className="object-cover w-full h-full"/>
+                      <OutputImg o={o} alt={`v${vi+2}-${i+1}`} className="object-cover w-full h-full"/>
                     </button>
                   </div>
                 );
@@ -393,6 +402,9 @@ export default function SkuPage() {
   const [exportUrls, setExportUrls] = useState<string[] | null>(null);
   const [copied, setCopied] = useState(false);
   const watcherRef = React.useRef<{ stop?: ()=>void } | null>(null);
+  // последний ответ вида — база для delta-опроса (?since=cursor)
+  const dataRef = React.useRef<any>(null);
+  useEffect(() => { dataRef.current = data; }, [data]);
 
   const allDone = useMemo(() => (data?.frames?.length ? data.frames.every((f:any)=>f.outputs && f.outputs.length>0) : false), [data]);
   const progressPct = useMemo(()=>{
@@ -423,7 +435,8 @@ export default function SkuPage() {
       const start = Date.now();
       const poll = async () => {
         try {
-          const latest = await fetchSkuView(String(sku));
+          const latest = await fetchSkuViewDelta(String(sku), dataRef.current);
+          dataRef.current = latest;
           setData(latest);
           const fr = (latest?.frames || []).find((f:any)=>f.id===frameId);
           const st = String(fr?.status||'').toUpperCase();
@@ -451,6 +464,30 @@ export default function SkuPage() {
     };
   }, [sku]);
 
+  // push-обновления: по событию сервера дочитываем только изменившиеся кадры;
+  // частые дочитывания в пределах 300 мс схлопываем в одно
+  useEffect(()=>{
+    if (!sku) return;
+    let timer: any = null;
+    const refresh = () => {
+      if (timer) return;
+      timer = setTimeout(async () => {
+        timer = null;
+        try {
+          const latest = await fetchSkuViewDelta(String(sku), dataRef.current);
+          dataRef.current = latest;
+          setData(latest);
+        } catch (err) {
+          // следующее событие или ручное обновление дочитает
+        }
+      }, 300);
+    };
+    const unsubscribe = subscribeSkuEvents(String(sku), refresh);
+    // без событий страница тоже должна обновить ссылки до их истечения (полный запрос)
+    const renew = setInterval(refresh, SIGNED_URL_REFRESH_MS);
+    return () => { unsubscribe(); clearInterval(renew); if (timer) clearTimeout(timer); };
+  }, [sku]);
+
   if (!sku) return <div className="p-6">Загрузка…</div>;
 
   const openPreview = (variantIndex: number, frame: any) => {
@@ -556,7 +593,7 @@ export default function SkuPage() {
               <div className="mb-2 font-medium">Результат V{previewCtx.variant + 1} (Кадр #{previewCtx.frame.seq || previewCtx.frame.id})</div>
               <div className="w-full aspect-square bg-black/5 rounded-xl overflow-hidden border flex items-center justify-center" style={{ borderColor: "#0000001a" }}>
                 {previewCtx.frame.outputs?.[previewCtx.variant] ? (
-                  <img src={previewCtx.frame.outputs[previewCtx.variant].url || previewCtx.frame.outputs[previewCtx.variant]} className="object-contain w-full h-full" />
+                  <OutputImg o={previewCtx.frame.outputs[previewCtx.variant]} size="preview" className="object-contain w-full h-full" />
                 ) : <span className="opacity-50 text-sm">Нет</span>}
               </div>
               <div className="mt-3 flex items-center justify-end gap-3">
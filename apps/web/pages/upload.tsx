@@ -53,6 +53,68 @@ async function putToS3(file: File, putUrl: string) {
   }
 }
 
+/** крупные файлы: multipart upload — части параллельно, упавшая часть повторяется отдельно */
+const MULTIPART_THRESHOLD = 16 * 1024 * 1024;
+const PART_CONCURRENCY = 4;
+const PART_RETRIES = 3;
+
+async function postJson(path: string, body: any) {
+  const base = apiBase ? `${apiBase}` : '';
+  const res = await fetch(`${base}${path}`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify(body),
+  });
+  if (!res.ok) {
+    const t = await res.text().catch(() => "");
+    throw new Error(`${path} failed: ${res.status} ${t}`);
+  }
+  return res.json();
+}
+
+async function putPart(url: string, blob: Blob): Promise<string | null> {
+  let lastErr: any = null;
+  for (let attempt = 0; attempt < PART_RETRIES; attempt++) {
+    try {
+      const r = await fetch(url, { method: "PUT", body: blob });
+      if (r.ok) return r.headers.get("ETag"); // null, если бакет не отдаёт ETag в CORS
+      lastErr = new Error(`part PUT ${r.status}`);
+    } catch (e) {
+      lastErr = e;
+    }
+    await new Promise((res) => setTimeout(res, 500 * 2 ** attempt));
+  }
+  throw lastErr;
+}
+
+async function uploadMultipart(sku: string, file: File): Promise<{ key: string; name: string }> {
+  const path = `/api/skus/${encodeURIComponent(sku)}/multipart`;
+  const init = await postJson(`${path}/initiate`, { name: file.name, type: file.type || "application/octet-stream", size: file.size });
+  const { key, upload_id, part_size, part_count, presign_batch } = init;
+  try {
+    const etags: Record<number, string | null> = {};
+    for (let first = 1; first <= part_count; first += presign_batch) {
+      const nums = Array.from({ length: Math.min(presign_batch, part_count - first + 1) }, (_, i) => first + i);
+      const { items } = await postJson(`${path}/parts`, { key, upload_id, part_numbers: nums });
+      const queue = [...items];
+      await Promise.all(Array.from({ length: PART_CONCURRENCY }, async () => {
+        while (queue.length) {
+          const { part_number, url } = queue.shift();
+          const start = (part_number - 1) * part_size;
+          etags[part_number] = await putPart(url, file.slice(start, Math.min(start + part_size, file.size)));
+        }
+      }));
+    }
+    const nums = Object.keys(etags).map(Number).sort((a, b) => a - b);
+    const parts = nums.every((n) => etags[n]) ? nums.map((n) => ({ part_number: n, etag: etags[n] })) : null;
+    await postJson(`${path}/complete`, { key, upload_id, parts });
+    return { key, name: init.name };
+  } catch (e) {
+    postJson(`${path}/abort`, { key, upload_id }).catch(() => {});
+    throw e;
+  }
+}
+
 /** шаг 3: регистрация кадров + постановка в очередь воркеру */
 async function submitSku(
   sku: string,
@@ -74,12 +136,23 @@ async function submitSku(
   return res.json();
 }
 
-/** fallback: если PUT в S3 упал по CORS/региону — грузим файлы через backend (multipart) */
+/** файлы от MULTIPART_THRESHOLD — multipart, остальные одним PUT.
+ * fallback: если PUT в S3 упал по CORS/региону — грузим файлы через backend (multipart) */
 async function uploadWithFallback(sku: string, files: File[]) {
   try {
-    const urls = await getUploadUrls(sku, files);
-    await Promise.all(files.map((f, i) => putToS3(f, urls[i].put_url)));
-    return urls.map((u) => ({ key: u.key, name: u.name }));
+    const small = files.filter((f) => f.size < MULTIPART_THRESHOLD);
+    const urls = small.length ? await getUploadUrls(sku, small) : [];
+    const byFile = new Map<File, { key: string; name: string }>();
+    await Promise.all(files.map(async (f) => {
+      if (f.size >= MULTIPART_THRESHOLD) {
+        byFile.set(f, await uploadMultipart(sku, f));
+      } else {
+        const u = urls[small.indexOf(f)];
+        await putToS3(f, u.put_url);
+        byFile.set(f, { key: u.key, name: u.name });
+      }
+    }));
+    return files.map((f) => byFile.get(f));
   } catch (e) {
     console.warn("Presigned PUT failed, fallback to backend upload", e);
     const fd = new FormData();
@@ -0,0 +1,128 @@
+"""Сборка ZIP-экспорта прямо в S3 (для задачи worker.build_export).
+
+zipfile пишет в несикаемый приёмник, который режет поток на части multipart upload
+(EXPORT_PART_SIZE): ни архив, ни его заметная часть не лежат на диске или в памяти.
+Объекты-источники качаются пулом потоков на prefetch записей вперёд. Картинки —
+STORED (уже сжаты), остальное — DEFLATE. Логика та же, что у потокового ZIP в API
+(apps/api/app/zipstream.py), только приёмник — S3 вместо HTTP-ответа.
+"""
+from __future__ import annotations
+
+import io
+import os
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Optional, Tuple, Union
+
+EXPORT_PART_SIZE = max(5 * 1024 * 1024, int(os.environ.get("EXPORT_PART_SIZE", str(16 * 1024 * 1024))))
+EXPORT_PREFETCH = int(os.environ.get("EXPORT_PREFETCH", "4"))
+STORED_EXTS = (".png", ".jpg", ".jpeg", ".webp", ".gif", ".zip")
+
+Entry = Tuple[str, Union[str, bytes]]
+
+
+class _MultipartSink(io.RawIOBase):
+    def __init__(self, s3, bucket: str, key: str):
+        self._s3, self._bucket, self._key = s3, bucket, key
+        self._buf = bytearray()
+        self._parts = []
+        self.size = 0
+        self._upload_id = s3.create_multipart_upload(
+            Bucket=bucket, Key=key, ContentType="application/zip",
+        )["UploadId"]
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._buf += b
+        self.size += len(b)
+        if len(self._buf) >= EXPORT_PART_SIZE:
+            self._upload_part()
+        return len(b)
+
+    def _upload_part(self) -> None:
+        n = len(self._parts) + 1
+        r = self._s3.upload_part(
+            Bucket=self._bucket, Key=self._key, UploadId=self._upload_id,
+            PartNumber=n, Body=bytes(self._buf),
+        )
+        self._parts.append({"ETag": r["ETag"], "PartNumber": n})
+        self._buf.clear()
+
+    def complete(self) -> None:
+        if self._buf or not self._parts:
+            self._upload_part()  # последняя часть может быть меньше 5 МБ
+        self._s3.complete_multipart_upload(
+            Bucket=self._bucket, Key=self._key, UploadId=self._upload_id,
+            MultipartUpload={"Parts": self._parts},
+        )
+
+    def abort(self) -> None:
+        try:
+            self._s3.abort_multipart_upload(Bucket=self._bucket, Key=self._key, UploadId=self._upload_id)
+        except Exception as e:
+            print(f"[export] abort multipart {self._key} failed: {e}")
+
+
+def build_zip_to_s3(
+    s3,
+    bucket: str,
+    key: str,
+    entries: Iterable[Entry],
+    fetch: Callable[[str], Optional[bytes]],
+    progress: Optional[Callable[[int], None]] = None,
+    prefetch: int = EXPORT_PREFETCH,
+) -> int:
+    """Записать ZIP из entries в s3://bucket/key. Возвращает размер архива в байтах."""
+    sink = _MultipartSink(s3, bucket, key)
+    pool = ThreadPoolExecutor(max_workers=max(1, prefetch), thread_name_prefix="export-prefetch")
+    it = iter(entries)
+    window: deque = deque()
+
+    def _submit_next() -> bool:
+        try:
+            arcname, src = next(it)
+        except StopIteration:
+            return False
+        if isinstance(src, (bytes, bytearray)):
+            window.append((arcname, None, bytes(src)))
+        else:
+            window.append((arcname, pool.submit(fetch, src), None))
+        return True
+
+    processed = 0
+    try:
+        for _ in range(max(1, prefetch)):
+            if not _submit_next():
+                break
+        with zipfile.ZipFile(sink, "w", allowZip64=True) as zf:
+            while window:
+                arcname, fut, data = window.popleft()
+                _submit_next()
+                if fut is not None:
+                    try:
+                        data = fut.result()
+                    except Exception as e:
+                        print(f"[export] skip {arcname}: {e}")
+                        data = None
+                if data is not None:
+                    info = zipfile.ZipInfo(arcname)
+                    info.compress_type = zipfile.ZIP_STORED if arcname.lower().endswith(STORED_EXTS) else zipfile.ZIP_DEFLATED
+                    with zf.open(info, "w", force_zip64=len(data) > 0x7FFFFFFF) as dst:
+                        dst.write(data)
+                    del data
+                processed += 1
+                if progress is not None:
+                    progress(processed)
+        sink.complete()
+        return sink.size
+    except BaseException:
+        sink.abort()
+        raise
+    finally:
+        for _, fut, _ in window:
+            if fut is not None:
+                fut.cancel()
+        pool.shutdown(wait=False)
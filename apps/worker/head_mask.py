@@ -5,6 +5,10 @@ from typing import Optional, Tuple, Dict
 import json
 import httpx
 import io  # for segmentation image download
+try:
+    from .replicate_poller import wait_prediction
+except Exception:
+    from replicate_poller import wait_prediction
 
 # Optional YOLO (person detection improves back-facing cases)
 try:
@@ -195,79 +199,71 @@ def _segment_head_mask(image_path: str, image_url: Optional[str], shape: Tuple[i
         get_url = (data.get("urls") or {}).get("get")
         if not get_url:
             return None
-        # poll
-        import time
-        waited = 0.0
-        step = 2.0
+        # poll через общий опросчик процесса (один keep-alive, адаптивный интервал)
         max_wait = int(os.environ.get("HEAD_SEGMENT_MAX_WAIT", "180"))
-        while True:
-            r = httpx.get(get_url, headers=headers, timeout=60)
-            if r.status_code >= 400:
+        try:
+            pj = wait_prediction(get_url, max_wait_sec=max_wait, model=version)
+        except Exception:
+            return None
+        st = pj.get("status")
+        if st in ("succeeded", "failed", "canceled"):
+            if st != "succeeded":
+                return None
+            out_url = pj.get("output")
+            if not out_url:
+                return None
+            if isinstance(out_url, list):
+                out_url = out_url[0] if out_url else None
+            if not out_url:
+                return None
+            # download output
+            seg_img_bytes = httpx.get(out_url, timeout=60).content
+            from PIL import Image
+            try:
+                seg_img = Image.open(io.BytesIO(seg_img_bytes))  # type: ignore
+            except Exception:
                 return None
-            pj = r.json()
-            st = pj.get("status")
-            if st in ("succeeded", "failed", "canceled"):
-                if st != "succeeded":
-                    return None
-                out_url = pj.get("output")
-                if not out_url:
-                    return None
-                if isinstance(out_url, list):
-                    out_url = out_url[0] if out_url else None
-                if not out_url:
-                    return None
-                # download output
-                seg_img_bytes = httpx.get(out_url, timeout=60).content
-                from PIL import Image
-                try:
-                    seg_img = Image.open(io.BytesIO(seg_img_bytes))  # type: ignore
-                except Exception:
-                    return None
-                W, H = shape[1], shape[0]
-                if seg_img.size != (W, H):
-                    seg_img = seg_img.resize((W, H))
-                # alpha or grayscale
-                if seg_img.mode in ("RGBA", "LA"):
-                    alpha = seg_img.split()[-1]
-                    mask_arr = np.array(alpha)
-                else:
-                    gray = seg_img.convert("L")
-                    mask_arr = np.array(gray)
-                mask_bin = (mask_arr > 16).astype(np.uint8) * 255
-                # derive bounding box
-                ys, xs = np.where(mask_bin > 0)
-                if ys.size and xs.size:
-                    y1, y2 = ys.min(), ys.max()
-                    x1, x2 = xs.min(), xs.max()
-                    hbb = y2 - y1 + 1
-                    up_extra = int(hbb * 0.25)
-                    down_extra = int(hbb * 0.15)
-                    y1 = max(0, y1 - up_extra)
-                    y2 = min(H - 1, y2 + down_extra)
-                    # Apply enlarge factor to bounding square derived from bbox
-                    bw = x2 - x1; bh = y2 - y1
-                    side = max(bw, bh)
-                    cx = (x1 + x2)//2; cy = (y1 + y2)//2
-                    if HEAD_MASK_ENLARGE > 1.0:
-                        side = int(side * HEAD_MASK_ENLARGE)
-                    x1 = cx - side//2; y1 = cy - side//2
-                    x2 = x1 + side; y2 = y1 + side
-                    # clamp
-                    if x1 < 0: x2 += -x1; x1 = 0
-                    if y1 < 0: y2 += -y1; y1 = 0
-                    if x2 > W: shift = x2 - W; x1 -= shift; x2 = W
-                    if y2 > H: shift = y2 - H; y1 -= shift; y2 = H
-                    x1 = max(0,x1); y1 = max(0,y1)
-                    mask_bin.fill(0)
-                    mask_bin[y1:y2, x1:x2] = 255
-                    meta = {"strategy": "segment", "box": (int(x1), int(y1), int(x2), int(y2))}
-                else:
-                    return None
-                return meta, mask_bin
-            time.sleep(step)
-            waited += step
-            if waited >= max_wait:
+            W, H = shape[1], shape[0]
+            if seg_img.size != (W, H):
+                seg_img = seg_img.resize((W, H))
+            # alpha or grayscale
+            if seg_img.mode in ("RGBA", "LA"):
+                alpha = seg_img.split()[-1]
+                mask_arr = np.array(alpha)
+            else:
+                gray = seg_img.convert("L")
+                mask_arr = np.array(gray)
+            mask_bin = (mask_arr > 16).astype(np.uint8) * 255
+            # derive bounding box
+            ys, xs = np.where(mask_bin > 0)
+            if ys.size and xs.size:
+                y1, y2 = ys.min(), ys.max()
+                x1, x2 = xs.min(), xs.max()
+                hbb = y2 - y1 + 1
+                up_extra = int(hbb * 0.25)
+                down_extra = int(hbb * 0.15)
+                y1 = max(0, y1 - up_extra)
+                y2 = min(H - 1, y2 + down_extra)
+                # Apply enlarge factor to bounding square derived from bbox
+                bw = x2 - x1; bh = y2 - y1
+                side = max(bw, bh)
+                cx = (x1 + x2)//2; cy = (y1 + y2)//2
+                if HEAD_MASK_ENLARGE > 1.0:
+                    side = int(side * HEAD_MASK_ENLARGE)
+                x1 = cx - side//2; y1 = cy - side//2
+                x2 = x1 + side; y2 = y1 + side
+                # clamp
+                if x1 < 0: x2 += -x1; x1 = 0
+                if y1 < 0: y2 += -y1; y1 = 0
+                if x2 > W: shift = x2 - W; x1 -= shift; x2 = W
+                if y2 > H: shift = y2 - H; y1 -= shift; y2 = H
+                x1 = max(0,x1); y1 = max(0,y1)
+                mask_bin.fill(0)
+                mask_bin[y1:y2, x1:x2] = 255
+                meta = {"strategy": "segment", "box": (int(x1), int(y1), int(x2), int(y2))}
+            else:
                 return None
+            return meta, mask_bin
     except Exception:
         return None
 
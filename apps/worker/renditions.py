@@ -0,0 +1,62 @@
+"""Уменьшенные копии выходов для UI (для ingest_prediction_outputs).
+
+Рядом с outputs/{sku}/{frame}/{pred8}_{i}.png кладутся {pred8}_{i}.thumb.jpg и
+{pred8}_{i}.preview.webp. Схема ключей и размеры — те же, что в API
+(apps/api/app/renditions.py): API выводит ссылки на копии из ключа выхода.
+"""
+from __future__ import annotations
+
+import io
+import os
+from typing import Dict
+
+from PIL import Image
+
+# должны совпадать с API
+RENDITION_THUMB_PX = int(os.environ.get("RENDITION_THUMB_PX", "320"))
+RENDITION_PREVIEW_PX = int(os.environ.get("RENDITION_PREVIEW_PX", "1024"))
+_SUFFIXES = {"thumb": ".thumb.jpg", "preview": ".preview.webp"}
+_CONTENT_TYPES = {"thumb": "image/jpeg", "preview": "image/webp"}
+
+
+def rendition_key(key: str, kind: str) -> str:
+    """outputs/A/1/ab12cd34_0.png -> outputs/A/1/ab12cd34_0.thumb.jpg (kind=thumb)."""
+    return os.path.splitext(key)[0] + _SUFFIXES[kind]
+
+
+def build(content: bytes) -> Dict[str, bytes]:
+    """{kind: байты} для всех копий."""
+    out: Dict[str, bytes] = {}
+    with Image.open(io.BytesIO(content)) as src:
+        src.load()
+        img = src
+        if img.mode not in ("RGB", "RGBA"):
+            alpha = "A" in img.getbands() or "transparency" in img.info
+            img = img.convert("RGBA" if alpha else "RGB")
+        for kind, px, fmt, opts in (
+            ("preview", RENDITION_PREVIEW_PX, "WEBP", {"quality": 82, "method": 4}),
+            ("thumb", RENDITION_THUMB_PX, "JPEG", {"quality": 80, "optimize": True, "progressive": True}),
+        ):
+            im = img.copy()
+            im.thumbnail((px, px), Image.LANCZOS)
+            if fmt == "JPEG" and im.mode != "RGB":
+                bg = Image.new("RGB", im.size, (255, 255, 255))
+                bg.paste(im, mask=im.getchannel("A") if "A" in im.getbands() else None)
+                im = bg
+            buf = io.BytesIO()
+            im.save(buf, fmt, **opts)
+            out[kind] = buf.getvalue()
+    return out
+
+
+def upload(s3, bucket: str, key: str, content: bytes, cache_control: str) -> None:
+    """Собрать и положить копии выхода key. Ошибки не пробрасываются: без копий UI
+    покажет оригинал."""
+    try:
+        for kind, data in build(content).items():
+            s3.put_object(
+                Bucket=bucket, Key=rendition_key(key, kind), Body=data,
+                ContentType=_CONTENT_TYPES[kind], CacheControl=cache_control,
+            )
+    except Exception as e:
+        print(f"[renditions] {key}: {e}")
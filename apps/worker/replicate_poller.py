@@ -0,0 +1,223 @@
+"""Общий опросчик Replicate predictions (один на процесс воркера).
+
+Раньше на каждый prediction крутился свой цикл httpx.get раз в 2.5 с. Здесь один
+фоновый поток держит все незавершённые predictions процесса и опрашивает их через
+одно keep-alive соединение. Интервал адаптивный: по истории длительности
+предиктов модели (EWMA, общая для процессов через Redis) — редко в начале,
+часто ближе к ожидаемому завершению, с плавным backoff если предикт затянулся.
+По терминальному статусу резолвится Future (можно повесить add_done_callback).
+"""
+from __future__ import annotations
+
+import heapq
+import os
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+REPLICATE_API_TOKEN = os.environ.get("REPLICATE_API_TOKEN", "")
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+
+POLL_MIN_INTERVAL_SEC = float(os.environ.get("REPLICATE_POLL_MIN_SEC", "1.0"))
+POLL_MAX_INTERVAL_SEC = float(os.environ.get("REPLICATE_POLL_MAX_SEC", "15.0"))
+# ожидаемая длительность для модели без истории
+DEFAULT_EXPECTED_RUNTIME_SEC = float(os.environ.get("REPLICATE_EXPECTED_RUNTIME_SEC", "30"))
+POLL_MAX_CONSECUTIVE_ERRORS = int(os.environ.get("REPLICATE_POLL_MAX_ERRORS", "5"))
+RUNTIME_EWMA_ALPHA = 0.3
+RUNTIME_HISTORY_KEY = "fc:replicate:runtime"  # hash: model version -> EWMA секунд
+
+TERMINAL_STATUSES = ("succeeded", "failed", "canceled")
+
+
+class _Tracked:
+    __slots__ = ("get_url", "model", "started", "future", "seq", "errors")
+
+    def __init__(self, get_url: str, model: Optional[str], seq: int):
+        self.get_url = get_url
+        self.model = model
+        self.started = time.monotonic()
+        self.future: Future = Future()
+        self.seq = seq
+        self.errors = 0
+
+
+class ReplicatePoller:
+    def __init__(self, token: str, redis_url: Optional[str] = None):
+        self._token = token
+        self._redis_url = redis_url
+        self._redis = None
+        self._cond = threading.Condition()
+        self._heap: List[Tuple[float, int, str]] = []  # (due, seq, get_url)
+        self._tracked: Dict[str, _Tracked] = {}
+        self._runtimes: Dict[str, float] = {}
+        self._seq = 0
+        self._thread: Optional[threading.Thread] = None
+        self._client: Optional[httpx.Client] = None
+
+    # ---- public API ----
+    def track(self, get_url: str, model: Optional[str] = None) -> Future:
+        """Начать отслеживать prediction. Повторный track того же URL возвращает тот же Future."""
+        with self._cond:
+            t = self._tracked.get(get_url)
+            if t is not None:
+                return t.future
+            self._seq += 1
+            t = _Tracked(get_url, model, self._seq)
+            self._tracked[get_url] = t
+            heapq.heappush(self._heap, (time.monotonic() + self._interval(t), t.seq, get_url))
+            self._ensure_thread()
+            self._cond.notify()
+            return t.future
+
+    def untrack(self, get_url: str) -> None:
+        with self._cond:
+            t = self._tracked.pop(get_url, None)
+        if t is not None:
+            t.future.cancel()
+
+    def expected_runtime(self, model: Optional[str]) -> float:
+        if not model:
+            return DEFAULT_EXPECTED_RUNTIME_SEC
+        val = self._runtimes.get(model)
+        if val is None:
+            try:
+                raw = self._redis_client().hget(RUNTIME_HISTORY_KEY, model)
+                val = float(raw) if raw is not None else None
+            except Exception:
+                val = None
+            if val is not None:
+                self._runtimes[model] = val
+        return val if val is not None else DEFAULT_EXPECTED_RUNTIME_SEC
+
+    # ---- internals ----
+    def _redis_client(self):
+        if self._redis is None:
+            import redis
+            self._redis = redis.Redis.from_url(self._redis_url or REDIS_URL)
+        return self._redis
+
+    def _record_runtime(self, model: Optional[str], seconds: float) -> None:
+        if not model:
+            return
+        prev = self._runtimes.get(model)
+        if prev is None:
+            self.expected_runtime(model)  # подтянуть историю из Redis, если она есть
+            prev = self._runtimes.get(model)
+        val = seconds if prev is None else (RUNTIME_EWMA_ALPHA * seconds + (1 - RUNTIME_EWMA_ALPHA) * prev)
+        self._runtimes[model] = val
+        try:
+            self._redis_client().hset(RUNTIME_HISTORY_KEY, model, f"{val:.2f}")
+        except Exception:
+            pass
+
+    def _interval(self, t: _Tracked) -> float:
+        """Половина оставшегося до ожидаемого завершения времени: редко в начале, часто в конце.
+        После ожидаемого срока — минимальный интервал с плавным ростом."""
+        remaining = self.expected_runtime(t.model) - (time.monotonic() - t.started)
+        if remaining > 0:
+            iv = remaining / 2.0
+        else:
+            iv = POLL_MIN_INTERVAL_SEC + (-remaining) * 0.1
+        return max(POLL_MIN_INTERVAL_SEC, min(POLL_MAX_INTERVAL_SEC, iv))
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="replicate-poller", daemon=True)
+            self._thread.start()
+
+    def _http(self) -> httpx.Client:
+        if self._client is None:
+            self._client = httpx.Client(
+                timeout=60,
+                headers={"Authorization": f"Token {self._token}"},
+                limits=httpx.Limits(max_keepalive_connections=1, max_connections=1),
+            )
+        return self._client
+
+    def _next_due(self) -> _Tracked:
+        with self._cond:
+            while True:
+                if not self._heap:
+                    self._cond.wait(timeout=30)
+                    continue
+                due, seq, url = self._heap[0]
+                t = self._tracked.get(url)
+                if t is None or t.seq != seq:
+                    heapq.heappop(self._heap)  # снятый с отслеживания
+                    continue
+                now = time.monotonic()
+                if due <= now:
+                    heapq.heappop(self._heap)
+                    return t
+                self._cond.wait(timeout=due - now)
+
+    def _reschedule(self, t: _Tracked, delay: float) -> None:
+        with self._cond:
+            if self._tracked.get(t.get_url) is t:
+                heapq.heappush(self._heap, (time.monotonic() + delay, t.seq, t.get_url))
+
+    def _finish(self, t: _Tracked, result: Optional[Dict[str, Any]] = None, exc: Optional[BaseException] = None) -> None:
+        with self._cond:
+            if self._tracked.get(t.get_url) is t:
+                self._tracked.pop(t.get_url, None)
+        try:
+            if exc is not None:
+                t.future.set_exception(exc)
+            else:
+                t.future.set_result(result)
+        except InvalidStateError:
+            pass  # уже отменён (таймаут у вызывающего)
+
+    def _run(self) -> None:
+        while True:
+            t = self._next_due()
+            try:
+                r = self._http().get(t.get_url)
+                r.raise_for_status()
+                data = r.json()
+            except Exception as e:
+                t.errors += 1
+                if t.errors >= POLL_MAX_CONSECUTIVE_ERRORS:
+                    self._finish(t, exc=e)
+                else:
+                    self._reschedule(t, min(POLL_MAX_INTERVAL_SEC, POLL_MIN_INTERVAL_SEC * (2 ** t.errors)))
+                continue
+            t.errors = 0
+            if t.model is None:
+                t.model = data.get("version") or data.get("model")
+            status = data.get("status")
+            if status in TERMINAL_STATUSES:
+                if status == "succeeded":
+                    self._record_runtime(t.model, time.monotonic() - t.started)
+                self._finish(t, result=data)
+            else:
+                self._reschedule(t, self._interval(t))
+
+
+_POLLER: Optional[ReplicatePoller] = None
+_POLLER_PID: Optional[int] = None
+_POLLER_LOCK = threading.Lock()
+
+
+def get_poller() -> ReplicatePoller:
+    """Опросчик текущего процесса (после fork в prefork-воркере создаётся заново)."""
+    global _POLLER, _POLLER_PID
+    with _POLLER_LOCK:
+        if _POLLER is None or _POLLER_PID != os.getpid():
+            _POLLER = ReplicatePoller(REPLICATE_API_TOKEN, REDIS_URL)
+            _POLLER_PID = os.getpid()
+        return _POLLER
+
+
+def wait_prediction(get_url: str, max_wait_sec: float = 600, model: Optional[str] = None) -> Dict[str, Any]:
+    """Дождаться терминального статуса prediction через общий опросчик. TimeoutError по истечении max_wait_sec."""
+    poller = get_poller()
+    fut = poller.track(get_url, model=model)
+    try:
+        return fut.result(timeout=max_wait_sec)
+    except TimeoutError:
+        poller.untrack(get_url)
+        raise TimeoutError("Replicate polling timeout")
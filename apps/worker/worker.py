@@ -1,7 +1,10 @@
 import os
 import io
 import uuid
+import json
+import hashlib
 from typing import List, Dict, Any, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse, unquote
 from celery import Celery
 import httpx
@@ -10,6 +13,10 @@ import cv2
 from PIL import Image, ImageOps
 import tempfile
 import math
+import random
+import time
+from datetime import datetime, timedelta, timezone
+import redis
 try:
     from ultralytics import YOLO  # YOLOv8
     _YOLO_MODEL_LOAD_ERROR = None
@@ -20,8 +27,14 @@ import boto3
 import re
 try:
     from .head_mask import generate_head_mask_auto  # package import
+    from .replicate_poller import wait_prediction
+    from .export_zip import build_zip_to_s3
+    from . import renditions
 except Exception:
     from head_mask import generate_head_mask_auto  # fallback when not recognized as pkg
+    from replicate_poller import wait_prediction
+    from export_zip import build_zip_to_s3
+    import renditions
 
 # ======== ENV ========
 REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
@@ -65,6 +78,69 @@ def _get_yolo_face_model():
 celery = Celery("worker", broker=REDIS_URL, backend=REDIS_URL)
 
 
+# ======== Frame lease / redo coalescing (Redis) ========
+# Один пайплайн на кадр: lease в Redis. Redo, пришедшие пока кадр в очереди или
+# в работе, схлопываются в один последующий прогон (он прочитает свежие pending_params).
+FRAME_LEASE_TTL_SEC = int(os.environ.get("FRAME_LEASE_TTL_SEC", "1800"))
+FRAME_QUEUED_TTL_SEC = int(os.environ.get("FRAME_QUEUED_TTL_SEC", "600"))
+_REDIS = None
+
+def redis_client():
+    global _REDIS
+    if _REDIS is None:
+        _REDIS = redis.Redis.from_url(REDIS_URL)
+    return _REDIS
+
+def _frame_lease_key(frame_id: int) -> str:
+    return f"fc:frame:{int(frame_id)}:lease"
+
+def _frame_queued_key(frame_id: int) -> str:
+    return f"fc:frame:{int(frame_id)}:queued"
+
+def _frame_rerun_key(frame_id: int) -> str:
+    return f"fc:frame:{int(frame_id)}:rerun"
+
+# либо берём lease, либо (атомарно) помечаем, что после текущего прогона нужен ещё один
+_LUA_ACQUIRE_OR_FLAG = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) then return 1 end
+redis.call('SET', KEYS[2], '1', 'EX', ARGV[2])
+return 0
+"""
+# отпускаем lease (только свой) и забираем флаг повторного прогона
+_LUA_RELEASE_POP_RERUN = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then return 0 end
+redis.call('DEL', KEYS[1])
+return redis.call('DEL', KEYS[2])
+"""
+_LUA_EXTEND = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('EXPIRE', KEYS[1], ARGV[2]) end
+return 0
+"""
+
+def acquire_frame_lease(frame_id: int, token: str) -> bool:
+    r = redis_client()
+    return bool(r.eval(_LUA_ACQUIRE_OR_FLAG, 2, _frame_lease_key(frame_id), _frame_rerun_key(frame_id), token, FRAME_LEASE_TTL_SEC))
+
+def extend_frame_lease(frame_id: int, token: str) -> None:
+    try:
+        redis_client().eval(_LUA_EXTEND, 1, _frame_lease_key(frame_id), token, FRAME_LEASE_TTL_SEC)
+    except Exception as e:
+        print(f"[worker] frame {frame_id}: lease extend failed: {e}")
+
+def release_frame_lease(frame_id: int, token: str) -> bool:
+    """Отпустить lease. Возвращает True, если пока мы работали пришёл redo и нужен ещё прогон."""
+    r = redis_client()
+    return bool(r.eval(_LUA_RELEASE_POP_RERUN, 2, _frame_lease_key(frame_id), _frame_rerun_key(frame_id), token))
+
+def enqueue_frame(frame_id: int) -> bool:
+    """Поставить process_frame в очередь, если для кадра ещё нет ожидающей задачи."""
+    if not redis_client().set(_frame_queued_key(frame_id), "1", nx=True, ex=FRAME_QUEUED_TTL_SEC):
+        print(f"[worker] frame {frame_id}: already queued, coalesced")
+        return False
+    process_frame.delay(int(frame_id))
+    return True
+
+
 # ======== S3 helpers ========
 def s3_client():
     return boto3.client(
@@ -120,13 +196,19 @@ def _extract_key_from_s3_url(url: str) -> Optional[str]:
 
 ## removed earlier ensure_presigned_download variant (we keep unified version below)
 
+# Выходы и маски кладутся под уникальными ключами и не перезаписываются — браузер
+# может кэшировать их навсегда (ссылки UI стабильны в пределах окна подписи, см. api s3util).
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
 # --- S3: upload mask helper ---
-def put_mask_to_s3(key: str, data: bytes) -> str:
+def put_mask_to_s3(key: str, data: bytes, cache_control: Optional[str] = None) -> str:
+    extra = {"CacheControl": cache_control} if cache_control else {}
     s3_client().put_object(
         Bucket=S3_BUCKET,
         Key=key,
         Body=data,
         ContentType="image/png",
+        **extra,
     )
     return f"https://{S3_BUCKET}.s3.amazonaws.com/{key}"
 
@@ -137,8 +219,9 @@ def s3_public_url(key: str) -> str:
     return f"https://{S3_BUCKET}.s3.amazonaws.com/{key}"
 
 
-def s3_put_bytes(key: str, data: bytes, content_type: str = "application/octet-stream"):
-    s3_client().put_object(Bucket=S3_BUCKET, Key=key, Body=data, ContentType=content_type)
+def s3_put_bytes(key: str, data: bytes, content_type: str = "application/octet-stream", cache_control: Optional[str] = None):
+    extra = {"CacheControl": cache_control} if cache_control else {}
+    s3_client().put_object(Bucket=S3_BUCKET, Key=key, Body=data, ContentType=content_type, **extra)
     return s3_public_url(key)
 
 def s3_key_from_public_url(url: str) -> Optional[str]:
@@ -347,7 +430,7 @@ def replicate_segment_head(image_url: str, width: int, height: int) -> Optional[
         if pred_id:
             print(f"[worker] head-seg prediction id={pred_id}")
         # poll (reuse replicate_poll but без вебхуков)
-        seg_final = replicate_poll(get_url, max_wait_sec=180, step_sec=2.0)
+        seg_final = replicate_poll(get_url, max_wait_sec=180, model=HEAD_SEGMENT_MODEL_VERSION)
         if seg_final.get("status") != "succeeded":
             print(f"[worker] head-seg status={seg_final.get('status')} detail={seg_final}")
             return None
@@ -422,24 +505,13 @@ def replicate_create_prediction(version: str, input_payload: Dict[str, Any], *,
     return r.json()
 
 
-def replicate_poll(get_url: str, max_wait_sec: int = 600, step_sec: float = 2.5) -> Dict[str, Any]:
+def replicate_poll(get_url: str, max_wait_sec: int = 600, model: Optional[str] = None) -> Dict[str, Any]:
     """
-    Ждём завершения предикта. Возвращаем финальный JSON.
+    Ждём завершения предикта через общий опросчик процесса (replicate_poller):
+    одно keep-alive соединение на все predictions, адаптивный интервал по истории модели.
+    Возвращаем финальный JSON; TimeoutError по истечении max_wait_sec.
     """
-    headers = {"Authorization": f"Token {REPLICATE_API_TOKEN}"}
-    waited = 0.0
-    while True:
-        r = httpx.get(get_url, headers=headers, timeout=60)
-        r.raise_for_status()
-        data = r.json()
-        status = data.get("status")
-        if status in ("succeeded", "failed", "canceled"):
-            return data
-        import time
-        time.sleep(step_sec)
-        waited += step_sec
-        if waited >= max_wait_sec:
-            raise TimeoutError("Replicate polling timeout")
+    return wait_prediction(get_url, max_wait_sec=max_wait_sec, model=model)
 
 
 # ======== Helpers: fetch original with presign fallback ========
@@ -525,6 +597,110 @@ def _to_png_bytes(arr: np.ndarray) -> bytes:
     pil.save(buf, format="PNG")
     return buf.getvalue()
 
+# ======== Pipeline checkpoints ========
+# Стадии пайплайна кадра. Каждая фиксируется на Generation (stage + checkpoint),
+# поэтому ретрай/перезапуск продолжает с последней завершённой стадии: не качаем
+# и не маскируем заново и, главное, не создаём второй платный prediction.
+PIPELINE_STAGES = ("created", "preprocessed", "masked", "submitted", "ingested")
+class RetryableHTTPStatusError(Exception):
+    """5xx / 429 от API или Replicate (process_frame перевыбрасывает HTTPStatusError как эту)."""
+
+def _retryable_status(code: int) -> bool:
+    # остальные 4xx (404 кадра нет, 422 кривой вход) от повтора не исправятся
+    return code == 429 or code >= 500
+
+# транзиентные ошибки (сеть, 5xx/429 API/Replicate, таймаут опроса) — ретраим с backoff
+RETRYABLE_ERRORS = (httpx.TransportError, RetryableHTTPStatusError, TimeoutError)
+PROCESS_FRAME_MAX_RETRIES = int(os.environ.get("PROCESS_FRAME_MAX_RETRIES", "5"))
+
+def _stage_done(current: Optional[str], stage: str) -> bool:
+    if current not in PIPELINE_STAGES:
+        return False
+    return PIPELINE_STAGES.index(current) >= PIPELINE_STAGES.index(stage)
+
+# Черновой прогон (draft_mode у профиля головы): 1 выход, мало шагов, низкое разрешение
+DRAFT_NUM_OUTPUTS = int(os.environ.get("DRAFT_NUM_OUTPUTS", "1"))
+DRAFT_INFERENCE_STEPS = int(os.environ.get("DRAFT_INFERENCE_STEPS", "12"))
+DRAFT_MAX_SIDE = int(os.environ.get("DRAFT_MAX_SIDE", "512"))
+
+def _params_fingerprint(pending: Dict[str, Any], head: Dict[str, Any]) -> str:
+    """Отпечаток входных параметров генерации. Продолжаем только генерацию с тем же
+    отпечатком — новый redo с другими параметрами начинает новую генерацию.
+    mask_strategy/mask_box не учитываем: их пишет сам пайплайн при авто-маске."""
+    relevant = {k: v for k, v in (pending or {}).items() if k not in ("mask_strategy", "mask_box")}
+    raw = json.dumps({"params": relevant, "model": head.get("model_version")}, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+def _find_resumable_generation(frame_id: int, fingerprint: str) -> Optional[Dict[str, Any]]:
+    """Последняя незавершённая генерация кадра с тем же отпечатком параметров."""
+    with httpx.Client(timeout=60) as c:
+        r = c.get(f"{API_BASE_URL}/internal/frame/{frame_id}/generations")
+        r.raise_for_status()
+        items = r.json().get("items") or []
+    best = None
+    for g in items:
+        if str(g.get("status") or "").upper() in ("COMPLETED", "FAILED"):
+            continue
+        if (g.get("checkpoint") or {}).get("fingerprint") != fingerprint:
+            continue
+        if best is None or int(g["id"]) > int(best["id"]):
+            best = g
+    return best
+
+def save_checkpoint(generation_id: int, stage: str, data: Dict[str, Any]) -> None:
+    with httpx.Client(timeout=60) as c:
+        r = c.post(
+            f"{API_BASE_URL}/internal/generation/{generation_id}/checkpoint",
+            json={"stage": stage, "data": data},
+        )
+        r.raise_for_status()
+
+def ingest_prediction_outputs(sku_code: str, frame_id: int, pred_id: str, final: Dict[str, Any]) -> List[str]:
+    """Скачать outputs завершённого prediction и выгрузить в S3 вместе с уменьшенными
+    копиями (renditions.py). Ключи детерминированы (pred_id + индекс), поэтому повторная
+    выгрузка идемпотентна."""
+    outputs: List[str] = []
+    raw_outputs = final.get("output") or []
+    if not isinstance(raw_outputs, list):
+        raw_outputs = [raw_outputs] if raw_outputs else []
+
+    for i, out_url in enumerate(raw_outputs):
+        try:
+            content = http_get_bytes(out_url, timeout=120)
+            # определим расширение по URL (если нет — png)
+            parsed = urlparse(out_url)
+            name = os.path.basename(parsed.path) or f"out_{i}.png"
+            ext = os.path.splitext(name)[1].lower() or ".png"
+            if ext not in (".png", ".jpg", ".jpeg", ".webp"):
+                ext = ".png"
+            key = f"outputs/{sku_code}/{frame_id}/{pred_id[:8]}_{i}{ext}"
+            # эвристика контента
+            ctype = (
+                "image/png" if ext == ".png"
+                else "image/jpeg" if ext in (".jpg", ".jpeg")
+                else "image/webp" if ext == ".webp"
+                else "application/octet-stream"
+            )
+            url = s3_put_bytes(key, content, content_type=ctype, cache_control=IMMUTABLE_CACHE_CONTROL)
+            # уменьшенные копии для сетки/просмотра в UI; экспорт берёт оригинал
+            renditions.upload(s3_client(), S3_BUCKET, key, content, IMMUTABLE_CACHE_CONTROL)
+            outputs.append(url)
+        except Exception as e:
+            print(f"[worker] failed to upload output {i} to S3: {e}")
+
+    print(f"[worker] frame {frame_id}: uploaded {len(outputs)} outputs to S3")
+    return outputs
+
+def notify_generation_complete(generation_id: int, outputs: Optional[List[str]] = None, status: Optional[str] = None, error: Optional[str] = None) -> None:
+    payload: Dict[str, Any] = {"outputs": outputs or []}
+    if status:
+        payload["status"] = status
+    if error:
+        payload["error"] = error[:2000]
+    with httpx.Client(timeout=60) as c:
+        r = c.post(f"{API_BASE_URL}/internal/generation/{generation_id}/complete", json=payload)
+        r.raise_for_status()
+
 # ======== Tasks ========
 @celery.task(name="worker.process_sku")
 def process_sku(sku_id: int):
@@ -548,19 +724,53 @@ def process_sku(sku_id: int):
 
     for fr in frames:
         fid = fr["id"] if isinstance(fr, dict) else int(fr)
-        process_frame.delay(int(fid))
-
-
-@celery.task(name="worker.process_frame")
-def process_frame(frame_id: int):
+        enqueue_frame(int(fid))
+
+
+@celery.task(
+    name="worker.process_frame",
+    bind=True,
+    autoretry_for=RETRYABLE_ERRORS,
+    retry_backoff=True,
+    retry_backoff_max=300,
+    retry_jitter=True,
+    max_retries=PROCESS_FRAME_MAX_RETRIES,
+)
+def process_frame(self, frame_id: int):
+    """
+    Обёртка над пайплайном кадра: держим lease на кадр, чтобы параллельные
+    redo / process_sku не гонялись за одной маской и версиями outputs.
+    Если кадр уже в работе — ставим флаг повторного прогона и выходим.
+    Транзиентные ошибки (сеть, 5xx/429) ретраятся Celery с backoff; ретрай продолжает с
+    чекпоинта. Прочие 4xx падают сразу.
+    """
+    token = uuid.uuid4().hex
+    # задача вышла из очереди — следующий redo должен поставить новую
+    redis_client().delete(_frame_queued_key(frame_id))
+    if not acquire_frame_lease(frame_id, token):
+        print(f"[worker] frame {frame_id}: pipeline already running, follow-up run scheduled")
+        return
+    try:
+        _process_frame_locked(frame_id, token)
+    except httpx.HTTPStatusError as e:
+        if _retryable_status(e.response.status_code):
+            raise RetryableHTTPStatusError(str(e)) from e
+        print(f"[worker] frame {frame_id}: permanent HTTP {e.response.status_code}, not retrying")
+        raise
+    finally:
+        if release_frame_lease(frame_id, token):
+            print(f"[worker] frame {frame_id}: redo arrived during run, enqueue follow-up")
+            enqueue_frame(frame_id)
+
+
+def _process_frame_locked(frame_id: int, lease_token: str):
     """
-    Полный пайплайн:
-    - тянем фрейм
-    - скачиваем original_url (если приватно — делаем presigned по original_key)
-    - строим маску и грузим её в S3
-    - регистрируем генерацию на бэке
-    - создаём prediction на Replicate, сохраняем prediction_id
-    - ждём завершения и грузим результат(ы) в S3
+    Полный пайплайн (стадии фиксируются чекпоинтами на генерации):
+    - тянем фрейм, находим незавершённую генерацию с теми же параметрами или регистрируем новую
+    - preprocessed: скачиваем original (если приватно — presigned по original_key), при необходимости уменьшаем
+    - masked: строим/переиспользуем маску и грузим её в S3
+    - submitted: создаём prediction на Replicate, сохраняем prediction_id
+    - ingested: ждём завершения и грузим результат(ы) в S3, сообщаем API
     """
     assert API_BASE_URL, "API_BASE_URL env is required"
 
@@ -586,301 +796,571 @@ def process_frame(frame_id: int):
     if not original_url:
         raise RuntimeError("Frame has no original_url or original_key")
 
-    # 2) Предобработка оригинала: downscale при необходимости и подготовка локального файла/URL для модели и сегментации
-    presigned_original = ensure_presigned_download(original_url, original_key)
-    orig_bytes = http_get_bytes(presigned_original, timeout=120)
-    orig_bgr = decode_image_bgr_with_exif(orig_bytes)
-    H0, W0 = orig_bgr.shape[:2]
-    max_long = int(os.environ.get("PREPROCESS_MAX_LONG_SIDE", "3000"))
-    target_long = int(os.environ.get("PREPROCESS_TARGET_LONG_SIDE", "2560"))
-    jpeg_q = int(os.environ.get("PREPROCESS_JPEG_QUALITY", "90"))
-    resized_applied = False
-    use_bgr = orig_bgr
-    # local file for mask generator
-    local_image_path: Optional[str] = None
-    # S3 key/url for the image passed to the model
-    model_image_key: Optional[str] = None
-    model_image_url: Optional[str] = None
-    if max(W0, H0) > max_long:
-        resized_applied = True
-        scale = float(target_long) / float(max(W0, H0))
-        new_w = int(round(W0 * scale))
-        new_h = int(round(H0 * scale))
-        # ensure >= 64 and multiple of 2 to be safe
-        new_w = max(64, int(round(new_w / 2.0) * 2))
-        new_h = max(64, int(round(new_h / 2.0) * 2))
-        use_bgr = cv2.resize(orig_bgr, (new_w, new_h), interpolation=cv2.INTER_AREA)
-        # save local temp JPEG for mask generator
-        with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as tmp_img:
-            tmp_img.write(bgr_to_jpeg_bytes(use_bgr, quality=jpeg_q))
-            local_image_path = tmp_img.name
-        # upload resized image for model & segmentation
-        model_image_key = f"resized/{sku_code}/{frame_id}.jpg"
-        with open(local_image_path, "rb") as f:
-            s3_put_bytes(model_image_key, f.read(), content_type="image/jpeg")
-        model_image_url = ensure_presigned_download(None, model_image_key)
-        print(f"[worker] frame {frame_id}: downscaled original {W0}x{H0} -> {new_w}x{new_h}")
+    head = info.get("head") or {}
+    # пользовательские pending_params (internal.redo сохранил их в pending_params frame)
+    pending = info.get("pending_params") or {}
+
+    # 2) генерация: продолжаем незавершённую с теми же параметрами или регистрируем новую
+    fingerprint = _params_fingerprint(pending, head)
+    gen = _find_resumable_generation(frame_id, fingerprint)
+    if gen:
+        generation_id = gen["id"]
+        ckpt: Dict[str, Any] = dict(gen.get("checkpoint") or {})
+        stage: Optional[str] = gen.get("stage")
+        if gen.get("prediction_id") and not _stage_done(stage, "submitted"):
+            # prediction уже создан, но чекпоинт не успели записать — второй не создаём
+            ckpt["prediction_id"] = gen["prediction_id"]
+            stage = "submitted"
+        print(f"[worker] frame {frame_id}: resume generation {generation_id} after stage={stage}")
     else:
-        # keep original; write to temp for mask generator (use .png to be safe)
-        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp_in:
-            tmp_in.write(orig_bytes)
-            local_image_path = tmp_in.name
-        model_image_url = presigned_original
-        model_image_key = original_key
-
-    # 3) Маска: используем существующую или генерируем; если изображение было уменьшено — приводим маску к тем же размерам
-    existing_mask_key = info.get("mask_key")
-    overwrite_env = os.environ.get("HEAD_MASK_OVERWRITE", "0") == "1"
-    mask_key: Optional[str] = None
-    mask_url: Optional[str] = None
-    had_existing_mask = bool(existing_mask_key) and not overwrite_env
-    if existing_mask_key and not overwrite_env and not resized_applied:
-        # безопасно переиспользовать как есть (совпадают размеры с оригиналом)
-        mask_key = existing_mask_key
-        print(f"[worker] frame {frame_id}: reuse existing mask {mask_key}")
-        mask_url = s3_client().generate_presigned_url(
-            "get_object",
-            Params={"Bucket": S3_BUCKET, "Key": mask_key},
-            ExpiresIn=3600,
-        )
-    elif existing_mask_key and not overwrite_env and resized_applied:
-        # Скачать и привести пользовательскую маску к размерам use_bgr
-        try:
-            m_presigned = ensure_presigned_download(None, existing_mask_key)
-            m_bytes = http_get_bytes(m_presigned, timeout=120)
-            m_img = Image.open(io.BytesIO(m_bytes))
-            # Always use luminance for user masks; alpha channel of painter PNG is opaque -> would produce full-white mask
-            try:
-                m_arr = np.array(m_img.convert("L"))
-            except Exception:
-                m_arr = np.array(m_img if m_img.mode == "L" else m_img.convert("L"))
-            # resize with nearest
-            Ht, Wt = use_bgr.shape[:2]
-            m_rs = cv2.resize(m_arr, (Wt, Ht), interpolation=cv2.INTER_NEAREST)
-            m_bin = (m_rs > 127).astype(np.uint8) * 255
-            # upload under separate key to avoid overwriting user mask
-            mask_key = f"masks-resized/{sku_code}/{frame_id}.png"
-            s3_put_bytes(mask_key, png_bytes_from_array(m_bin), content_type="image/png")
-            mask_url = ensure_presigned_download(None, mask_key)
-            print(f"[worker] frame {frame_id}: resized existing mask to {Wt}x{Ht}")
-        except Exception as e:
-            print(f"[worker] frame {frame_id}: failed to resize existing mask, will auto-generate. err={e}")
-            mask_key = None
-            mask_url = None
-
-    if mask_key is None or mask_url is None:
-        # Генерируем автоматически маску по уменьшенному/оригинальному изображению
-        force_seg = (info.get("pending_params") or {}).get("force_segmentation_mask") is True
-        old_before = os.environ.get("HEAD_SEGMENT_BEFORE_PERSON")
-        if force_seg:
-            os.environ["HEAD_SEGMENT_BEFORE_PERSON"] = "1"
-        try:
-            meta, mask_path = generate_head_mask_auto(local_image_path, "/tmp/head_mask.png", model_image_url)
-        finally:
-            if force_seg:
-                if old_before is None:
-                    os.environ.pop("HEAD_SEGMENT_BEFORE_PERSON", None)
-                else:
-                    os.environ["HEAD_SEGMENT_BEFORE_PERSON"] = old_before
-        # загрузка маски в S3
-        # Если была пользовательская маска и мы работаем с уменьшенным изображением —
-        # не перезаписываем оригинальную маску; кладём рядом в masks-resized/ и НЕ регистрируем в API
-        if resized_applied and had_existing_mask:
-            mask_key = f"masks-resized/{sku_code}/{frame_id}.png"
-            with open(mask_path, "rb") as f:
-                put_mask_to_s3(mask_key, f.read())
-            print(f"[worker] frame {frame_id}: auto mask generated for resized image (kept user's original mask)")
+        with httpx.Client(timeout=60) as c:
+            reg = c.post(f"{API_BASE_URL}/internal/frame/{frame_id}/generation", json={})
+            reg.raise_for_status()
+            reg_json = reg.json()
+        generation_id = reg_json.get("id")
+        if not generation_id:
+            raise RuntimeError("internal generation create returned no id")
+        ckpt = {"fingerprint": fingerprint}
+        save_checkpoint(generation_id, "created", ckpt)
+        stage = "created"
+
+    # 3) Предобработка оригинала: downscale при необходимости и подготовка локального файла/URL для модели и сегментации
+    local_image_path: Optional[str] = None
+    if not _stage_done(stage, "preprocessed"):
+        presigned_original = ensure_presigned_download(original_url, original_key)
+        orig_bytes = http_get_bytes(presigned_original, timeout=120)
+        max_long = int(os.environ.get("PREPROCESS_MAX_LONG_SIDE", "3000"))
+        target_long = int(os.environ.get("PREPROCESS_TARGET_LONG_SIDE", "2560"))
+        jpeg_q = int(os.environ.get("PREPROCESS_JPEG_QUALITY", "90"))
+        # размеры из метаданных сабмита (API, frame_meta.py): если уменьшать не нужно, полный decode не делаем
+        meta = info.get("meta") or {}
+        meta_dims = None
+        if meta.get("width") and meta.get("height"):
+            meta_dims = (int(meta["width"]), int(meta["height"]))
+            if int(meta.get("orientation") or 1) in (5, 6, 7, 8):
+                meta_dims = meta_dims[::-1]  # как после exif_transpose
+        if meta_dims and max(meta_dims) <= max_long:
+            orig_bgr = None
+            W0, H0 = meta_dims
         else:
-            mask_key = f"masks/{sku_code}/{frame_id}.png"
-            with open(mask_path, "rb") as f:
-                put_mask_to_s3(mask_key, f.read())
-            # регистрация mask_key + meta в API (без вызова /redo чтобы не запускать лишнюю генерацию)
+            orig_bgr = decode_image_bgr_with_exif(orig_bytes)
+            H0, W0 = orig_bgr.shape[:2]
+        resized_applied = False
+        use_bgr = orig_bgr
+        # S3 key of the image passed to the model
+        model_image_key: Optional[str] = None
+        if max(W0, H0) > max_long:
+            resized_applied = True
+            scale = float(target_long) / float(max(W0, H0))
+            new_w = int(round(W0 * scale))
+            new_h = int(round(H0 * scale))
+            # ensure >= 64 and multiple of 2 to be safe
+            new_w = max(64, int(round(new_w / 2.0) * 2))
+            new_h = max(64, int(round(new_h / 2.0) * 2))
+            use_bgr = cv2.resize(orig_bgr, (new_w, new_h), interpolation=cv2.INTER_AREA)
+            # save local temp JPEG for mask generator
+            with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as tmp_img:
+                tmp_img.write(bgr_to_jpeg_bytes(use_bgr, quality=jpeg_q))
+                local_image_path = tmp_img.name
+            # upload resized image for model & segmentation
+            model_image_key = f"resized/{sku_code}/{frame_id}.jpg"
+            with open(local_image_path, "rb") as f:
+                s3_put_bytes(model_image_key, f.read(), content_type="image/jpeg")
+            print(f"[worker] frame {frame_id}: downscaled original {W0}x{H0} -> {new_w}x{new_h}")
+        else:
+            # keep original; write to temp for mask generator (use .png to be safe)
+            with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp_in:
+                tmp_in.write(orig_bytes)
+                local_image_path = tmp_in.name
+            model_image_key = original_key
+        _H, _W = use_bgr.shape[:2] if use_bgr is not None else (H0, W0)
+        ckpt.update({"model_image_key": model_image_key, "resized": resized_applied, "width": _W, "height": _H})
+        save_checkpoint(generation_id, "preprocessed", {k: ckpt[k] for k in ("model_image_key", "resized", "width", "height")})
+        stage = "preprocessed"
+
+    resized_applied = bool(ckpt.get("resized"))
+    model_image_key = ckpt.get("model_image_key")
+    img_w, img_h = int(ckpt.get("width") or 0), int(ckpt.get("height") or 0)
+    # presigned ссылки живут час — перевыпускаем по ключу на каждом прогоне
+    model_image_url = ensure_presigned_download(None if model_image_key else original_url, model_image_key)
+
+    # 4) Маска: используем существующую или генерируем; если изображение было уменьшено — приводим маску к тем же размерам
+    if not _stage_done(stage, "masked"):
+        if local_image_path is None:
+            # продолжение после рестарта: локального файла уже нет — качаем подготовленное изображение
+            with tempfile.NamedTemporaryFile(suffix=".jpg" if resized_applied else ".png", delete=False) as tmp_in:
+                tmp_in.write(http_get_bytes(model_image_url, timeout=120))
+                local_image_path = tmp_in.name
+        existing_mask_key = info.get("mask_key")
+        overwrite_env = os.environ.get("HEAD_MASK_OVERWRITE", "0") == "1"
+        mask_key: Optional[str] = None
+        had_existing_mask = bool(existing_mask_key) and not overwrite_env
+        if existing_mask_key and not overwrite_env and not resized_applied:
+            # безопасно переиспользовать как есть (совпадают размеры с оригиналом)
+            mask_key = existing_mask_key
+            print(f"[worker] frame {frame_id}: reuse existing mask {mask_key}")
+        elif existing_mask_key and not overwrite_env and resized_applied:
+            # Скачать и привести пользовательскую маску к размерам подготовленного изображения
             try:
-                payload = {"key": mask_key}
-                if isinstance(meta, dict):
-                    if meta.get("strategy"):
-                        payload["strategy"] = meta.get("strategy")
-                    if meta.get("box"):
-                        payload["box"] = list(meta.get("box")) if not isinstance(meta.get("box"), list) else meta.get("box")
-                with httpx.Client(timeout=30) as c:
-                    c.post(f"{API_BASE_URL}/internal/frame/{frame_id}/mask", json=payload)
+                m_presigned = ensure_presigned_download(None, existing_mask_key)
+                m_bytes = http_get_bytes(m_presigned, timeout=120)
+                m_img = Image.open(io.BytesIO(m_bytes))
+                # Always use luminance for user masks; alpha channel of painter PNG is opaque -> would produce full-white mask
+                try:
+                    m_arr = np.array(m_img.convert("L"))
+                except Exception:
+                    m_arr = np.array(m_img if m_img.mode == "L" else m_img.convert("L"))
+                # resize with nearest
+                Ht, Wt = img_h, img_w
+                m_rs = cv2.resize(m_arr, (Wt, Ht), interpolation=cv2.INTER_NEAREST)
+                m_bin = (m_rs > 127).astype(np.uint8) * 255
+                # upload under separate key to avoid overwriting user mask
+                mask_key = f"masks-resized/{sku_code}/{frame_id}.png"
+                s3_put_bytes(mask_key, png_bytes_from_array(m_bin), content_type="image/png")
+                print(f"[worker] frame {frame_id}: resized existing mask to {Wt}x{Ht}")
             except Exception as e:
-                print(f"[worker] failed to register mask key frame={frame_id}: {e}")
-            print(f"[worker] frame {frame_id}: auto mask generated and uploaded")
-        mask_url = s3_client().generate_presigned_url(
-            "get_object",
-            Params={"Bucket": S3_BUCKET, "Key": mask_key},
-            ExpiresIn=3600,
-        )
-
-    image_url_for_model = model_image_url
-    mask_url_for_model  = ensure_presigned_download(None, mask_key)
+                print(f"[worker] frame {frame_id}: failed to resize existing mask, will auto-generate. err={e}")
+                mask_key = None
 
-    # 3) промпт (дефолтная "Маша" если профиля нет)
-    head = info.get("head") or {}
-    token = head.get("trigger_token") or head.get("trigger") or "tnkfwm1"
-    tmpl = head.get("prompt_template") or head.get("prompt") or "a photo of {token} female model"
-    base_prompt = str(tmpl).replace("{token}", token)
+        if mask_key is None:
+            # Генерируем автоматически маску по уменьшенному/оригинальному изображению
+            force_seg = pending.get("force_segmentation_mask") is True
+            old_before = os.environ.get("HEAD_SEGMENT_BEFORE_PERSON")
+            if force_seg:
+                os.environ["HEAD_SEGMENT_BEFORE_PERSON"] = "1"
+            try:
+                # свой файл на кадр/прогон: параллельные задачи не перетирают маски друг друга
+                out_mask_path = os.path.join(tempfile.gettempdir(), f"head_mask_{frame_id}_{lease_token[:8]}.png")
+                meta, mask_path = generate_head_mask_auto(local_image_path, out_mask_path, model_image_url)
+            finally:
+                if force_seg:
+                    if old_before is None:
+                        os.environ.pop("HEAD_SEGMENT_BEFORE_PERSON", None)
+                    else:
+                        os.environ["HEAD_SEGMENT_BEFORE_PERSON"] = old_before
+            # загрузка маски в S3
+            # Если была пользовательская маска и мы работаем с уменьшенным изображением —
+            # не перезаписываем оригинальную маску; кладём рядом в masks-resized/ и НЕ регистрируем в API
+            if resized_applied and had_existing_mask:
+                mask_key = f"masks-resized/{sku_code}/{frame_id}.png"
+                with open(mask_path, "rb") as f:
+                    put_mask_to_s3(mask_key, f.read())
+                print(f"[worker] frame {frame_id}: auto mask generated for resized image (kept user's original mask)")
+            else:
+                with open(mask_path, "rb") as f:
+                    mask_bytes = f.read()
+                # ключ версионирован содержимым: новая маска — новый ключ, старая ссылка в кэше браузера не врёт
+                mask_key = f"masks/{sku_code}/{frame_id}_{hashlib.sha1(mask_bytes).hexdigest()[:12]}.png"
+                put_mask_to_s3(mask_key, mask_bytes, cache_control=IMMUTABLE_CACHE_CONTROL)
+                # регистрация mask_key + meta в API (без вызова /redo чтобы не запускать лишнюю генерацию)
+                try:
+                    payload = {"key": mask_key}
+                    if isinstance(meta, dict):
+                        if meta.get("strategy"):
+                            payload["strategy"] = meta.get("strategy")
+                        if meta.get("box"):
+                            payload["box"] = list(meta.get("box")) if not isinstance(meta.get("box"), list) else meta.get("box")
+                    with httpx.Client(timeout=30) as c:
+                        c.post(f"{API_BASE_URL}/internal/frame/{frame_id}/mask", json=payload)
+                except Exception as e:
+                    print(f"[worker] failed to register mask key frame={frame_id}: {e}")
+                print(f"[worker] frame {frame_id}: auto mask generated and uploaded")
+        ckpt["mask_key"] = mask_key
+        save_checkpoint(generation_id, "masked", {"mask_key": mask_key})
+        stage = "masked"
 
-    # 4) регистрируем генерацию в бэке
-    with httpx.Client(timeout=60) as c:
-        reg = c.post(f"{API_BASE_URL}/internal/frame/{frame_id}/generation", json={})
-        reg.raise_for_status()
-        reg_json = reg.json()
-    generation_id = reg_json.get("id")
-    if not generation_id:
-        raise RuntimeError("internal generation create returned no id")
-
-    source_image_url = original_url
-    if original_key:  # всегда безопаснее давать presigned в Replicate
-        source_image_url = s3_client().generate_presigned_url(
-            "get_object",
-            Params={"Bucket": S3_BUCKET, "Key": original_key},
-            ExpiresIn=3600,
-        )
+    image_url_for_model = model_image_url
+    mask_url_for_model  = ensure_presigned_download(None, ckpt["mask_key"])
 
     # 5) делаем prediction на Replicate
-    model_version = head.get("model_version") or os.getenv("REPLICATE_MODEL_VERSION") or os.getenv("REPLICATE_MODEL")
-    if not model_version:
-        raise RuntimeError("No model_version available (head.model_version or REPLICATE_MODEL_VERSION env)")
-    # пользовательские pending_params (internal.redo сохранил их в pending_params frame)
-    pending = info.get("pending_params") or {}
-    # Defaults from head.params (if provided) now merged before applying pending overrides
-    head_params = head.get("params") or {}
-    def _p(name, fallback):
-        if name in pending:  # explicit user override (redo)
-            return pending[name]
-        if name in head_params:  # per-head default
-            return head_params[name]
-        return fallback
-    # Compose style-based prompt if applicable
-    eyes = (pending.get("eye_color") or "").strip()
-    hair_style = (pending.get("hair_style") or "").strip()
-    hair_color = (pending.get("hair_color") or "").strip()
-    style_parts = []
-    if eyes:
-        style_parts.append(eyes)
-    # hair as sentence: "Short dark hair" etc.
-    hair_phrase = None
-    if hair_style and hair_color:
-        # Ensure hair_style sentence-cased (first letter uppercase) in case passed lower
+    if not _stage_done(stage, "submitted"):
+        # промпт (дефолтная "Маша" если профиля нет)
+        token = head.get("trigger_token") or head.get("trigger") or "tnkfwm1"
+        tmpl = head.get("prompt_template") or head.get("prompt") or "a photo of {token} female model"
+        base_prompt = str(tmpl).replace("{token}", token)
+
+        model_version = head.get("model_version") or os.getenv("REPLICATE_MODEL_VERSION") or os.getenv("REPLICATE_MODEL")
+        if not model_version:
+            raise RuntimeError("No model_version available (head.model_version or REPLICATE_MODEL_VERSION env)")
+        # Defaults from head.params (if provided) now merged before applying pending overrides
+        head_params = head.get("params") or {}
+        def _p(name, fallback):
+            if name in pending:  # explicit user override (redo)
+                return pending[name]
+            if name in head_params:  # per-head default
+                return head_params[name]
+            return fallback
+        # Compose style-based prompt if applicable
+        eyes = (pending.get("eye_color") or "").strip()
+        hair_style = (pending.get("hair_style") or "").strip()
+        hair_color = (pending.get("hair_color") or "").strip()
+        style_parts = []
+        if eyes:
+            style_parts.append(eyes)
+        # hair as sentence: "Short dark hair" etc.
+        hair_phrase = None
+        if hair_style and hair_color:
+            # Ensure hair_style sentence-cased (first letter uppercase) in case passed lower
+            try:
+                hs = hair_style[0].upper() + hair_style[1:]
+            except Exception:
+                hs = hair_style
+            hair_phrase = f"{hs} {hair_color} hair"
+        elif hair_style:
+            try:
+                hs = hair_style[0].upper() + hair_style[1:]
+            except Exception:
+                hs = hair_style
+            hair_phrase = f"{hs} hair"
+        elif hair_color:
+            hair_phrase = f"{hair_color} hair"
+        if hair_phrase:
+            style_parts.append(hair_phrase)
+        style_suffix = (". " + ". ".join(style_parts) + ".").replace("..", ".") if style_parts else ""
+        composed_prompt = (pending.get("prompt") or (base_prompt + style_suffix)).strip()
+
+        # draft_mode (параметр профиля головы): сначала быстрый черновик, полный прогон
+        # с тем же seed — только для принятых кадров или по явному /refine (phase=full).
+        phase = "draft" if (_p("draft_mode", False) and pending.get("phase") != "full") else "full"
+        seed = pending.get("seed")
+        if phase == "draft" and seed is None:
+            seed = random.randint(1, 2**31 - 1)
+        input_dict = {
+            "prompt": composed_prompt,
+            "prompt_strength": _p("prompt_strength", 0.9),
+            "num_outputs": DRAFT_NUM_OUTPUTS if phase == "draft" else _p("num_outputs", 3),
+            "num_inference_steps": DRAFT_INFERENCE_STEPS if phase == "draft" else _p("num_inference_steps", 50),  # updated global default 50
+            "guidance_scale": _p("guidance_scale", 2),
+            "output_format": _p("output_format", "png"),
+            "image": image_url_for_model,
+            "mask": mask_url_for_model,
+        }
+        if seed is not None:
+            input_dict["seed"] = int(seed)
+        # Try to preserve image aspect/size if model supports it: add width/height based on preprocessed image
         try:
-            hs = hair_style[0].upper() + hair_style[1:]
+            _max_side = DRAFT_MAX_SIDE if phase == "draft" else int(os.environ.get("REPLICATE_MAX_SIDE", "1024"))
+            scale = 1.0
+            if max(img_w, img_h) > _max_side:
+                scale = _max_side / float(max(img_w, img_h))
+            _w = int(round((img_w * scale) / 8.0) * 8)
+            _h = int(round((img_h * scale) / 8.0) * 8)
+            if _w >= 64 and _h >= 64:
+                input_with_size = dict(input_dict)
+                input_with_size.update({"width": _w, "height": _h})
+            else:
+                input_with_size = input_dict
         except Exception:
-            hs = hair_style
-        hair_phrase = f"{hs} {hair_color} hair"
-    elif hair_style:
+            input_with_size = input_dict
         try:
-            hs = hair_style[0].upper() + hair_style[1:]
+            print(f"[worker] frame {frame_id}: pending_params={pending} head_params={head_params} final_input={input_dict}")
         except Exception:
-            hs = hair_style
-        hair_phrase = f"{hs} hair"
-    elif hair_color:
-        hair_phrase = f"{hair_color} hair"
-    if hair_phrase:
-        style_parts.append(hair_phrase)
-    style_suffix = (". " + ". ".join(style_parts) + ".").replace("..", ".") if style_parts else ""
-    composed_prompt = (pending.get("prompt") or (base_prompt + style_suffix)).strip()
-
-    input_dict = {
-        "prompt": composed_prompt,
-        "prompt_strength": _p("prompt_strength", 0.9),
-        "num_outputs": _p("num_outputs", 3),
-    "num_inference_steps": _p("num_inference_steps", 50),  # updated global default 50
-    "guidance_scale": _p("guidance_scale", 2),
-        "output_format": _p("output_format", "png"),
-        "image": image_url_for_model,
-        "mask": mask_url_for_model,
-    }
-    # Try to preserve image aspect/size if model supports it: add width/height based on preprocessed image
-    try:
-        _H, _W = use_bgr.shape[:2]
-        _max_side = int(os.environ.get("REPLICATE_MAX_SIDE", "1024"))
-        scale = 1.0
-        if max(_W, _H) > _max_side:
-            scale = _max_side / float(max(_W, _H))
-        _w = int(round((_W * scale) / 8.0) * 8)
-        _h = int(round((_H * scale) / 8.0) * 8)
-        if _w >= 64 and _h >= 64:
-            input_with_size = dict(input_dict)
-            input_with_size.update({"width": _w, "height": _h})
-        else:
-            input_with_size = input_dict
-    except Exception:
-        input_with_size = input_dict
-    try:
-        print(f"[worker] frame {frame_id}: pending_params={pending} head_params={head_params} final_input={input_dict}")
-    except Exception:
-        pass
+            pass
 
-    try:
-        pred = replicate_create_prediction(model_version, input_with_size, idempotency_key=f"gen-{generation_id}")
-    except Exception as e:
-        print(f"[worker] replicate create failed (with size) frame={frame_id} gen={generation_id}: {e}")
-        # Fallback: try without width/height if present
         try:
-            if input_with_size is not input_dict:
-                pred = replicate_create_prediction(model_version, input_dict, idempotency_key=f"gen-{generation_id}-fallback")
-            else:
-                raise e
-        except Exception as e2:
-            print(f"[worker] replicate create failed (fallback) frame={frame_id} gen={generation_id}: {e2}")
+            pred = replicate_create_prediction(model_version, input_with_size, idempotency_key=f"gen-{generation_id}")
+        except Exception as e:
+            print(f"[worker] replicate create failed (with size) frame={frame_id} gen={generation_id}: {e}")
+            # Fallback: try without width/height if present
+            try:
+                if input_with_size is not input_dict:
+                    pred = replicate_create_prediction(model_version, input_dict, idempotency_key=f"gen-{generation_id}-fallback")
+                else:
+                    raise e
+            except Exception as e2:
+                print(f"[worker] replicate create failed (fallback) frame={frame_id} gen={generation_id}: {e2}")
+                return
+        pred_id = pred.get("id")
+        pred_get = (pred.get("urls") or {}).get("get")
+        if not pred_id or not pred_get:
+            raise RuntimeError(f"Replicate create response missing fields: {pred}")
+
+        # сохраняем prediction_id в бэке
+        with httpx.Client(timeout=60) as c:
+            r = c.post(
+                f"{API_BASE_URL}/internal/generation/{generation_id}/prediction",
+                json={"prediction_id": pred_id},
+            )
+            r.raise_for_status()
+        submitted = {"prediction_id": pred_id, "get_url": pred_get, "model_version": model_version, "phase": phase, "seed": seed}
+        ckpt.update(submitted)
+        save_checkpoint(generation_id, "submitted", submitted)
+        stage = "submitted"
+
+    pred_id = ckpt["prediction_id"]
+    pred_get = ckpt.get("get_url") or f"https://api.replicate.com/v1/predictions/{pred_id}"
+
+    # 6) ждём завершения и выгружаем результаты в S3
+    if not _stage_done(stage, "ingested"):
+        extend_frame_lease(frame_id, lease_token)
+        final = replicate_poll(pred_get, model=ckpt.get("model_version"))
+        status = final.get("status")
+        if status != "succeeded":
+            print(f"[worker] replicate prediction {pred_id} finished with status={status}, detail={final}")
+            # генерация терминальна: следующий redo с теми же параметрами начнёт новую, а не продолжит эту
+            notify_generation_complete(generation_id, status=status or "failed", error=str(final.get("error") or status))
             return
-    pred_id = pred.get("id")
-    pred_get = (pred.get("urls") or {}).get("get")
-    if not pred_id or not pred_get:
-        raise RuntimeError(f"Replicate create response missing fields: {pred}")
 
-    # 6) сохраняем prediction_id в бэке
+        outputs = ingest_prediction_outputs(sku_code, frame_id, pred_id, final)
+        ckpt["outputs"] = outputs
+        save_checkpoint(generation_id, "ingested", {"outputs": outputs})
+        stage = "ingested"
+
+    # 7) уведомляем API о завершении генерации (ошибка -> ретрай продолжит отсюда)
+    notify_generation_complete(generation_id, outputs=ckpt.get("outputs") or [])
+
+
+# ======== Orphaned predictions sweeper (celery beat) ========
+# Если воркер, опрашивавший prediction, перезапустился (деплой на Render), генерация
+# навсегда остаётся RUNNING. Периодически забираем такие генерации: succeeded —
+# выгружаем outputs и завершаем, failed/canceled — помечаем FAILED.
+ORPHAN_SWEEP_INTERVAL_SEC = float(os.environ.get("ORPHAN_SWEEP_INTERVAL_SEC", "300"))
+ORPHAN_MIN_AGE_SEC = int(os.environ.get("ORPHAN_MIN_AGE_SEC", "900"))
+ORPHAN_BATCH_SIZE = int(os.environ.get("ORPHAN_BATCH_SIZE", "20"))
+ORPHAN_METRICS_KEY = "fc:metrics:orphan_sweeper"
+
+celery.conf.beat_schedule = {
+    "recover-orphaned-predictions": {
+        "task": "worker.recover_orphaned_predictions",
+        "schedule": ORPHAN_SWEEP_INTERVAL_SEC,
+    },
+}
+
+
+@celery.task(name="worker.recover_orphaned_predictions")
+def recover_orphaned_predictions():
+    """Восстановить RUNNING генерации старше ORPHAN_MIN_AGE_SEC (не больше ORPHAN_BATCH_SIZE за проход).
+    Кадр, по которому прямо сейчас идёт пайплайн (lease занят), пропускаем."""
+    assert API_BASE_URL, "API_BASE_URL env is required"
+    stats = {"checked": 0, "recovered": 0, "failed": 0, "still_running": 0, "skipped_busy": 0, "errors": 0}
     with httpx.Client(timeout=60) as c:
-        r = c.post(
-            f"{API_BASE_URL}/internal/generation/{generation_id}/prediction",
-            json={"prediction_id": pred_id},
+        r = c.get(
+            f"{API_BASE_URL}/internal/generations/stale",
+            params={"older_than_sec": ORPHAN_MIN_AGE_SEC, "limit": ORPHAN_BATCH_SIZE},
         )
         r.raise_for_status()
+        items = r.json().get("items") or []
 
-    # 7) ждём завершения
-    final = replicate_poll(pred_get)
-    status = final.get("status")
-    if status != "succeeded":
-        print(f"[worker] replicate prediction {pred_id} finished with status={status}, detail={final}")
-        return
+    headers = {"Authorization": f"Token {REPLICATE_API_TOKEN}"}
+    for g in items:
+        stats["checked"] += 1
+        generation_id = int(g["id"])
+        frame_id = int(g["frame_id"])
+        pred_id = g.get("prediction_id")
+        token = uuid.uuid4().hex
+        # без флага повторного прогона: sweeper не должен порождать redo
+        if not redis_client().set(_frame_lease_key(frame_id), token, nx=True, ex=FRAME_LEASE_TTL_SEC):
+            stats["skipped_busy"] += 1
+            continue
+        try:
+            with httpx.Client(timeout=60) as c:
+                pr = c.get(f"https://api.replicate.com/v1/predictions/{pred_id}", headers=headers)
+            if pr.status_code == 404:
+                notify_generation_complete(generation_id, status="failed", error="prediction not found")
+                stats["failed"] += 1
+                continue
+            pr.raise_for_status()
+            final = pr.json()
+            status = final.get("status")
+            if status == "succeeded":
+                sku_code = str(g.get("sku_code") or f"sku_{frame_id}")
+                outputs = ingest_prediction_outputs(sku_code, frame_id, pred_id, final)
+                if not outputs:
+                    # у Replicate выходные файлы живут ограниченное время
+                    notify_generation_complete(generation_id, status="failed", error="prediction outputs unavailable")
+                    stats["failed"] += 1
+                    continue
+                save_checkpoint(generation_id, "ingested", {"outputs": outputs})
+                notify_generation_complete(generation_id, outputs=outputs)
+                stats["recovered"] += 1
+                print(f"[worker] sweeper: recovered gen={generation_id} frame={frame_id} pred={pred_id} outputs={len(outputs)}")
+            elif status in ("failed", "canceled"):
+                notify_generation_complete(generation_id, status=status, error=str(final.get("error") or status))
+                stats["failed"] += 1
+            else:
+                stats["still_running"] += 1
+        except Exception as e:
+            stats["errors"] += 1
+            print(f"[worker] sweeper: gen={generation_id} frame={frame_id} error: {e}")
+        finally:
+            if release_frame_lease(frame_id, token):
+                enqueue_frame(frame_id)
 
-    # 8) выгружаем результаты в S3
-    outputs: List[str] = []
-    raw_outputs = final.get("output") or []
-    if not isinstance(raw_outputs, list):
-        raw_outputs = [raw_outputs] if raw_outputs else []
+    try:
+        pipe = redis_client().pipeline()
+        for k, v in stats.items():
+            if v:
+                pipe.hincrby(ORPHAN_METRICS_KEY, k, v)
+        pipe.hset(ORPHAN_METRICS_KEY, "last_run_ts", int(time.time()))
+        pipe.execute()
+    except Exception as e:
+        print(f"[worker] sweeper: metrics write failed: {e}")
+    print(f"[worker] sweeper: {stats}")
+    return stats
+
+
+# ======== Stale multipart uploads sweeper (celery beat) ========
+# Незавершённые multipart-загрузки оригиналов (/api/skus/{code}/multipart/...) держат
+# части в бакете и тарифицируются, пока их не завершат или не прервут. Закрытая вкладка
+# или упавший клиент их бросает — прерываем всё под uploads/ старше MULTIPART_STALE_HOURS.
+MULTIPART_SWEEP_INTERVAL_SEC = float(os.environ.get("MULTIPART_SWEEP_INTERVAL_SEC", "3600"))
+MULTIPART_STALE_HOURS = float(os.environ.get("MULTIPART_STALE_HOURS", "24"))
+
+celery.conf.beat_schedule["abort-stale-multipart-uploads"] = {
+    "task": "worker.abort_stale_multipart_uploads",
+    "schedule": MULTIPART_SWEEP_INTERVAL_SEC,
+}
+
+
+@celery.task(name="worker.abort_stale_multipart_uploads")
+def abort_stale_multipart_uploads():
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=MULTIPART_STALE_HOURS)
+    s3 = s3_client()
+    stats = {"checked": 0, "aborted": 0, "errors": 0}
+    for page in s3.get_paginator("list_multipart_uploads").paginate(Bucket=S3_BUCKET, Prefix="uploads/"):
+        for u in page.get("Uploads") or []:
+            stats["checked"] += 1
+            if u["Initiated"] >= cutoff:
+                continue
+            try:
+                s3.abort_multipart_upload(Bucket=S3_BUCKET, Key=u["Key"], UploadId=u["UploadId"])
+                stats["aborted"] += 1
+            except Exception as e:
+                stats["errors"] += 1
+                print(f"[worker] multipart sweeper: abort {u['Key']} failed: {e}")
+    print(f"[worker] multipart sweeper: {stats}")
+    return stats
 
-    for i, out_url in enumerate(raw_outputs):
+
+# ======== ZIP export jobs (очередь "exports", статус — см. apps/api/app/exports.py) ========
+EXPORT_JOB_TTL_SEC = int(os.environ.get("EXPORT_JOB_TTL_SEC", str(7 * 86400)))  # как в API
+EXPORT_FAILED_TTL_SEC = 3600
+EXPORT_PROGRESS_EVERY = 10  # записей между обновлениями статуса
+
+
+@celery.task(name="worker.build_export")
+def build_export(job_id: str, artifact_key: str, manifest: List[Dict[str, str]]):
+    """Собрать ZIP по манифесту [{name, key} | {name, text}] в s3://S3_BUCKET/artifact_key."""
+    job_key = f"fc:export:{job_id}"
+    r = redis_client()
+    r.hset(job_key, mapping={"status": "running", "done": 0, "started_ts": int(time.time())})
+    s3 = s3_client()
+
+    def fetch(key: str) -> bytes:
+        return s3.get_object(Bucket=S3_BUCKET, Key=key)["Body"].read()
+
+    def progress(done: int) -> None:
+        if done % EXPORT_PROGRESS_EVERY == 0 or done == len(manifest):
+            r.hset(job_key, "done", done)
+
+    entries = [(e["name"], e["key"] if e.get("key") else (e.get("text") or "").encode("utf-8")) for e in manifest]
+    t0 = time.monotonic()
+    try:
+        size = build_zip_to_s3(s3, S3_BUCKET, artifact_key, entries, fetch, progress)
+    except Exception as e:
+        pipe = r.pipeline()
+        pipe.hset(job_key, mapping={"status": "failed", "error": str(e)[:500]})
+        pipe.expire(job_key, EXPORT_FAILED_TTL_SEC)
+        pipe.delete(f"{job_key}:claim")  # следующий POST поставит задачу заново
+        pipe.execute()
+        raise
+    pipe = r.pipeline()
+    pipe.hset(job_key, mapping={"status": "done", "done": len(manifest), "bytes": size, "finished_ts": int(time.time())})
+    pipe.expire(job_key, EXPORT_JOB_TTL_SEC)
+    pipe.execute()
+    print(f"[worker] export {job_id[:12]}: {len(manifest)} entries, {size} bytes in {time.monotonic() - t0:.1f}s -> {artifact_key}")
+    return {"key": artifact_key, "bytes": size}
+
+
+# ======== Превью для маск-пейнтера (ставит API, single-flight — apps/api/app/previews.py) ========
+PREVIEW_MAX_LONG_SIDE = int(os.environ.get("PREVIEW_MAX_LONG_SIDE", os.environ.get("PREPROCESS_TARGET_LONG_SIDE", "2560")))
+PREVIEW_JPEG_QUALITY = int(os.environ.get("PREVIEW_JPEG_QUALITY", "90"))
+PREVIEW_READY_TTL_SEC = int(os.environ.get("PREVIEW_READY_TTL_SEC", str(30 * 86400)))  # как в API
+
+
+@celery.task(name="worker.build_preview")
+def build_preview(frame_id: int, original_key: str, target_key: str):
+    """Оригинал -> JPEG с длинной стороной не больше PREVIEW_MAX_LONG_SIDE в target_key."""
+    r = redis_client()
+    try:
+        # задача могла дождаться очереди дольше маркера pending и оказаться повторной
+        if r.get(f"fc:preview:{int(frame_id)}") == target_key.encode():
+            return
+        data = s3_client().get_object(Bucket=S3_BUCKET, Key=original_key)["Body"].read()
+        im = Image.open(io.BytesIO(data))
+        # JPEG: декодируем сразу в уменьшенном масштабе (DCT), не меньше целевого размера
+        im.draft("RGB", (PREVIEW_MAX_LONG_SIDE, PREVIEW_MAX_LONG_SIDE))
         try:
-            content = http_get_bytes(out_url, timeout=120)
-            # определим расширение по URL (если нет — png)
-            parsed = urlparse(out_url)
-            name = os.path.basename(parsed.path) or f"out_{i}.png"
-            ext = os.path.splitext(name)[1].lower() or ".png"
-            if ext not in (".png", ".jpg", ".jpeg", ".webp"):
-                ext = ".png"
-            key = f"outputs/{sku_code}/{frame_id}/{pred_id[:8]}_{i}{ext}"
-            # эвристика контента
-            ctype = (
-                "image/png" if ext == ".png"
-                else "image/jpeg" if ext in (".jpg", ".jpeg")
-                else "image/webp" if ext == ".webp"
-                else "application/octet-stream"
-            )
-            url = s3_put_bytes(key, content, content_type=ctype)
-            outputs.append(url)
-        except Exception as e:
-            print(f"[worker] failed to upload output {i} to S3: {e}")
+            im = ImageOps.exif_transpose(im)
+        except Exception:
+            pass
+        if im.mode != "RGB":
+            im = im.convert("RGB")
+        if max(im.size) > PREVIEW_MAX_LONG_SIDE:
+            im.thumbnail((PREVIEW_MAX_LONG_SIDE, PREVIEW_MAX_LONG_SIDE), resample=Image.Resampling.LANCZOS)
+        out = io.BytesIO()
+        im.save(out, format="JPEG", quality=PREVIEW_JPEG_QUALITY)
+        # оригинал кадра не меняется — превью тоже
+        s3_put_bytes(target_key, out.getvalue(), content_type="image/jpeg", cache_control=IMMUTABLE_CACHE_CONTROL)
+        r.set(f"fc:preview:{int(frame_id)}", target_key, ex=PREVIEW_READY_TTL_SEC)
+        print(f"[worker] preview frame={frame_id}: {im.size[0]}x{im.size[1]} -> {target_key}")
+    finally:
+        r.delete(f"fc:preview:{int(frame_id)}:pending")
+
+
+# ======== Метаданные оригиналов большой пачки (ставит API, см. apps/api/app/frame_meta.py) ========
+# то же чтение заголовков, что в API: ranged GET начала объекта, окно удваивается до MAX
+FRAME_META_HEAD_BYTES = int(os.environ.get("FRAME_META_HEAD_BYTES", str(64 * 1024)))
+FRAME_META_MAX_BYTES = int(os.environ.get("FRAME_META_MAX_BYTES", str(1024 * 1024)))
+FRAME_META_CONCURRENCY = int(os.environ.get("FRAME_META_CONCURRENCY", "8"))
+
+
+def _frame_meta_parse(data: bytes) -> Optional[Dict[str, Any]]:
+    try:
+        with Image.open(io.BytesIO(data)) as im:
+            w, h = im.size
+            fmt = im.format
+            orientation = None
+            if fmt != "PNG":  # eXIf у PNG может идти после IDAT
+                try:
+                    orientation = im.getexif().get(0x0112)
+                except Exception:
+                    pass
+    except Exception:
+        return None
+    return {"width": int(w), "height": int(h), "image_format": (fmt or "").lower() or None,
+            "orientation": int(orientation) if orientation else None}
 
-    print(f"[worker] frame {frame_id}: uploaded {len(outputs)} outputs to S3")
-    # уведомляем API о завершении генерации
+
+def _frame_meta_extract(item) -> Optional[Dict[str, Any]]:
+    fid, key = item
     try:
-        with httpx.Client(timeout=60) as c:
-            c.post(
-                f"{API_BASE_URL}/internal/generation/{generation_id}/complete",
-                json={"outputs": outputs},
-            )
+        n = FRAME_META_HEAD_BYTES
+        while True:
+            resp = s3_client().get_object(Bucket=S3_BUCKET, Key=key, Range=f"bytes=0-{n - 1}")
+            data = resp["Body"].read()
+            info = _frame_meta_parse(data)
+            if info is not None or len(data) < n or n >= FRAME_META_MAX_BYTES:
+                break
+            n = min(n * 2, FRAME_META_MAX_BYTES)
+        cr = resp.get("ContentRange") or ""
+        total = int(cr.rsplit("/", 1)[1]) if "/" in cr and cr.rsplit("/", 1)[1].isdigit() else resp.get("ContentLength")
+        meta = {"frame_id": int(fid), "byte_size": total, "content_hash": (resp.get("ETag") or "").strip('"') or None}
+        meta.update(info or {})
+        return meta
     except Exception as e:
-        print(f"[worker] failed to notify completion gen={generation_id}: {e}")
+        print(f"[worker] frame meta {fid} ({key}): {e}")
+        return None
+
+
+@celery.task(name="worker.extract_frame_meta")
+def extract_frame_meta(items: List[List[Any]]):
+    """[[frame_id, original_key]] -> заголовки из S3 -> одним POST /internal/frames/meta."""
+    with ThreadPoolExecutor(max_workers=FRAME_META_CONCURRENCY, thread_name_prefix="frame-meta") as pool:
+        metas = [m for m in pool.map(_frame_meta_extract, [tuple(it) for it in items if it[1]]) if m]
+    if not metas:
+        return
+    with httpx.Client(timeout=60) as c:
+        r = c.post(f"{API_BASE_URL}/internal/frames/meta", json={"items": metas})
+        r.raise_for_status()
+    print(f"[worker] frame meta: {len(metas)}/{len(items)} frames")